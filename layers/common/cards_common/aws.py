@@ -0,0 +1,62 @@
+import os
+from typing import Any, Callable
+
+# build clients at import instead, for containers where init time is free
+# (provisioned concurrency) so the first request does not pay for them
+EAGER_INIT = os.environ.get('EAGER_INIT', '').lower() in ['1', 'true', 'yes']
+
+LOCAL_DYNAMO = 'http://localhost:8000/'
+
+
+class Lazy(object):
+    '''Stands in for an object that is only built the first time it is used
+
+    Attribute access is forwarded to the built object. Attributes set on the
+    stand in itself (e.g. by unittest.mock.patch.object) take precedence.
+    '''
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._target = None
+
+        if EAGER_INIT:
+            self.resolve()
+
+    def resolve(self) -> Any:
+
+        if self._target is None:
+            self._target = self._factory()
+
+        return self._target
+
+    @property
+    def resolved(self) -> bool:
+        return self._target is not None
+
+    def __getattr__(self, name: str):
+
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return getattr(self.resolve(), name)
+
+
+def dynamo_endpoint() -> dict:
+    '''Local dynamo unless running in a deployed environment'''
+
+    return {} if 'ENV' in os.environ else {'endpoint_url': LOCAL_DYNAMO}
+
+
+def dynamo_resource():
+    import boto3
+    return boto3.resource('dynamodb', **dynamo_endpoint())
+
+
+def dynamo_client():
+    import boto3
+    return boto3.client('dynamodb', **dynamo_endpoint())
+
+
+def gateway_client(endpoint_url: str):
+    import boto3
+    return boto3.client('apigatewaymanagementapi', endpoint_url=endpoint_url)
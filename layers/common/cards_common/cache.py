@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache(object):
+    '''Bounded LRU for warm containers where entries also expire after ttl seconds
+
+    A ttl of None keeps entries until they are evicted, and a max_size of 0
+    disables the cache. An entry can be given its own expiry time instead,
+    e.g. a token cached until its exp.
+    '''
+
+    def __init__(self, max_size: int = 256, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+
+        entry = self._entries.get(key, None)
+
+        if entry is None:
+            return default
+
+        expires, value = entry
+
+        if expires is not None and time.time() > expires:
+            del self._entries[key]
+            return default
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any, expires_at: float = None):
+
+        if not self.max_size:
+            return
+
+        now = time.time()
+
+        if expires_at is not None:
+            if now > expires_at:
+                return
+            expires = expires_at
+        else:
+            expires = now + self.ttl if self.ttl is not None else None
+
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
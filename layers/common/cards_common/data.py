@@ -0,0 +1,119 @@
+import time
+import random
+from typing import List, Iterator
+from dataclasses import dataclass
+
+# retries of keys a batch read left unprocessed, backing off between each
+BATCH_GET_ATTEMPTS = 6
+BATCH_GET_BASE_DELAY = 0.05
+BATCH_GET_MAX_DELAY = 1.0
+
+
+class UnprocessedKeysError(Exception):
+    '''Keys were still unprocessed after every retry, e.g. the table is throttled'''
+
+
+def projection(*fields: str) -> dict:
+    '''Read arguments limiting the returned item to the given top level attributes
+
+    Every name is aliased so reserved words such as name and version can be
+    used. Call sites declare the fields they use, e.g.
+
+        USER_FIELDS = projection('in_game', 'game_id')
+        db.get_item(Key=key, **USER_FIELDS)
+    '''
+
+    return {
+        'ProjectionExpression': ', '.join(f'#{f}' for f in fields),
+        'ExpressionAttributeNames': {f'#{f}': f for f in fields},
+    }
+
+
+def batch_get_items(db_resource, table: str, keys: List[dict], fields: dict = None) -> List[dict]:
+    '''Items for the keys with BatchGetItem, in no particular order
+
+    Keys dynamo could not process in one pass are requested again after an
+    exponential, jittered backoff, raising UnprocessedKeysError once the
+    attempts run out. Keys with no item are left out. At most 100 keys can be
+    read per call.
+    '''
+
+    if not keys:
+        return []
+
+    items = []
+    request = {
+        table: {
+            'Keys': keys,
+            **(fields or {})
+        }
+    }
+
+    for attempt in range(BATCH_GET_ATTEMPTS):
+
+        if attempt:
+            delay = min(BATCH_GET_MAX_DELAY, BATCH_GET_BASE_DELAY * 2 ** (attempt - 1))
+            time.sleep(random.uniform(delay / 2, delay))
+
+        response = db_resource.batch_get_item(RequestItems=request)
+        items += response['Responses'].get(table, [])
+        request = response.get('UnprocessedKeys', None)
+
+        if not request:
+            return items
+
+    raise UnprocessedKeysError(f'{len(request[table]["Keys"])} keys unprocessed after {BATCH_GET_ATTEMPTS} attempts')
+
+
+@dataclass
+class Capacity:
+    '''Read capacity consumed by the pages of a query'''
+
+    units: float = 0
+    pages: int = 0
+
+    def add(self, consumed: dict = None):
+        self.pages += 1
+        self.units += float((consumed or {}).get('CapacityUnits', 0))
+
+
+def query_items(table, limit: int = None, page_size: int = None, capacity: Capacity = None, **query) -> Iterator[dict]:
+    '''Items matching the query, read a page at a time as they are consumed
+
+    Follows LastEvaluatedKey so results are not cut off at 1 MB, and stops
+    reading once limit items are yielded or the caller stops iterating, e.g.
+
+        for connection in query_items(db, KeyConditionExpression=..., page_size=100):
+            ...
+
+    Pass a Capacity to count the read units every page consumed.
+    '''
+
+    query = dict(query)
+
+    if page_size or limit:
+        query['Limit'] = page_size or limit
+
+    if capacity is not None:
+        query['ReturnConsumedCapacity'] = 'TOTAL'
+
+    remaining = limit
+
+    while True:
+
+        response = table.query(**query)
+
+        if capacity is not None:
+            capacity.add(response.get('ConsumedCapacity', None))
+
+        for item in response.get('Items', []):
+            yield item
+            if remaining is not None:
+                remaining -= 1
+                if remaining <= 0:
+                    return
+
+        if 'LastEvaluatedKey' not in response:
+            return
+
+        query['ExclusiveStartKey'] = response['LastEvaluatedKey']
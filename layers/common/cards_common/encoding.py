@@ -0,0 +1,68 @@
+'''JSON for API responses and websocket frames
+
+Dynamo returns numbers as Decimal and sets as set, which json cannot write.
+They are converted by dynamo_default as the encoder meets them, in the same
+pass that writes everything else. orjson is used when it is installed (add
+it to layers/common/requirements.txt), falling back to the standard library
+with a single reused encoder.
+'''
+import json
+from decimal import Decimal
+from typing import Any
+
+from cards_common.timing import span
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional backend
+    orjson = None
+
+
+def dynamo_default(value: Any) -> Any:
+    '''Decimals as int where whole, else float, and sets as lists'''
+
+    if type(value) is Decimal:
+        whole = int(value)
+        return whole if whole == value else float(value)
+
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+# building an encoder per call costs as much as encoding a small body
+_encoder = json.JSONEncoder(default=dynamo_default, separators=(',', ':'))
+
+
+def dumps_bytes(value: Any) -> bytes:
+    '''UTF-8 JSON, as posted to websocket connections'''
+
+    if orjson is not None:
+        return orjson.dumps(value, default=dynamo_default, option=orjson.OPT_NON_STR_KEYS)
+
+    return _encoder.encode(value).encode('utf-8')
+
+
+def dumps(value: Any) -> str:
+
+    if orjson is not None:
+        return orjson.dumps(value, default=dynamo_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    return _encoder.encode(value)
+
+
+def make_response(code: int, body: dict = {}, headers: dict = None) -> dict:
+    '''Generates HTTP response expected by API gateway'''
+
+    with span('serialise'):
+        body = dumps(body)
+
+    return {
+        'statusCode': code,
+        'headers': {
+                'Access-Control-Allow-Origin': '*',
+                **(headers or {})
+        },
+        'body': body
+    }
@@ -0,0 +1,60 @@
+import hashlib
+from http import HTTPStatus as s
+
+
+def make_etag(*parts) -> str:
+    '''Weak ETag from the ids and versions a response was built from'''
+
+    digest = hashlib.sha1(':'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+
+def get_header(event: dict, name: str) -> str:
+    '''Header value from an API gateway event, ignoring the header's case'''
+
+    name = name.lower()
+
+    for key, value in (event.get('headers', None) or {}).items():
+        if key.lower() == name:
+            return value
+
+    return None
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    '''Weak comparison of an If-None-Match header against the current ETag'''
+
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == '*':
+        return True
+
+    opaque = etag[2:] if etag.startswith('W/') else etag
+
+    return any(
+        (tag[2:] if tag.startswith('W/') else tag) == opaque
+        for tag in (t.strip() for t in if_none_match.split(','))
+    )
+
+
+def etag_headers(etag: str) -> dict:
+    '''Response headers carrying the ETag, readable by browser clients'''
+
+    return {
+        'ETag': etag,
+        'Access-Control-Expose-Headers': 'ETag',
+    }
+
+
+def not_modified(etag: str) -> dict:
+    '''Empty 304 response for API gateway'''
+
+    return {
+        'statusCode': s.NOT_MODIFIED,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            **etag_headers(etag),
+        },
+        'body': '',
+    }
@@ -0,0 +1,140 @@
+import os
+import json
+import random
+import logging
+from typing import Any
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+MAX_STRING = 80
+MAX_ITEMS = 8
+
+
+def parse_rates(spec: str) -> dict:
+    '''Sample rates from e.g. "GET /games=0.1,sendmessage=1,*=0.01"'''
+
+    rates = {}
+
+    for part in (spec or '').split(','):
+        route, _, rate = part.rpartition('=')
+        if route.strip():
+            rates[route.strip()] = float(rate)
+
+    return rates
+
+
+# fraction of requests per route whose full event is logged
+EVENT_SAMPLE_RATES = parse_rates(os.environ.get('LOG_EVENT_SAMPLE', ''))
+
+
+def get_logger() -> logging.Logger:
+    '''Root logger at LOG_LEVEL, as the Lambda runtime attaches its handler there'''
+
+    log = logging.getLogger()
+    log.setLevel(LOG_LEVEL)
+    return log
+
+
+def summarise(value: Any, depth: int = 2) -> Any:
+    '''Small stand in for a payload: long strings cut, collections sized'''
+
+    if isinstance(value, str):
+        return value if len(value) <= MAX_STRING else f'{value[:MAX_STRING]}...<{len(value)} chars>'
+
+    if isinstance(value, dict):
+        if depth <= 0:
+            return f'<dict {len(value)} keys>'
+        summary = {k: summarise(v, depth - 1) for k, v in list(value.items())[:MAX_ITEMS]}
+        if len(value) > MAX_ITEMS:
+            summary['...'] = f'<{len(value) - MAX_ITEMS} more keys>'
+        return summary
+
+    if isinstance(value, (list, tuple, set)):
+        return f'<{type(value).__name__} {len(value)} items>'
+
+    return value
+
+
+class Fields(object):
+    '''A structured log message, only formatted if a handler emits it
+
+    Pass as the message so logging defers the JSON work until the level
+    check has passed, e.g. log.debug(Fields('state loaded', state=state)).
+    Values are summarised when formatted unless full is set.
+    '''
+
+    __slots__ = ['message', 'fields', 'full']
+
+    def __init__(self, message: str, full: bool = False, **fields):
+        self.message = message
+        self.fields = fields
+        self.full = full
+
+    def __str__(self):
+
+        fields = self.fields if self.full else {k: summarise(v) for k, v in self.fields.items()}
+        return json.dumps({'message': self.message, **fields}, default=str, separators=(',', ':'))
+
+
+def route_key(event: dict) -> str:
+    '''Route of an invocation for sampling: "METHOD /resource", a socket route or "stream"'''
+
+    if 'Records' in event:
+        return 'stream'
+
+    if 'httpMethod' in event:
+        return f'{event["httpMethod"]} {event.get("resource", event.get("path", ""))}'
+
+    context = event.get('requestContext', None) or {}
+    return context.get('routeKey', None) or context.get('eventType', None) or 'unknown'
+
+
+def event_summary(event: dict) -> dict:
+    '''The parts of an event worth logging on every request'''
+
+    if 'Records' in event:
+        names = {}
+        for record in event['Records']:
+            name = record.get('eventName', 'unknown')
+            names[name] = names.get(name, 0) + 1
+        return {'route': 'stream', 'records': len(event['Records']), 'events': names}
+
+    context = event.get('requestContext', None) or {}
+    body = event.get('body', None)
+
+    summary = {
+        'route': route_key(event),
+        'request_id': context.get('requestId', None),
+        'body_bytes': len(body) if body else 0,
+    }
+
+    if 'httpMethod' in event:
+        summary['path'] = event.get('path', None)
+    else:
+        summary['connection_id'] = context.get('connectionId', None)
+
+    return summary
+
+
+def sampled(route: str) -> bool:
+
+    rate = EVENT_SAMPLE_RATES.get(route, EVENT_SAMPLE_RATES.get('*', 0))
+    return rate > 0 and random.random() < rate
+
+
+def log_event(log: logging.Logger, event: dict):
+    '''Logs a summary of the incoming event, and the full event when debugging
+
+    Full events are logged at DEBUG, or at INFO for the sampled share of a
+    route's requests set in LOG_EVENT_SAMPLE.
+    '''
+
+    if not log.isEnabledFor(logging.INFO):
+        return
+
+    log.info(Fields('request', **event_summary(event)))
+
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(Fields('event', full=True, event=event))
+    elif sampled(route_key(event)):
+        log.info(Fields('event', full=True, sampled=True, event=event))
@@ -0,0 +1,115 @@
+import time
+from decimal import Decimal
+from dataclasses import dataclass
+
+from botocore.exceptions import ClientError
+
+from cards_common.cache import TTLCache
+
+
+@dataclass
+class TokenBucket:
+    '''Holds up to burst tokens, refilled at rate tokens per second'''
+
+    rate: float
+    burst: float
+    tokens: float = None
+    updated: float = None
+
+    def __post_init__(self):
+        self.tokens = self.burst if self.tokens is None else self.tokens
+
+    def take(self, now: float, cost: float = 1) -> bool:
+
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+
+        self.updated = now
+
+        if self.tokens < cost:
+            return False
+
+        self.tokens -= cost
+        return True
+
+
+class RateLimiter(object):
+    '''Token bucket per key, e.g. per websocket connection
+
+    Buckets are kept in memory, so each warm container limits the keys it
+    sees. With a table, the bucket is kept in dynamo instead so every
+    container shares it. The table holds one timestamp per key: the time the
+    bucket will next be full (the generic cell rate algorithm, which admits
+    exactly what a token bucket does). Checking and spending a token is a
+    single conditional write, so the limit never costs a read.
+
+    Those writes are on the stream like any other, under the prefix, so the
+    stream consumers' filters leave them out.
+    '''
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 1024, table=None, prefix: str = 'RATE#'):
+        self.rate = rate
+        self.burst = burst
+        self.table = table
+        self.prefix = prefix
+        # a bucket left alone this long is full again, the same as a new one
+        self.buckets = TTLCache(max_size=max_keys, ttl=burst / rate)
+
+    def allow(self, key: str) -> bool:
+
+        if self.table is not None:
+            return self._allow_persisted(key)
+
+        bucket = self.buckets.get(key, None)
+
+        if bucket is None:
+            bucket = TokenBucket(rate=self.rate, burst=self.burst)
+
+        allowed = bucket.take(time.time())
+        self.buckets.put(key, bucket)
+
+        return allowed
+
+    def _allow_persisted(self, key: str) -> bool:
+
+        now = time.time()
+        interval = 1 / self.rate
+        # the bucket is empty once full_at is burst intervals away
+        limit = now + (self.burst - 1) * interval
+
+        item_key = {'pk': f'{self.prefix}{key}', 'sk': 'LIMIT'}
+        expires_at = int(now + self.burst * interval) + 1
+
+        updates = [
+            # new or full bucket, the usual case - spend the first
+            {
+                'UpdateExpression': 'SET full_at = :next, expires_at = :e',
+                'ConditionExpression': 'attribute_not_exists(full_at) OR full_at < :now',
+                'ExpressionAttributeValues': {
+                    ':next': Decimal(str(now + interval)),
+                    ':now': Decimal(str(now)),
+                    ':e': expires_at,
+                },
+            },
+            # tokens left - spend one
+            {
+                'UpdateExpression': 'SET full_at = full_at + :i, expires_at = :e',
+                'ConditionExpression': 'full_at BETWEEN :now AND :limit',
+                'ExpressionAttributeValues': {
+                    ':i': Decimal(str(interval)),
+                    ':now': Decimal(str(now)),
+                    ':limit': Decimal(str(limit)),
+                    ':e': expires_at,
+                },
+            },
+        ]
+
+        for update in updates:
+            try:
+                self.table.update_item(Key=item_key, **update)
+                return True
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+
+        return False
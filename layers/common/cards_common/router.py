@@ -0,0 +1,97 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+
+# path parameters as written in the API definition e.g. /games/{game_id}/players
+PARAM = re.compile(r'{(\w+)}')
+SEGMENT = '[A-Za-z0-9-]+'
+
+
+def compile_path(path: str):
+    '''Regex for a templated path, or None if the path has no parameters'''
+
+    if not PARAM.search(path):
+        return None
+
+    parts = PARAM.split(path)
+    pattern = ''.join(
+        f'(?P<{part}>{SEGMENT})' if i % 2 else re.escape(part)
+        for i, part in enumerate(parts)
+    )
+
+    return re.compile(pattern)
+
+
+@dataclass
+class Route:
+    method: str = None
+    path: str = None
+    function: Callable = None
+    # names of the arguments to pass, resolved only once the route matches
+    args: Tuple[str, ...] = ()
+    pattern: Any = None
+
+    def __post_init__(self):
+        self.pattern = compile_path(self.path)
+
+
+@dataclass
+class Match:
+    route: Route = None
+    params: Dict[str, str] = field(default_factory=dict)
+
+    def call(self, **sources: Callable[[], Any]):
+        '''Calls the route function with its arguments
+
+        Each argument is taken from the path parameters if present, otherwise
+        from the source of the same name, which is only called here so work
+        for arguments of other routes is never done.
+        '''
+
+        args = [
+            self.params[name] if name in self.params else sources[name]()
+            for name in self.route.args
+        ]
+
+        return self.route.function(*args)
+
+
+class Router(object):
+    '''Routes REST requests by method and then path
+
+    Paths are compiled once when routes are added. Fixed paths are looked up
+    directly and only templated paths for the request method are matched.
+    '''
+
+    def __init__(self, routes: List[Route] = None):
+        self._static = {}
+        self._templated = {}
+
+        for route in routes or []:
+            self.add(route)
+
+    def add(self, route: Route):
+
+        if route.pattern is None:
+            self._static.setdefault(route.method, {})[route.path] = route
+        else:
+            self._templated.setdefault(route.method, []).append(route)
+
+    def match(self, method: str, path: str, path_parameters: dict = None) -> Optional[Match]:
+        '''Finds the route for a request
+
+        Path parameters already parsed by API gateway take precedence over
+        those read from the path.
+        '''
+
+        route = self._static.get(method, {}).get(path, None)
+
+        if route:
+            return Match(route=route, params=dict(path_parameters or {}))
+
+        for route in self._templated.get(method, []):
+            found = route.pattern.fullmatch(path)
+            if found:
+                return Match(route=route, params={**found.groupdict(), **(path_parameters or {})})
+
+        return None
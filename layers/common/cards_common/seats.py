@@ -0,0 +1,32 @@
+'''Who sits at a game's table, in seat order
+
+The meta service seats players and bots, and the shd service deals to them in
+the same order when the game starts, so both read the seats from here.
+'''
+from typing import List
+
+# bots are seated under ids no cognito user can have, the shd service plays them
+BOT_PREFIX = 'bot-'
+
+
+def is_bot(player_id: str) -> bool:
+    return player_id.startswith(BOT_PREFIX)
+
+
+def seat_order(players, players_joined: int = None) -> List[str]:
+    '''Player ids in the order they joined, then the bots filling the table
+
+    Maps are unordered in dynamo so seats are ordered by join time, with the id
+    breaking ties. Games stored before players became a map hold a list.
+    Seats counted in players_joined beyond the players are bots, which are
+    only counted so a table can be filled without reading its players first.
+    '''
+
+    if isinstance(players, dict):
+        seats = [k for k, _ in sorted(players.items(), key=lambda p: (p[1], p[0]))]
+    else:
+        seats = list(players or [])
+
+    bots = int(players_joined) - len(seats) if players_joined is not None else 0
+
+    return seats + [f'{BOT_PREFIX}{i + 1}' for i in range(max(bots, 0))]
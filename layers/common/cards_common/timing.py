@@ -0,0 +1,94 @@
+import time
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+
+from cards_common.log import get_logger, Fields
+
+log = get_logger()
+
+_current = ContextVar('timer', default=None)
+
+
+class Timer(object):
+    '''Wall time per phase of one invocation, in milliseconds
+
+    Spans of the same name add up, and a span may run inside another (e.g.
+    serialise within apply), so spans need not sum to the total.
+    '''
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.fields = {}
+
+    @contextmanager
+    def span(self, name: str):
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.spans[name] = self.spans.get(name, 0) + elapsed
+
+    def tag(self, **fields):
+        self.fields.update(fields)
+
+    def record(self) -> dict:
+
+        return {
+            'handler': self.handler,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'spans': {k: round(v, 3) for k, v in self.spans.items()},
+            **self.fields,
+        }
+
+
+@contextmanager
+def _no_span():
+    yield
+
+
+def span(name: str):
+    '''Times a phase of the current invocation, doing nothing outside one'''
+
+    timer = _current.get()
+    return timer.span(name) if timer else _no_span()
+
+
+def tag(**fields):
+    '''Adds fields such as the action type to the current invocation's record'''
+
+    timer = _current.get()
+
+    if timer:
+        timer.tag(**fields)
+
+
+def timed(handler: str) -> Callable:
+    '''Times a lambda handler and logs one record of its spans when it returns'''
+
+    def decorator(fn: Callable) -> Callable:
+
+        @functools.wraps(fn)
+        def wrapper(event, context):
+
+            timer = Timer(handler)
+            token = _current.set(timer)
+
+            try:
+                response = fn(event, context)
+                if isinstance(response, dict) and 'statusCode' in response:
+                    timer.tag(status=int(response['statusCode']))
+                return response
+            finally:
+                _current.reset(token)
+                log.info(Fields('timing', full=True, **timer.record()))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,76 @@
+'''What each person looking at a game may see of its state
+
+The shd engine stores the whole state, hands and hidden cards included. These
+build the public view (sent to everyone at the table and the audience) and
+each player's own view from the stored state, as plain dicts, so the engine,
+the stream processor and the game route all hide the same things.
+'''
+from typing import Dict, Tuple
+
+STATE_SK = 'STATE#SHD'
+SANITISED_SK = 'SANITISED#SHD'
+PLAYER_PREFIX = 'PLAYER#'
+
+# counts every change to what a game's players can see, so a poll reads one small item
+VERSION_SK = 'VERSION'
+
+# only ever shown to the player themselves
+PRIVATE_PLAYER_FIELDS = ('can_burn', 'can_play')
+
+
+def hidden_card(card: dict) -> dict:
+    return {
+        'id': card['id'],
+        'is_hidden': card.get('is_hidden', None),
+        'order': card.get('order', None),
+    }
+
+
+def player_view(player: dict) -> dict:
+    '''The player's own cards, except the ones face down'''
+
+    return {
+        **player,
+        'hidden': [hidden_card(c) for c in player['hidden']],
+    }
+
+
+def public_player(player: dict) -> dict:
+    '''A player as the rest of the table sees them, with their hand counted'''
+
+    public = {k: v for k, v in player.items() if k not in PRIVATE_PLAYER_FIELDS}
+    public['hand'] = len(player['hand'])
+    public['hidden'] = [hidden_card(c) for c in player['hidden']]
+    return public
+
+
+def sanitised_state(state: dict) -> dict:
+
+    return {
+        **state,
+        'stack': len(state['stack']),
+        'dead': len(state['dead']),
+        'players': [public_player(p) for p in state['players']],
+    }
+
+
+def game_views(item: dict) -> Tuple[dict, Dict[str, dict]]:
+    '''Public view and each player's view of a stored state item
+
+    Keyed and versioned like the items the shd service writes when it does
+    not leave the views to the stream.
+    '''
+
+    pk = item['pk']
+    version = item.get('version', None)
+
+    state = sanitised_state(item['state'])
+    state.update(pk=pk, sk=SANITISED_SK, version=version)
+
+    players = {}
+    for player in item['state']['players']:
+        view = player_view(player)
+        view.update(pk=pk, sk=f'{PLAYER_PREFIX}{player["id"]}', version=version)
+        players[player['id']] = view
+
+    return state, players
@@ -1,13 +1,10 @@
 import os
-import boto3
 
-if 'ENV' not in os.environ:
-    # running locally
-    db_resource = boto3.resource('dynamodb', endpoint_url='http://localhost:8000/')
-    db_client = boto3.client('dynamodb', endpoint_url='http://localhost:8000/')
-else:
-    db_resource = boto3.resource('dynamodb')
-    db_client = boto3.client('dynamodb')
+from cards_common.aws import Lazy, dynamo_resource, dynamo_client
+
+# built on first use so a cold start only pays for the clients a request needs
+db_resource = Lazy(dynamo_resource)
+db_client = Lazy(dynamo_client)
 
 table = os.environ.get('TABLE_NAME', 'cards-app-table')
-db = db_resource.Table(table)
\ No newline at end of file
+db = Lazy(lambda: db_resource.Table(table))
@@ -6,6 +6,8 @@ serializer = TypeSerializer()
 @dataclass
 class UserGameConnection:
 
+    PREFIX = 'CONN#'
+
     pk: str = None
     sk: str = None
     connection_id: str = None
@@ -17,7 +19,10 @@ class UserGameConnection:
         if not self.pk:
             self.pk = f'GAME#{self.game_id}'
         if not self.sk:
-            self.sk = f'CONN#{self.connection_id}'
+            self.sk = f'{self.PREFIX}{self.user_id}'
+
+    def get_key(self) -> dict:
+        return UserGameConnection.make_key(self.game_id, self.user_id)
 
     def to_dict(self):
         return {
@@ -30,4 +35,23 @@ class UserGameConnection:
         return {
             k: serializer.serialize(v)
             for k, v in self.__dict__.items()
-        }
\ No newline at end of file
+        }
+
+    @classmethod
+    def make_key(cls, game_id, user_id):
+        '''Connections are keyed by user so a reconnect replaces the old session'''
+        return {
+            'pk': f'GAME#{game_id}',
+            'sk': f'{cls.PREFIX}{user_id}'
+        }
+
+
+@dataclass
+class SpectatorConnection(UserGameConnection):
+    '''Connection of a user watching a game, sent the sanitised view only
+
+    Sorts after every other item in the game partition (VIEW# > STATE#), so
+    the game's own reads can stop short of its audience.
+    '''
+
+    PREFIX = 'VIEW#'
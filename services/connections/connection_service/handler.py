@@ -1,56 +1,199 @@
-import json
 import time
-import logging
 from dataclasses import asdict
 from http import HTTPStatus as s
 
-from jose import JWTError
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key, Attr
 
-from connection_service.token import validate_and_decode
-from connection_service.manager import process_stream
+from cards_common.data import projection
+from cards_common.encoding import make_response
+from cards_common.log import get_logger, log_event, Fields
+from cards_common.timing import timed, span, tag
 
-from . import db
-from connection_service.entities import UserGameConnection
+from connection_service.manager import process_stream, disconnect
 
-log = logging.getLogger()
-log.setLevel(logging.INFO)
+from . import db, db_client, table
+from connection_service.entities import UserGameConnection, SpectatorConnection, serializer
 
-def make_response(code: s, body: dict = {}) -> dict:
-    '''Generates HTTP response expected by API gateway'''
+log = get_logger()
 
-    return {
-        'statusCode': code,
-        'headers': {
-                'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps(body)
-    }
+USER_FIELDS = projection('in_game', 'game_id', 'queue_pk')
+
+
+def validate_and_decode(token: str) -> dict:
+    '''Claims of a valid token, else None
+
+    Imported here as jose and its crypto backend are only needed on connect,
+    not for the stream records most invocations carry.
+    '''
+
+    from jose import JWTError
+    from connection_service import token as token_validation
+
+    try:
+        return token_validation.validate_and_decode(token)
+    except JWTError as e:
+        log.error('Token could not be decoded: %s', e)
+        return None
 
 
 def validation_failed_response():
     return make_response(s.UNAUTHORIZED, {'message': 'Token validation failed'})
 
 
+def connect_to_game(user_id: str, game_id: str, connection_id: str) -> dict:
+    '''Stores the connection in a single transaction when the client names its game
+
+    The user item is only condition checked, and the connection is keyed by user
+    so the put replaces any stale session without a query or deletes.
+    '''
+
+    log.info('Connecting user %s to game %s with connection ID %s', user_id, game_id, connection_id)
+
+    game_connection = UserGameConnection(
+        connection_id=connection_id,
+        game_id=game_id,
+        user_id=user_id,
+        connected_at=int(time.time()),
+    )
+
+    try:
+        with span('persist'):
+            db_client.transact_write_items(
+                TransactItems=[
+                    {
+                        'ConditionCheck': {
+                            'TableName': table,
+                            'Key': {
+                                'pk': serializer.serialize(f'USER#{user_id}'),
+                                'sk': serializer.serialize('ENTITY'),
+                            },
+                            'ConditionExpression': 'in_game = :g AND game_id = :gid',
+                            'ExpressionAttributeValues': {
+                                ':g': serializer.serialize(True),
+                                ':gid': serializer.serialize(game_id),
+                            }
+                        }
+                    },
+                    {
+                        'Put': {
+                            'TableName': table,
+                            'Item': game_connection.to_dynamo(),
+                            'ConditionExpression': 'attribute_not_exists(pk) OR connected_at <= :t',
+                            'ExpressionAttributeValues': {
+                                ':t': serializer.serialize(game_connection.connected_at),
+                            }
+                        }
+                    }
+                ]
+            )
+    except db_client.exceptions.TransactionCanceledException as e:
+        reasons = e.response.get('CancellationReasons', [])
+        log.error('Could not connect user %s to game %s: %s', user_id, game_id, reasons)
+        if reasons and reasons[0].get('Code') == 'ConditionalCheckFailed':
+            return make_response(s.CONFLICT, {'message': 'Cannot connect socket - user not in game'})
+        return make_response(s.CONFLICT, {'message': 'A newer connection exists for this user'})
+
+    return make_response(s.OK, {'message': 'Connected'})
+
+
+def connect_as_spectator(user_id: str, game_id: str, connection_id: str) -> dict:
+    '''Stores a spectator's connection, if the game exists and is public'''
+
+    log.info('Connecting user %s to watch game %s with connection ID %s', user_id, game_id, connection_id)
+
+    spectator_connection = SpectatorConnection(
+        connection_id=connection_id,
+        game_id=game_id,
+        user_id=user_id,
+        connected_at=int(time.time()),
+    )
+
+    try:
+        with span('persist'):
+            db_client.transact_write_items(
+                TransactItems=[
+                    {
+                        'ConditionCheck': {
+                            'TableName': table,
+                            'Key': {
+                                'pk': serializer.serialize(f'GAME#{game_id}'),
+                                'sk': serializer.serialize('META'),
+                            },
+                            'ConditionExpression': 'attribute_exists(pk) AND #private = :f',
+                            'ExpressionAttributeNames': {
+                                '#private': 'private',
+                            },
+                            'ExpressionAttributeValues': {
+                                ':f': serializer.serialize(False),
+                            }
+                        }
+                    },
+                    {
+                        'Put': {
+                            'TableName': table,
+                            'Item': spectator_connection.to_dynamo(),
+                            'ConditionExpression': 'attribute_not_exists(pk) OR connected_at <= :t',
+                            'ExpressionAttributeValues': {
+                                ':t': serializer.serialize(spectator_connection.connected_at),
+                            }
+                        }
+                    }
+                ]
+            )
+    except db_client.exceptions.TransactionCanceledException as e:
+        reasons = e.response.get('CancellationReasons', [])
+        log.error('Could not connect user %s to watch game %s: %s', user_id, game_id, reasons)
+        if reasons and reasons[0].get('Code') == 'ConditionalCheckFailed':
+            return make_response(s.NOT_FOUND, {'message': 'No public game to watch'})
+        return make_response(s.CONFLICT, {'message': 'A newer connection exists for this user'})
+
+    return make_response(s.OK, {'message': 'Connected'})
+
+
+def connect_to_queue(user_id: str, queue_pk: str, connection_id: str) -> dict:
+    '''Stores the connection of a queued user so the matcher can tell them about their game'''
+
+    log.info('Connecting user %s to queue %s with connection ID %s', user_id, queue_pk, connection_id)
+
+    queue_connection = UserGameConnection(
+        pk=queue_pk,
+        connection_id=connection_id,
+        user_id=user_id,
+        connected_at=int(time.time()),
+    )
+
+    with span('persist'):
+        db.put_item(Item=asdict(queue_connection))
+
+    return make_response(s.OK, {'message': 'Connected'})
+
+
+@timed('connections')
 def handle(event, context):
 
-    log.info(event)
+    log_event(log, event)
 
     if 'Records' in event:
+        tag(action='STREAM', records=len(event['Records']))
         try:
             n_records = process_stream(event['Records'])
         except Exception as e:
-            log.error(f'Could not process stream due to exception {e}')
+            log.error('Could not process stream due to exception %s', e)
             return make_response(500, {'message': 'Could not process stream'})
             
         return make_response(200, {'message': f'Processed {n_records} records'})
 
-    connection_id = event["requestContext"].get("connectionId", None)
-    token = event.get("queryStringParameters", {}).get("token", None)
+    with span('parse'):
+        connection_id = event["requestContext"].get("connectionId", None)
+        params = event.get("queryStringParameters", None) or {}
+        token = params.get("token", None)
+        game_id = params.get("gameId", None)
+        spectate = params.get("spectate", "").lower() in ['1', 'true', 'yes']
+
+    tag(action=event["requestContext"].get("eventType", None))
 
     if not connection_id:
-        log.error(f'No connection ID provided')
+        log.error('No connection ID provided')
         return make_response(s.BAD_REQUEST, {'message': 'No connection ID provided'})
 
     if event["requestContext"]["eventType"] == "CONNECT":
@@ -61,15 +204,13 @@ def handle(event, context):
 
         log.info('Validating token and retrieving user')
 
-        try:
+        with span('auth'):
             claims = validate_and_decode(token)
-        except JWTError:
-            return validation_failed_response()
 
         if not claims:
             return validation_failed_response()
 
-        log.info(f'Token valid - claims: {claims}')
+        log.debug(Fields('token valid', claims=claims))
 
         user_id = claims.get('sub', None)
 
@@ -77,32 +218,31 @@ def handle(event, context):
             log.error('Could not get user ID from claims')
             return validation_failed_response()
 
-        user = db.get_item(
-            Key={
-                'pk': f'USER#{user_id}',
-                'sk': f'ENTITY'
-            }
-        ).get('Item', None)
-
-        if not user:
-            return make_response(s.NOT_FOUND, {'message': 'Could not find user'})
+        if game_id and spectate:
+            return connect_as_spectator(user_id, game_id, connection_id)
 
-        if not user.get('in_game', False) or not user.get('game_id', False):
-            return make_response(s.CONFLICT, {'message', 'Cannot connect socket - user not in game'})
+        if game_id:
+            return connect_to_game(user_id, game_id, connection_id)
 
-        log.info('Checking for existing connections')
+        with span('load'):
+            user = db.get_item(
+                Key={
+                    'pk': f'USER#{user_id}',
+                    'sk': f'ENTITY'
+                },
+                **USER_FIELDS
+            ).get('Item', None)
 
-        stale_connections = db.query(
-            KeyConditionExpression=Key('pk').eq(f'GAME#{user["game_id"]}') & Key('sk').begins_with('CONN#'),
-            FilterExpression=Attr('user_id').eq(user_id)
-        )['Items']
+        if not user:
+            return make_response(s.NOT_FOUND, {'message': 'Could not find user'})
 
-        for conn in stale_connections:
-            db.delete_item(Key={'pk': conn['pk'], 'sk': conn['sk']})
+        if user.get('queue_pk', None) and not user.get('in_game', False):
+            return connect_to_queue(user_id, user['queue_pk'], connection_id)
 
-        log.info(f'Removed {len(stale_connections)} connections')
+        if not user.get('in_game', False) or not user.get('game_id', False):
+            return make_response(s.CONFLICT, {'message': 'Cannot connect socket - user not in game'})
 
-        log.info(f'Connecting user {user_id} to game {user["game_id"]} with connection ID {connection_id}')
+        log.info('Connecting user %s to game %s with connection ID %s', user_id, user["game_id"], connection_id)
 
         game_connection = UserGameConnection(
             connection_id=connection_id,
@@ -111,24 +251,30 @@ def handle(event, context):
             connected_at=int(time.time()),
         )
 
-        log.info(f'Game connection {asdict(game_connection)}')
-
         try:
-            response = db.put_item(
-                Item=asdict(game_connection),
-                ConditionExpression='attribute_not_exists(pk) AND attribute_not_exists(sk)'
-            )
+            with span('persist'):
+                db.put_item(
+                    Item=asdict(game_connection),
+                    ConditionExpression='attribute_not_exists(pk) OR connected_at <= :t',
+                    ExpressionAttributeValues={':t': game_connection.connected_at}
+                )
         except ClientError as e:
-            log.error(f'Exception raised when storing connection: {e}')
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return make_response(s.CONFLICT, {'message': 'A newer connection exists for this user'})
+            log.error('Exception raised when storing connection: %s', e)
             return make_response(s.INTERNAL_SERVER_ERROR, {'message': 'Error when saving connection'})
 
-        log.info(response)
-
         return make_response(s.OK, {'message': 'Connected'})
 
     elif event["requestContext"]["eventType"] == "DISCONNECT":
 
-        log.info(f'Disconnecting client ID {connection_id}')
+        log.info('Disconnecting client ID %s', connection_id)
+
+        with span('persist'):
+            removed = disconnect(connection_id)
+
+        tag(removed=removed)
+
         return make_response(200, {'message': 'Disconnected'})
 
     
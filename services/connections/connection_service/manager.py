@@ -1,125 +1,282 @@
-import json
-import decimal
-import logging
-from json import JSONEncoder
+import os
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Key
 from boto3.dynamodb.types import TypeDeserializer
 from botocore.exceptions import ClientError
 
+from cards_common.aws import Lazy, gateway_client
+from cards_common.cache import TTLCache
+from cards_common.data import projection, query_items, Capacity
+from cards_common.encoding import dumps_bytes
+from cards_common.log import get_logger, Fields
+from cards_common.timing import span
+from cards_common.views import game_views, STATE_SK
+
 from . import db, table, db_client
+from connection_service.entities import UserGameConnection, SpectatorConnection
 
-log = logging.getLogger()
-log.setLevel(logging.INFO)
+log = get_logger()
 
 serializer = TypeDeserializer()
 
-client = boto3.client('apigatewaymanagementapi', endpoint_url='https://jepc6bx2m7.execute-api.ap-southeast-2.amazonaws.com/dev')
+CONNECTION_FIELDS = projection('pk', 'sk', 'user_id', 'connection_id')
+
+CONNECTION_INDEX = 'ConnectionIndex'
+
+client = Lazy(lambda: gateway_client(
+    os.environ.get('WEBSOCKET_ENDPOINT', 'https://jepc6bx2m7.execute-api.ap-southeast-2.amazonaws.com/dev')
+))
+
+# concurrent posts per update, for games with an audience
+FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', 16))
 
-class DecimalEncoder(JSONEncoder):
-    def default(self, o): # pylint: disable=method-hidden
-        if isinstance(o, decimal.Decimal):
-            if abs(o) % 1 > 0:
-                return float(o)
-            else:
-                return int(o)
-        return super(DecimalEncoder, self).default(o)
+# encoded updates by (pk, sk, version), so a version is serialised once per container
+frames = TTLCache(max_size=256, ttl=60)
 
 
-def post_to_connection(connection_id: str, data: dict):
+def post_to_connection(connection: dict, data: bytes):
+    '''Sends an encoded frame, so an update fanned out to a game is encoded once
+
+    A connection the gateway reports gone is removed, in case its $disconnect
+    never arrived, so it is not read and posted to on every later update.
+    '''
 
     try:
         client.post_to_connection(
-            ConnectionId=connection_id,
-            Data=json.dumps(data, cls=DecimalEncoder).encode('utf-8')
+            ConnectionId=connection['connection_id'],
+            Data=data
         )
     except ClientError as e:
         if e.response['Error']['Code'] == 'GoneException':
-            log.warn(f'Gone exception for {connection_id}')
+            log.warning('Gone exception for %s, removing %s', connection['connection_id'], connection['sk'])
+            remove_connection(connection)
         else:
             raise
 
 
-def process_stream(records: list):
+def remove_connection(connection: dict) -> bool:
+    '''Deletes a connection item, unless a newer connection has since replaced it'''
+
+    try:
+        db.delete_item(
+            Key={'pk': connection['pk'], 'sk': connection['sk']},
+            ConditionExpression='connection_id = :cid',
+            ExpressionAttributeValues={':cid': connection['connection_id']},
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+    return True
+
+
+def disconnect(connection_id: str) -> int:
+    '''Removes every item stored for a closed connection, returning how many were removed'''
+
+    connections = query_items(
+        db,
+        IndexName=CONNECTION_INDEX,
+        KeyConditionExpression=Key('connection_id').eq(connection_id),
+    )
+
+    return sum(remove_connection(c) for c in connections)
+
+
+def is_legacy(connection: dict) -> bool:
+    '''Player connections once keyed by connection id, superseded by one item per user'''
+
+    return (
+        connection['sk'].startswith(UserGameConnection.PREFIX)
+        and connection['sk'] != f"{UserGameConnection.PREFIX}{connection.get('user_id', None)}"
+    )
+
+
+def game_connections(game_id: str, spectators: bool = True, capacity: Capacity = None) -> Iterator[dict]:
+    '''Connections of the game's players, then its spectators, following every page
+
+    Legacy player items are removed as they are found rather than sent to.
+    '''
+
+    prefixes = [UserGameConnection.PREFIX, SpectatorConnection.PREFIX] if spectators else [UserGameConnection.PREFIX]
+
+    for prefix in prefixes:
+        for connection in query_items(
+            db,
+            KeyConditionExpression=Key('pk').eq(f'GAME#{game_id}') & Key('sk').begins_with(prefix),
+            capacity=capacity,
+            **CONNECTION_FIELDS
+        ):
+            if is_legacy(connection):
+                log.info('Removing legacy connection %s', connection['sk'])
+                remove_connection(connection)
+                continue
+            yield connection
+
+
+def encode_update(keys: dict, update_type: str, image: dict) -> bytes:
+    '''Frame for an update, reused for every recipient and any redelivery of the version'''
+
+    version = image.get('version', None)
+    key = (keys['pk'], keys['sk'], update_type, version) if version is not None else None
+
+    data = frames.get(key) if key else None
+
+    if data is None:
+        data = dumps_bytes({
+            'type': update_type,
+            'data': image,
+        })
+        if key:
+            frames.put(key, data)
+
+    return data
+
+
+def fan_out(connections: list, data: bytes):
+    '''Posts the same frame to every connection, concurrently for larger audiences'''
+
+    if len(connections) <= 1 or FANOUT_WORKERS <= 1:
+        for connection in connections:
+            post_to_connection(connection, data)
+        return
+
+    # built once here rather than racing in the workers
+    client.resolve()
+
+    with ThreadPoolExecutor(max_workers=min(FANOUT_WORKERS, len(connections))) as pool:
+        list(pool.map(lambda connection: post_to_connection(connection, data), connections))
+
+
+def send_derived_views(game_id: str, item: dict):
+    '''Builds the views of a state item the shd service left to the stream and sends them
+
+    Everyone watching gets the public view and each connected player their
+    own, as if the view items had been written and streamed one by one.
+    '''
+
+    with span('serialise'):
+        state, players = game_views(item)
+
+    read = Capacity()
+
+    with span('load'):
+        connections = list(game_connections(game_id, capacity=read))
+
+    log.info(Fields('derived_update', game_id=game_id, connections=len(connections), read_units=read.units))
+
+    with span('serialise'):
+        state_data = encode_update(state, 'state_update', state)
+        player_data = [
+            (c, encode_update(players[c['user_id']], 'player_update', players[c['user_id']]))
+            for c in connections
+            if c['sk'].startswith(UserGameConnection.PREFIX) and c.get('user_id', None) in players
+        ]
+
+    with span('fanout'):
+        fan_out(connections, state_data)
+        for connection, data in player_data:
+            post_to_connection(connection, data)
+
+
+def process_stream(records: list) -> int:
+    '''Sends the updates in a batch of stream records, returning how many were processed
+
+    Removes and malformed records are skipped and not counted.
+    '''
+
+    processed = 0
 
     for record in records:
 
+        # deletes, e.g. of a finished game's items, have nothing to send
+        if record.get('eventName', None) == 'REMOVE':
+            continue
+
         dynamo = record.get('dynamodb', None)
 
         if not dynamo:
-            log.warn('Could not find dynamo object in record')
+            log.warning('Could not find dynamo object in record')
             continue
 
         keys: dict = dynamo.get('Keys', None)
         image: dict = dynamo.get('NewImage', None)
 
         if not keys or not image:
-            log.warn('Could not find keys and/or image in record')
+            log.warning('Could not find keys and/or image in record')
             continue
 
-        for key in ['sk', 'pk']:
-            if not keys.get(key, None):
-                log.warn(f'Key {key} not present in record')
-            keys[key] = serializer.deserialize(keys[key])
+        with span('parse'):
+            for key in ['sk', 'pk']:
+                if not keys.get(key, None):
+                    log.warning('Key %s not present in record', key)
+                keys[key] = serializer.deserialize(keys[key])
+
+        processed += 1
 
         game_entity_update = 'GAME#' in keys['pk']
 
         meta_update = game_entity_update and 'META' in keys['sk']
         state_update = game_entity_update and 'SANITISED' in keys['sk']
         player_update = game_entity_update and 'PLAYER#' in keys['sk']
+        derived_update = game_entity_update and keys['sk'] == STATE_SK and 'derived_views' in image
+
+        if derived_update:
+
+            with span('parse'):
+                state_image = { k: serializer.deserialize(v) for k,v in image.items() }
+
+            send_derived_views(keys['pk'][5:], state_image)
+            continue
 
         if meta_update or state_update:
 
             game_id = keys.get('pk')[5:]
-            game_image = { k: serializer.deserialize(v) for k,v in image.items() }
+            with span('parse'):
+                game_image = { k: serializer.deserialize(v) for k,v in image.items() }
 
             update_type = 'meta_update' if meta_update else 'state_update'
-            log.info(f'{update_type} info for connection to game {game_id}')
 
-            connections = db.query(
-                KeyConditionExpression=Key('pk').eq(f'GAME#{game_id}') & Key('sk').begins_with('CONN#'),
-            )['Items']
+            read = Capacity()
+
+            with span('load'):
+                connections = list(game_connections(game_id, capacity=read))
 
-            log.info(f'Connections: {connections}')
+            log.info(Fields(update_type, game_id=game_id, connections=len(connections), read_units=read.units))
 
-            message = {
-                'type': update_type,
-                'data': game_image,
-            }
+            with span('serialise'):
+                data = encode_update(keys, update_type, game_image)
 
-            for conn in connections:
-                log.info(f'Sending game update to user {conn["user_id"]} on connection ID {conn["connection_id"]}')
-                post_to_connection(conn['connection_id'], message)
+            with span('fanout'):
+                log.debug(Fields('sending update', connections=[c['connection_id'] for c in connections]))
+                fan_out(connections, data)
                 
 
         elif player_update:
 
             game_id = keys.get('pk')[5:]
-            player_image = { k: serializer.deserialize(v) for k,v in image.items()}
+            with span('parse'):
+                player_image = { k: serializer.deserialize(v) for k,v in image.items()}
             player_id = player_image['id']
 
-            log.info(f'Updating player {player_id}')
+            log.info('Updating player %s', player_id)
 
-            connections = db.query(
-                KeyConditionExpression=Key('pk').eq(f'GAME#{game_id}') & Key('sk').begins_with('CONN#'),
-                FilterExpression=Attr('user_id').eq(player_id)
-            )['Items']
+            with span('load'):
+                connection = db.get_item(
+                    Key=UserGameConnection.make_key(game_id, player_id),
+                    **CONNECTION_FIELDS
+                ).get('Item', None)
 
-            if len(connections) != 1:
-                log.warn(f'Could not find connection to game {game_id} for player {player_id}')
+            if not connection:
+                log.warning('Could not find connection to game %s for player %s', game_id, player_id)
                 continue
 
-            message = {
-                'type': 'player_update',
-                'data': player_image,
-            }
-            
-            post_to_connection(connections[0]['connection_id'], message)
-
-
-
-
-
+            with span('serialise'):
+                data = encode_update(keys, 'player_update', player_image)
 
+            with span('fanout'):
+                post_to_connection(connection, data)
 
+    return processed
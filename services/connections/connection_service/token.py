@@ -1,44 +1,135 @@
+import os
 import json
 import time
-import logging
+import hashlib
 import urllib.request
 from jose import jwk, jwt
 from jose.utils import base64url_decode
 
-log = logging.getLogger()
-log.setLevel(logging.INFO)
+from cards_common.cache import TTLCache
+from cards_common.log import get_logger
+
+log = get_logger()
 
 region = 'ap-southeast-2'
 userpool_id = 'ap-southeast-2_H9SN2bqby'
 app_client_id = '7s15kdmtc3rp33tct70en9u7d0'
 keys_url = f'https://cognito-idp.{region}.amazonaws.com/{userpool_id}/.well-known/jwks.json'
 
-with urllib.request.urlopen(keys_url) as f:
-  response = f.read()
-keys = json.loads(response.decode('utf-8'))['keys']
+
+class KeyStore(object):
+    '''Cognito public keys indexed by kid, fetched on first use
+
+    Keys are re-fetched once the TTL has passed, or early when a token names a
+    kid we have not seen (Cognito rotated its keys). Either way fetches are at
+    least min_refresh_interval apart, failed ones included, so an unreachable
+    endpoint costs one timeout per interval while stale keys keep being served.
+    Constructed public key
+    objects are kept so each kid is only parsed once per container. If a local
+    JWKS file is given it is used instead of the network.
+    '''
+
+    def __init__(self, url: str, ttl: int = 3600, path: str = None, min_refresh_interval: int = 30):
+        self.url = url
+        self.ttl = ttl
+        self.path = path
+        self.min_refresh_interval = min_refresh_interval
+        self.fetched_at = None
+        self.last_attempt = 0
+        self._jwks = {}
+        self._public_keys = {}
+
+    def load(self, keys: list):
+        '''Replaces the known keys, keeping constructed keys for unchanged kids'''
+
+        jwks = { k['kid']: k for k in keys }
+
+        self._public_keys = {
+            kid: key
+            for kid, key in self._public_keys.items()
+            if jwks.get(kid) == self._jwks.get(kid)
+        }
+        self._jwks = jwks
+        self.fetched_at = time.time()
+
+    def fetch(self) -> list:
+
+        if self.path:
+            with open(self.path, 'r') as f:
+                return json.load(f)['keys']
+
+        with urllib.request.urlopen(self.url, timeout=2) as f:
+            response = f.read()
+        return json.loads(response.decode('utf-8'))['keys']
+
+    def refresh(self):
+
+        self.last_attempt = time.time()
+
+        try:
+            self.load(self.fetch())
+        except Exception as e:
+            # keep serving any keys we already have
+            log.error('Unable to fetch public keys: %s', e)
+            return
+
+        log.info('Loaded %s public keys', len(self._jwks))
+
+    @property
+    def expired(self) -> bool:
+        return self.fetched_at is None or time.time() - self.fetched_at > self.ttl
+
+    @property
+    def refresh_due(self) -> bool:
+        return time.time() - self.last_attempt > self.min_refresh_interval
+
+    def get(self, kid: str):
+        '''Returns the constructed public key for kid, or None if it is unknown'''
+
+        if (self.expired or kid not in self._jwks) and self.refresh_due:
+            self.refresh()
+
+        public_key = self._public_keys.get(kid, None)
+
+        if public_key is None and kid in self._jwks:
+            public_key = jwk.construct(self._jwks[kid])
+            self._public_keys[kid] = public_key
+
+        return public_key
+
+
+def token_key(token: str) -> bytes:
+    '''Cache key for a token, so the cache does not hold the tokens themselves'''
+
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+
+key_store = KeyStore(
+    keys_url,
+    ttl=int(os.environ.get('JWKS_TTL', 3600)),
+    path=os.environ.get('JWKS_PATH', None),
+)
+
+# signature-verified claims, each kept until the token's exp. Only the
+# signature check is skipped on a hit, expiry and audience are still checked
+token_cache = TTLCache(max_size=int(os.environ.get('TOKEN_CACHE_SIZE', 1024)))
 
 # https://github.com/awslabs/aws-support-tools/blob/master/Cognito/decode-verify-jwt/decode-verify-jwt.py
 
-def validate_and_decode(token):
+def verify_signature(token) -> dict:
+    '''Returns the unverified claims if the token signature is valid'''
 
     # get the kid from the headers prior to verification
     headers = jwt.get_unverified_headers(token)
-    kid = headers['kid']
+    kid = headers.get('kid', None)
 
-    # search for the kid in the downloaded public keys
-    key_index = -1
-    for i in range(len(keys)):
-        if kid == keys[i]['kid']:
-            key_index = i
-            break
+    # find the public key for the kid, fetching the keys if needed
+    public_key = key_store.get(kid)
 
-    if key_index == -1:
+    if not public_key:
         log.error('Public key not found in jwks.json')
         return None
 
-    # construct the public key
-    public_key = jwk.construct(keys[key_index])
-
     # get the last two sections of the token,
     # message and signature (encoded in base64)
     message, encoded_signature = str(token).rsplit('.', 1)
@@ -48,23 +139,39 @@ def validate_and_decode(token):
 
     # verify the signature
     if not public_key.verify(message.encode("utf8"), decoded_signature):
-        log.warn('Signature verification failed')
+        log.warning('Signature verification failed')
         return None
 
-    log.info('Signature successfully verified')
+    log.debug('Signature successfully verified')
 
     # since we passed the verification, we can now safely
     # use the unverified claims
-    claims = jwt.get_unverified_claims(token)
+    return jwt.get_unverified_claims(token)
+
+
+def validate_and_decode(token):
+
+    # tokens verified recently in this container skip the signature check
+    key = token_key(token)
+    claims = token_cache.get(key)
+
+    if claims is None:
+
+        claims = verify_signature(token)
+
+        if not claims:
+            return None
+
+        token_cache.put(key, claims, expires_at=claims['exp'])
 
     # additionally we can verify the token expiration
     if time.time() > claims['exp']:
-        log.warn('Token is expired')
+        log.warning('Token is expired')
         return None
 
     # and the Audience  (use claims['client_id'] if verifying an access token)
     if claims['aud'] != app_client_id:
-        log.warn('Token was not issued for this audience')
+        log.warning('Token was not issued for this audience')
         return None
-        
-    return claims
+
+    return dict(claims)
@@ -1,9 +1,12 @@
-from typing import List, Any
+import time
+from typing import List, Dict, Any
 from uuid import uuid4
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, asdict
 
 from boto3.dynamodb.types import TypeSerializer
 
+from cards_common.seats import BOT_PREFIX, is_bot, seat_order
+
 serializer = TypeSerializer()
 
 class GameTypesEnum:
@@ -25,6 +28,8 @@ class User:
     id: str = None
     in_game: bool = False
     game_id: str = None
+    queue_pk: str = None
+    queue_sk: str = None
 
     def __post_init__(self):
         if self.id:
@@ -41,6 +46,13 @@ class User:
 
 
 
+LOBBY_INDEX = 'LobbyIndex'
+LOBBY_KEYS = ['lobby_pk', 'lobby_sk']
+
+# stored for conditions only, which cannot do arithmetic
+CONDITION_KEYS = ['last_seat']
+
+
 @dataclass
 class GameMeta:
 
@@ -53,21 +65,92 @@ class GameMeta:
 
     table_size: int = 4
     players_joined: int = 0
-    players: List[str] = field(default_factory=list)
+    # user id -> ms joined, a map so seats can be taken and freed in place.
+    # Seats joined beyond the players are bots, see seat_order
+    players: Dict[str, int] = field(default_factory=dict)
     invited_players: List[str] = field(default_factory=list)
+    created_at: int = field(default_factory=lambda: int(time.time()))
+    # bumped on every write so clients can poll with an ETag
+    version: int = 1
+
+    # lobby index keys - only present while the game is public with free seats
+    lobby_pk: str = None
+    lobby_sk: str = None
+
+    # players_joined once one seat is left, so a join can tell it fills the table
+    last_seat: int = None
 
     def __post_init__(self):
         self.pk = f'GAME#{self.id}' if not self.pk else self.pk
         self.sk = f'META' if not self.sk else self.sk
 
+        # read back from dynamo as decimals
+        self.table_size = int(self.table_size)
+        self.players_joined = int(self.players_joined)
+        self.last_seat = self.table_size - 1
+
+        if isinstance(self.players, list):
+            # stored before players became a map, their order kept as join times
+            self.players = {player_id: i for i, player_id in enumerate(self.players)}
+
     def get_key(self) -> dict:
         return GameMeta.make_key(self.id)
 
+    @property
+    def seats(self) -> List[str]:
+        return seat_order(self.players, self.players_joined)
+
+    @property
+    def is_open(self) -> bool:
+        return not self.private and self.players_joined < self.table_size
+
+    def seat_bots(self) -> List[str]:
+        '''Fills every free seat with a bot, seated after the players'''
+
+        self.players_joined = self.table_size
+        return self.bots
+
+    @property
+    def bots(self) -> List[str]:
+        return [p for p in self.seats if is_bot(p)]
+
+    def lobby_key(self) -> dict:
+        return {
+            'lobby_pk': GameMeta.make_lobby_pk(self.game_type),
+            'lobby_sk': f'{GameMeta.make_lobby_size(self.table_size)}#{self.created_at}#{self.id}',
+        }
+
+    def update_lobby(self):
+        '''Sets or clears the lobby index keys to match the game'''
+
+        key = self.lobby_key() if self.is_open else {'lobby_pk': None, 'lobby_sk': None}
+        self.lobby_pk = key['lobby_pk']
+        self.lobby_sk = key['lobby_sk']
+
+    def to_item(self) -> dict:
+        '''Item to store - index keys are omitted rather than stored as null'''
+
+        return {
+            k: v
+            for k, v in asdict(self).items()
+            if v is not None or k not in LOBBY_KEYS
+        }
+
     def to_dict(self):
         return {
             k: v
             for k, v in self.__dict__.items()
-            if k not in ['pk', 'sk']
+            if k not in ['pk', 'sk'] + LOBBY_KEYS + CONDITION_KEYS
+        }
+
+    def to_lobby(self) -> dict:
+        return {
+            'id': self.id,
+            'game_type': self.game_type,
+            'table_size': self.table_size,
+            'players_joined': self.players_joined,
+            'created_by': self.created_by,
+            'created_at': self.created_at,
         }
 
     @classmethod
@@ -77,6 +160,45 @@ class GameMeta:
             'sk': f'META'
         }
 
+    @classmethod
+    def make_lobby_pk(cls, game_type: str) -> str:
+        return f'LOBBY#{game_type}'
+
+    @classmethod
+    def make_lobby_size(cls, table_size: int) -> str:
+        # zero padded so sizes sort numerically within a game type
+        return f'SIZE#{int(table_size):02d}'
+
+
+
+@dataclass
+class QueueEntry:
+    '''A user waiting in the matchmaking queue for a game type and table size'''
+
+    pk: str = None
+    sk: str = None
+    user_id: str = None
+    game_type: str = GameTypesEnum.SHD
+    table_size: int = 4
+    enqueued_at: int = field(default_factory=lambda: int(time.time() * 1000))
+
+    def __post_init__(self):
+        if not self.pk:
+            self.pk = QueueEntry.make_pk(self.game_type, self.table_size)
+        if not self.sk:
+            # oldest entries sort first so the queue is matched in order
+            self.sk = f'ENTRY#{self.enqueued_at:013d}#{self.user_id}'
+
+    def get_key(self) -> dict:
+        return {
+            'pk': self.pk,
+            'sk': self.sk,
+        }
+
+    @classmethod
+    def make_pk(cls, game_type: str, table_size: int) -> str:
+        return f'QUEUE#{game_type}#{int(table_size)}'
+
 
 
 @dataclass
@@ -1,99 +1,102 @@
 import os
-import re
 import json
-import logging
-from typing import List, Any
-from dataclasses import asdict, dataclass, field
 
-import boto3
-from boto3.exceptions import Boto3Error
+from cards_common.data import projection
+from cards_common.etag import get_header
+from cards_common.log import get_logger, log_event
+from cards_common.router import Router, Route
+from cards_common.timing import timed, span, tag
 
 from meta_service.entities import User
 from meta_service.routes import (
     get_game,
+    get_open_games,
     create_game,
     enter_game,
     exit_game,
+    add_bots,
+    join_queue,
+    leave_queue,
     make_response,
 )
 
 from . import db
 
-log = logging.getLogger()
-log.setLevel(logging.INFO)
+log = get_logger()
 
+# the only user attributes any game route reads
+USER_FIELDS = projection('in_game', 'game_id', 'queue_pk', 'queue_sk')
 
-@dataclass
-class Route():
-    path: str = None
-    method: str = None
-    function: Any = None
-    args: List[Any] = field(default_factory=list)
-    kwargs: dict = field(default_factory=dict)
-    
 
-guid = '[A-Za-z0-9-]+'
+router = Router([
+    Route(method='GET', path='/games', function=get_game, args=('user', 'if_none_match')),
+    Route(method='GET', path='/games/open', function=get_open_games, args=('params',)),
+    Route(method='POST', path='/games/queue', function=join_queue, args=('user', 'body')),
+    Route(method='DELETE', path='/games/queue', function=leave_queue, args=('user',)),
+    Route(method='POST', path='/games', function=create_game, args=('user', 'body')),
+    Route(method='POST', path='/games/{game_id}/players', function=enter_game, args=('user', 'game_id')),
+    Route(method='DELETE', path='/games/{game_id}/players', function=exit_game, args=('user', 'game_id')),
+    Route(method='POST', path='/games/{game_id}/bots', function=add_bots, args=('user', 'game_id')),
+])
 
 
+@timed('meta')
 def handle(event, context):
     '''Lambda routing function to handle game metadata resource e.g.'''
 
-    log.info(event)
+    log_event(log, event)
         
     try: 
 
         try:
-            user_id = event['requestContext']['authorizer']['claims']['cognito:username']
+            with span('parse'):
+                user_id = event['requestContext']['authorizer']['claims']['cognito:username']
         except KeyError:
             return make_response(401, {'message': 'Unauthorised'})
 
         user = User(id=user_id)
 
         # initial validations
-        result = db.get_item(
-            Key=user.get_key()
-        )
+        with span('auth'):
+            result = db.get_item(
+                Key=user.get_key(),
+                **USER_FIELDS
+            )
 
         if not 'Item' in result:
             return make_response(401, {'Message': 'Could not find user'})
 
-        user.in_game = result['Item']['in_game']
-        user.game_id = result['Item']['game_id']
+        user.in_game = result['Item'].get('in_game', False)
+        user.game_id = result['Item'].get('game_id', None)
+        user.queue_pk = result['Item'].get('queue_pk', None)
+        user.queue_sk = result['Item'].get('queue_sk', None)
 
         # route and process response
         path = event['path']
         method = event['httpMethod']
-        body = json.loads(event['body']) if event['body'] else None
 
-        game_id = None
-        
-        if event['pathParameters']:
-            params = event['pathParameters']
-            game_id = params['game_id'] if 'game_id' in params else None
-
-        routes = [
-            Route(path='/games', method='GET', function=get_game, args=[user]),
-            Route(path='/games', method='POST', function=create_game, args=[user, body]),
-            Route(path=f'/games/{guid}/players$', method='POST', function=enter_game, args=[user, game_id]),
-            Route(path=f'/games/{guid}/players$', method='DELETE', function=exit_game, args=[user, game_id]),
-        ]
-
-        route = next(
-                (r for r in routes if re.fullmatch(r.path, path) and r.method == method),
-                None
-            )
-        
-        if not route:
-            log.error(f'Unhandled request route: {path}, method: {method}')
+        with span('parse'):
+            match = router.match(method, path, event.get('pathParameters', None))
+
+        if not match:
+            log.error('Unhandled request route: %s, method: %s', path, method)
             return make_response(400, {'message': 'Route or method not supported'})
 
-        log.info(f'Handling route [{path}] method [{method}] with function {route.function.__name__}')
-        
-        return route.function(*route.args, **route.kwargs)
+        log.info('Handling route [%s] method [%s] with function %s', path, method, match.route.function.__name__)
+
+        tag(action=match.route.function.__name__)
+
+        with span('route'):
+            return match.call(
+                user=lambda: user,
+                body=lambda: json.loads(event['body']) if event['body'] else None,
+                params=lambda: event.get('queryStringParameters', None) or {},
+                if_none_match=lambda: get_header(event, 'If-None-Match'),
+            )
 
 
     except Exception as e:
 
-        log.error(f'Exception when processing request: {str(e)}')
+        log.error('Exception when processing request: %s', e)
         raise
         # return make_response(500, {'message': 'Internal server error'})
\ No newline at end of file
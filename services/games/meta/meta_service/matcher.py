@@ -0,0 +1,313 @@
+import os
+import time
+from typing import List, Tuple
+
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+from cards_common.aws import gateway_client
+from cards_common.data import projection, batch_get_items, query_items
+from cards_common.encoding import dumps_bytes
+from cards_common.log import get_logger
+
+from meta_service.entities import GameMeta, GameTypesEnum, LOBBY_INDEX
+from meta_service.routes import as_dynamo_dict, serializer, version_bump, MAX_TABLE_SIZE
+
+from . import db, db_resource, table, db_client
+
+log = get_logger()
+
+deserializer = TypeDeserializer()
+
+LOBBY_FILL_LIMIT = 25
+
+CONNECTION_FIELDS = projection('pk', 'sk', 'connection_id')
+
+_gateway = None
+
+
+class GameConflict(Exception):
+    '''The game changed between reading and seating - try another one'''
+    pass
+
+
+def get_gateway():
+
+    global _gateway
+
+    if _gateway is None and os.environ.get('WEBSOCKET_ENDPOINT', None):
+        _gateway = gateway_client(os.environ['WEBSOCKET_ENDPOINT'])
+
+    return _gateway
+
+
+def parse_queue(queue_pk: str) -> Tuple[str, int]:
+    _, game_type, table_size = queue_pk.split('#')
+    return game_type, int(table_size)
+
+
+def waiting_entries(queue_pk: str) -> List[dict]:
+    '''All entries in a queue, oldest first'''
+
+    return list(query_items(
+        db,
+        KeyConditionExpression=Key('pk').eq(queue_pk) & Key('sk').begins_with('ENTRY#'),
+        ConsistentRead=True,
+    ))
+
+
+def open_games(game_type: str, table_size: int) -> List[dict]:
+    '''Public games with free seats, oldest first'''
+
+    return list(query_items(
+        db,
+        IndexName=LOBBY_INDEX,
+        KeyConditionExpression=Key('lobby_pk').eq(GameMeta.make_lobby_pk(game_type)) & Key('lobby_sk').begins_with(f'{GameMeta.make_lobby_size(table_size)}#'),
+        limit=LOBBY_FILL_LIMIT,
+    ))
+
+
+def seat_entries(game_op: dict, game_id: str, entries: List[dict]) -> List[str]:
+    '''Seats the queued users with one transaction
+
+    Returns the ids of users who had already left the queue, in which case
+    nobody was seated. Raises GameConflict if the game operation failed.
+    '''
+
+    user_updates = [
+        {
+            'Update': {
+                'TableName': table,
+                'Key': as_dynamo_dict({'pk': f'USER#{e["user_id"]}', 'sk': 'ENTITY'}),
+                'UpdateExpression': 'SET in_game = :t, game_id = :gid REMOVE queue_pk, queue_sk ADD version :v',
+                'ConditionExpression': 'queue_sk = :qsk',
+                'ExpressionAttributeValues': {
+                    ':t': serializer.serialize(True),
+                    ':gid': serializer.serialize(game_id),
+                    ':qsk': serializer.serialize(e['sk']),
+                    ':v': serializer.serialize(1),
+                }
+            }
+        }
+        for e in entries
+    ]
+
+    entry_deletes = [
+        {
+            'Delete': {
+                'TableName': table,
+                'Key': as_dynamo_dict({'pk': e['pk'], 'sk': e['sk']}),
+                'ConditionExpression': 'attribute_exists(pk)',
+            }
+        }
+        for e in entries
+    ]
+
+    try:
+        db_client.transact_write_items(
+            # the version count is unconditional, so it never shifts the reasons read below
+            TransactItems=[game_op] + user_updates + entry_deletes + [version_bump(game_id)]
+        )
+    except db_client.exceptions.TransactionCanceledException as e:
+
+        reasons = [r.get('Code', 'None') for r in e.response.get('CancellationReasons', [])]
+        log.info('Seating in game %s cancelled: %s', game_id, reasons)
+
+        if reasons and reasons[0] == 'ConditionalCheckFailed':
+            raise GameConflict(game_id)
+
+        n = len(entries)
+        stale = {
+            entries[i % n]['user_id']
+            for i, code in enumerate(reasons[1:])
+            if code == 'ConditionalCheckFailed'
+        }
+
+        if not stale:
+            # contention rather than stale data - leave the group for the next run
+            raise
+
+        return list(stale)
+
+    return []
+
+
+def fill_game_op(game: dict, entries: List[dict]) -> dict:
+    '''Seats queued users in an open game, conditional on the seat count we read
+
+    Games that still store the old players list are skipped, as their seats
+    cannot be set by id. They are converted when a player joins or leaves.
+    '''
+
+    joined = int(game['players_joined'])
+    seated_at = int(time.time() * 1000)
+    seats = ', '.join(f'players.#p{i} = :t{i}' for i in range(len(entries)))
+    update_expression = f'SET {seats}, players_joined = players_joined + :n'
+
+    if joined + len(entries) >= int(game['table_size']):
+        update_expression += ' REMOVE lobby_pk, lobby_sk'
+
+    update_expression += ' ADD version :v'
+
+    return {
+        'Update': {
+            'TableName': table,
+            'Key': as_dynamo_dict(GameMeta.make_key(game['id'])),
+            'UpdateExpression': update_expression,
+            'ConditionExpression': 'players_joined = :joined AND attribute_type(players, :map)',
+            'ExpressionAttributeNames': {
+                f'#p{i}': e['user_id'] for i, e in enumerate(entries)
+            },
+            'ExpressionAttributeValues': {
+                # a ms apart so the group keeps its queue order
+                **{f':t{i}': serializer.serialize(seated_at + i) for i in range(len(entries))},
+                ':n': serializer.serialize(len(entries)),
+                ':joined': serializer.serialize(joined),
+                ':map': serializer.serialize('M'),
+                ':v': serializer.serialize(1),
+            }
+        }
+    }
+
+
+def new_game_op(game: GameMeta) -> dict:
+    return {
+        'Put': {
+            'TableName': table,
+            'Item': as_dynamo_dict(game.to_item()),
+            'ConditionExpression': 'attribute_not_exists(pk)',
+        }
+    }
+
+
+def match_queue(queue_pk: str) -> List[Tuple[str, List[str]]]:
+    '''Seats waiting users in open games, then in new full games
+
+    Each game is filled with a single transaction, so users never race each
+    other for seats. Users found to have left the queue are dropped and the
+    group is topped up from the queue. Returns (game id, user ids) per game.
+    '''
+
+    game_type, table_size = parse_queue(queue_pk)
+    entries = waiting_entries(queue_pk)
+
+    log.info('%s users waiting in %s', len(entries), queue_pk)
+
+    matches = []
+    games = open_games(game_type, table_size) if entries else []
+
+    while entries:
+
+        if games:
+            game = games[0]
+            group = entries[:int(game['table_size']) - int(game['players_joined'])]
+            game_id, game_op = game['id'], fill_game_op(game, group)
+
+        elif len(entries) >= table_size:
+            group = entries[:table_size]
+            new_game = GameMeta(
+                created_by=group[0]['user_id'],
+                game_type=game_type,
+                table_size=table_size,
+                # queue order breaks the tie on join time
+                players={e['user_id']: int(e['enqueued_at']) for e in group},
+                players_joined=len(group),
+            )
+            new_game.update_lobby()
+            game_id, game_op = new_game.id, new_game_op(new_game)
+
+        else:
+            break
+
+        try:
+            stale = seat_entries(game_op, game_id, group)
+        except GameConflict:
+            if not games:
+                break
+            games.pop(0)
+            continue
+        except db_client.exceptions.TransactionCanceledException:
+            # contended - leave the rest for the next run rather than spinning
+            break
+
+        if stale:
+            entries = [e for e in entries if e['user_id'] not in stale]
+            continue
+
+        matches.append((game_id, [e['user_id'] for e in group]))
+        entries = entries[len(group):]
+
+        if games and game_id == games[0]['id']:
+            games.pop(0)
+
+    for game_id, user_ids in matches:
+        notify(queue_pk, game_id, user_ids)
+
+    return matches
+
+
+def notify(queue_pk: str, game_id: str, user_ids: List[str]):
+    '''Tells matched users about their game on the socket they opened while queued'''
+
+    keys = [{'pk': queue_pk, 'sk': f'CONN#{user_id}'} for user_id in user_ids]
+
+    connections = batch_get_items(db_resource, table, keys, CONNECTION_FIELDS)
+
+    gateway = get_gateway()
+
+    if connections and gateway:
+
+        data = dumps_bytes({'type': 'match_found', 'data': {'game_id': game_id}})
+
+        for conn in connections:
+            try:
+                gateway.post_to_connection(ConnectionId=conn['connection_id'], Data=data)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'GoneException':
+                    raise
+                log.warning('Gone exception for %s', conn["connection_id"])
+
+    with db.batch_writer() as batch:
+        for conn in connections:
+            batch.delete_item(Key={'pk': conn['pk'], 'sk': conn['sk']})
+
+
+def all_queues() -> List[str]:
+    return [
+        f'QUEUE#{game_type}#{table_size}'
+        for game_type in GameTypesEnum.to_list()
+        for table_size in range(2, MAX_TABLE_SIZE + 1)
+    ]
+
+
+def handle(event, context):
+    '''Runs the matcher for queues with new entries, or every queue on a schedule'''
+
+    if 'Records' in event:
+
+        queues = set()
+
+        for record in event['Records']:
+
+            if record.get('eventName', None) != 'INSERT':
+                continue
+
+            keys = record.get('dynamodb', {}).get('Keys', {})
+            pk = deserializer.deserialize(keys['pk']) if 'pk' in keys else ''
+            sk = deserializer.deserialize(keys['sk']) if 'sk' in keys else ''
+
+            if pk.startswith('QUEUE#') and sk.startswith('ENTRY#'):
+                queues.add(pk)
+
+    else:
+        queues = all_queues()
+
+    matches = []
+
+    for queue_pk in queues:
+        matches += match_queue(queue_pk)
+
+    log.info('Matched %s users into %s games', sum(len(users) for _, users in matches), len(matches))
+
+    return {'games': len(matches)}
@@ -1,45 +1,41 @@
 import re
 import json
-import decimal
-import logging
-from typing import Any
-from json import JSONEncoder
+import time
+import base64
+from typing import Any, Tuple
 from http import HTTPStatus as s
 from dataclasses import asdict, dataclass
 
-from boto3.exceptions import Boto3Error
-from boto3.dynamodb.conditions import Attr, Key
-from boto3.dynamodb.types import TypeSerializer
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from botocore.exceptions import ClientError
 
-from meta_service.entities import User, GameMeta, GameUser, GameTypesEnum
+from cards_common.cache import TTLCache
+from cards_common.data import batch_get_items, query_items
+from cards_common.encoding import make_response, dumps_bytes
+from cards_common.etag import make_etag, etag_matches, etag_headers, not_modified
+from cards_common.log import get_logger, Fields
+from cards_common.views import game_views, STATE_SK, SANITISED_SK, PLAYER_PREFIX, VERSION_SK
 
-from . import db, table, db_client
+from meta_service.entities import User, GameMeta, GameUser, GameTypesEnum, QueueEntry, LOBBY_INDEX
 
-log = logging.getLogger()
-log.setLevel(logging.INFO)
+from . import db, db_resource, table, db_client
+
+log = get_logger()
 
 serializer = TypeSerializer()
+deserializer = TypeDeserializer()
 
-class DecimalEncoder(JSONEncoder):
-    def default(self, o): # pylint: disable=method-hidden
-        if isinstance(o, decimal.Decimal):
-            if abs(o) % 1 > 0:
-                return float(o)
-            else:
-                return int(o)
-        return super(DecimalEncoder, self).default(o)
+LOBBY_PAGE_SIZE = 20
+LOBBY_MAX_PAGE_SIZE = 50
+MAX_TABLE_SIZE = 8
 
+# writes of a seat before giving up on a game that keeps changing
+SEAT_ATTEMPTS = 3
 
-def make_response(code: int, body: dict = {}) -> dict:
-    '''Generates HTTP response expected by API gateway'''
+# game views built in this container, keyed by game and user
+game_cache = TTLCache(max_size=256, ttl=300)
 
-    return {
-        'statusCode': code,
-        'headers': {
-                'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps(body, cls=DecimalEncoder)
-    }
 
 
 def as_dynamo_dict(data: dict) -> dict:
@@ -49,196 +45,625 @@ def as_dynamo_dict(data: dict) -> dict:
     }
 
 
-def get_game(user: User):
+def encode_cursor(last_key: dict) -> str:
+    return base64.urlsafe_b64encode(
+        dumps_bytes(last_key)
+    ).decode('utf-8')
+
+
+def decode_cursor(cursor: str, lobby_pk: str) -> dict:
+    '''Decodes a lobby cursor, raising ValueError if it was not issued for this listing'''
+
+    try:
+        last_key = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Malformed cursor: {e}')
+
+    if (
+        not isinstance(last_key, dict)
+        or set(last_key.keys()) != {'pk', 'sk', 'lobby_pk', 'lobby_sk'}
+        or not all(isinstance(v, str) for v in last_key.values())
+        or last_key['lobby_pk'] != lobby_pk
+    ):
+        raise ValueError('Cursor does not match listing')
+
+    return last_key
+
+
+def get_open_games(params: dict):
+    '''Lists public games with free seats from the sparse lobby index'''
+
+    game_type = params.get('gameType', None) or GameTypesEnum.SHD
+    table_size = params.get('tableSize', None)
+
+    if game_type not in GameTypesEnum.to_list():
+        return make_response(s.BAD_REQUEST, {'message': 'Invalid game type'})
+
+    try:
+        limit = min(int(params.get('limit', None) or LOBBY_PAGE_SIZE), LOBBY_MAX_PAGE_SIZE)
+        condition = Key('lobby_pk').eq(GameMeta.make_lobby_pk(game_type))
+        if table_size:
+            condition &= Key('lobby_sk').begins_with(f'{GameMeta.make_lobby_size(table_size)}#')
+    except ValueError:
+        return make_response(s.BAD_REQUEST, {'message': 'Invalid table size or limit'})
+
+    if limit < 1:
+        return make_response(s.BAD_REQUEST, {'message': 'Invalid table size or limit'})
+
+    query = {
+        'IndexName': LOBBY_INDEX,
+        'KeyConditionExpression': condition,
+        'Limit': limit,
+    }
+
+    if params.get('cursor', None):
+        try:
+            query['ExclusiveStartKey'] = decode_cursor(params['cursor'], GameMeta.make_lobby_pk(game_type))
+        except ValueError as e:
+            log.error('Invalid lobby cursor: %s', e)
+            return make_response(s.BAD_REQUEST, {'message': 'Invalid cursor'})
+
+    response = db.query(**query)
+    last_key = response.get('LastEvaluatedKey', None)
+
+    return make_response(s.OK, {
+        'games': [GameMeta(**item).to_lobby() for item in response.get('Items', [])],
+        'cursor': encode_cursor(last_key) if last_key else None,
+    })
+
+
+def game_view_keys(user_id: str, derived: bool) -> list:
+    '''Sort keys of the game items the user can see
+
+    Games whose views are left to the stream have their views built from the
+    state item instead, ignoring any view items stored before they were.
+    '''
+
+    if derived:
+        return ['META', STATE_SK]
+
+    return ['META', SANITISED_SK, f'{PLAYER_PREFIX}{user_id}']
+
+
+def version_bump(game_id: str) -> dict:
+    '''Transaction item counting a change to the game, so polls see it'''
+
+    return {
+        'Update': {
+            'TableName': table,
+            'Key': as_dynamo_dict({'pk': f'GAME#{game_id}', 'sk': VERSION_SK}),
+            'UpdateExpression': 'ADD version :v',
+            'ExpressionAttributeValues': { ':v': { 'N': '1' } },
+        }
+    }
+
+
+def game_items(game_id: str, user_id: str) -> list:
+    '''Every item of a game stored before it kept a version item, for the user to see'''
+
+    entities = list(query_items(
+        db,
+        KeyConditionExpression=Key('pk').eq(f'GAME#{game_id}') & Key('sk').lt('VIEW#'),
+    ))
+
+    sks = {e['sk'] for e in entities}
+    derived = any(e['sk'] == STATE_SK and e.get('derived_views', False) for e in entities) or (
+        STATE_SK in sks and SANITISED_SK not in sks
+    )
+
+    keys = game_view_keys(user_id, derived)
+
+    return [e for e in entities if e['sk'] in keys]
+
+
+def get_game(user: User, if_none_match: str = None):
+    '''Returns the user's game, or 304 if the client's copy is current
+
+    Polls read only the game's small version item, and the items the user can
+    see are fetched by key only when the version has moved on. Views are kept
+    per container for clients that poll a game another request has already
+    loaded.
+    '''
 
     if not user.in_game or not user.game_id:
         return make_response(s.NOT_FOUND, {'message': 'User not in game'})
 
-    log.info(f'Getting game {user.game_id} for user {user.id}')
+    log.info('Getting game %s for user %s', user.game_id, user.id)
+
+    marker = db.get_item(Key={'pk': f'GAME#{user.game_id}', 'sk': VERSION_SK}).get('Item', None)
+
+    if not marker:
+        etag = None
+        entitites = game_items(user.game_id, user.id)
+
+    else:
+        etag = make_etag(user.game_id, user.id, marker.get('version', 0))
+
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
 
-    entitites = db.query(
-        KeyConditionExpression=Key('pk').eq(f'GAME#{user.game_id}')
-    ).get('Items', [])
+        cached = game_cache.get((user.game_id, user.id))
+
+        if cached and cached[0] == etag:
+            return make_response(s.OK, cached[1], headers=etag_headers(etag))
+
+        entitites = batch_get_items(db_resource, table, [
+            {'pk': f'GAME#{user.game_id}', 'sk': sk}
+            for sk in game_view_keys(user.id, marker.get('derived_views', False))
+        ])
 
     meta = next((e for e in entitites if e['sk'] == 'META'), None)
     state = next((e for e in entitites if 'SANITISED' in e['sk']), None)
     player = next((e for e in entitites if e['sk'] == f'PLAYER#{user.id}'), None)
+    stored = next((e for e in entitites if e['sk'] == STATE_SK), None)
+
+    if stored:
+        state, players = game_views(stored)
+        player = players.get(user.id, None)
 
     if not any([meta, state, player]):
-        return {s.NOT_FOUND, {'message': f'Could not find game {user.game_id}'}}
+        return make_response(s.NOT_FOUND, {'message': f'Could not find game {user.game_id}'})
 
-    return make_response(s.OK, {
+    body = {
         'meta': meta,
         'state': state,
         'player': player
-    })
+    }
+
+    if not etag:
+        return make_response(s.OK, body)
+
+    # writers count a change after making it, so the body is at least as new as the tag
+    game_cache.put((user.game_id, user.id), (etag, body))
+
+    return make_response(s.OK, body, headers=etag_headers(etag))
+
+
+def join_user_update(user: User, game_id: str) -> dict:
+    '''Transaction item pointing the user at a game, only if they are free to play'''
+
+    return {
+        'Update': {
+            'TableName': table,
+            'Key': as_dynamo_dict(user.get_key()),
+            'UpdateExpression': 'SET in_game = :g, game_id = :gid ADD version :v',
+            'ConditionExpression': 'attribute_exists(pk) AND in_game <> :g AND attribute_not_exists(queue_pk)',
+            'ExpressionAttributeValues': {
+                ':g': serializer.serialize(True),
+                ':gid': serializer.serialize(game_id),
+                ':v': { 'N': '1' },
+            },
+        }
+    }
 
 
 def create_game(user: User, body: dict):
-    '''Create a new game and add the user to it'''
+    '''Create a new game with the user seated in a single transaction'''
 
     if user.in_game:
         return make_response(s.CONFLICT, {'message': 'Cannot create game while currently playing'})
 
-    log.info(f'Creating game with data {json.dumps(body)}')
+    if user.queue_pk:
+        return make_response(s.CONFLICT, {'message': 'Cannot create game while queued for a match'})
+
+    log.info(Fields('create game', user=user.id, body=body))
 
     try:
         if body['game_type'] not in GameTypesEnum.to_list():
             return make_response(s.BAD_REQUEST, {'message': 'Invalid game type'})
-    except KeyError:
+    except (KeyError, TypeError):
         return make_response(s.BAD_REQUEST, {'message': 'No game type selected'})
 
+    # the rest of the table can be filled with bots so the game starts now
+    with_bots = body.get('bots', False)
+    if not isinstance(with_bots, bool):
+        return make_response(s.BAD_REQUEST, {'message': 'Bots must be true or false'})
+
     # if game attributes are missing use default
     try:
-        game = GameMeta(created_by=user.id, **body)
-    except TypeError as e:
+        game = GameMeta(created_by=user.id, **{k: v for k, v in body.items() if k != 'bots'})
+    except (TypeError, ValueError) as e:
         return make_response(s.BAD_REQUEST, {'message': f'Invalid key in create game data: {str(e)}'})
 
+    joined_at = int(time.time() * 1000)
+
+    game.players = {user.id: joined_at}
+    game.players_joined = 1
+
+    if with_bots:
+        game.seat_bots()
+
+    game.update_lobby()
+
     try:
-        db.put_item(
-            Item=asdict(game)
+        db_client.transact_write_items(
+            TransactItems=[
+                {
+                    'Put': {
+                        'TableName': table,
+                        'Item': as_dynamo_dict(game.to_item()),
+                        'ConditionExpression': 'attribute_not_exists(pk)',
+                    }
+                },
+                join_user_update(user, game.id),
+                version_bump(game.id),
+            ]
         )
-    except Boto3Error as e:
-        log.error(f'Unable to create game due to exception: {str(e)}')
-        raise
+    except db_client.exceptions.TransactionCanceledException as e:
+        log.error('Unable to create game for user %s: %s', user.id, e)
+        return make_response(s.CONFLICT, {'message': 'Cannot create game while currently playing'})
 
-    response = enter_game(user, game.id)
+    return make_response(s.CREATED, game.to_dict())
 
-    if response['statusCode'] != 200:
-        log.error(f'Unable to set user {user.id} in game {game.id}')
-        log.info('Rolling back game')
-        db.delete_item(
-            Key=game.get_key()
-        )
-        return response
 
-    return make_response(s.CREATED, json.loads(response['body']))
+def seat_key_update(game_id: str, user_id: str, update_expression: str, condition: str, values: dict = None) -> dict:
+    '''Transaction item taking or freeing the user's seat in place, without reading the game
+
+    The condition says what the write assumes about the game, e.g. that the
+    table stays open, and the game is returned if it does not hold.
+    '''
+
+    return {
+        'Update': {
+            'TableName': table,
+            'Key': as_dynamo_dict(GameMeta.make_key(game_id)),
+            'UpdateExpression': update_expression,
+            'ConditionExpression': f'attribute_type(players, :map) AND {condition}',
+            'ExpressionAttributeNames': {'#pid': user_id},
+            'ExpressionAttributeValues': as_dynamo_dict({':map': 'M', ':one': 1, **(values or {})}),
+            'ReturnValuesOnConditionCheckFailure': 'ALL_OLD',
+        }
+    }
+
 
+def seat_update(game: GameMeta, read_version: Any) -> dict:
+    '''Transaction item writing the game's seats and lobby keys, if it is unchanged since it was read
+
+    The whole players map is written, so a game stored with the old players
+    list is converted by the same write.
+    '''
+
+    game.update_lobby()
+
+    sets = 'SET players = :players, players_joined = :joined, last_seat = :last'
+    values = {
+        ':players': serializer.serialize(game.players),
+        ':joined': serializer.serialize(game.players_joined),
+        ':last': serializer.serialize(game.last_seat),
+        ':v': { 'N': '1' },
+    }
+
+    if game.lobby_pk:
+        update_expression = f'{sets}, lobby_pk = :lpk, lobby_sk = :lsk ADD version :v'
+        values[':lpk'] = serializer.serialize(game.lobby_pk)
+        values[':lsk'] = serializer.serialize(game.lobby_sk)
+    else:
+        update_expression = f'{sets} REMOVE lobby_pk, lobby_sk ADD version :v'
+
+    if read_version is None:
+        condition = 'attribute_exists(pk) AND attribute_not_exists(version)'
+    else:
+        condition = 'version = :read'
+        values[':read'] = serializer.serialize(read_version)
+
+    return {
+        'Update': {
+            'TableName': table,
+            'Key': as_dynamo_dict(game.get_key()),
+            'UpdateExpression': update_expression,
+            'ConditionExpression': condition,
+            'ExpressionAttributeValues': values,
+            'ReturnValuesOnConditionCheckFailure': 'ALL_OLD',
+        }
+    }
+
+
+def failed_game(e: Exception) -> Tuple[bool, dict]:
+    '''Whether a cancelled seat transaction failed on the game, and the game it found
+
+    The game is {} if there was none.
+    '''
+
+    reasons = e.response.get('CancellationReasons', [])
+
+    if not reasons or reasons[0].get('Code', None) != 'ConditionalCheckFailed':
+        return False, None
+
+    return True, {k: deserializer.deserialize(v) for k, v in reasons[0].get('Item', {}).items()}
 
 
 def enter_game(user: User, game_id: str):
+    '''Seats the user in a game, updating its seats and lobby listing in one transaction
+
+    The seat is taken in place on the assumption the table stays open, so most
+    joins are a single write. Should that not hold, e.g. the user takes the
+    last seat, the failed write returns the game and the whole game is written
+    conditional on it being unchanged.
+    '''
 
     if user.in_game:
         return make_response(s.CONFLICT, {'message': 'Cannot join a game while currently playing'})
 
-    log.info(f'Adding user {user.id} to game {game_id}')
+    if user.queue_pk:
+        return make_response(s.CONFLICT, {'message': 'Cannot join a game while queued for a match'})
 
-    try:
-        response = db_client.transact_write_items(
-            TransactItems=[
-                {
-                    'Update': {
-                        'TableName': table,
-                        'Key': as_dynamo_dict(GameMeta.make_key(game_id)),
-                        'UpdateExpression': 'SET players_joined = players_joined + :p, players = list_append(players, :pid)',
-                        'ConditionExpression': 'players_joined < table_size AND NOT contains(players, :pid)',
-                        'ExpressionAttributeValues': {
-                            ':p': { 'N': '1' },
-                            ':pid': serializer.serialize([user.id])
+    log.info('Adding user %s to game %s', user.id, game_id)
 
-                        },
-                        'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
-                    }
-                },
-                {
-                    'Update': {
-                        'TableName': table,
-                        'Key': as_dynamo_dict(user.get_key()),
-                        'UpdateExpression': 'set in_game = :g, game_id = :gid',
-                        'ExpressionAttributeValues': {
-                            ':g': serializer.serialize(True),
-                            ':gid': serializer.serialize(game_id)
-                        },
-                        'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
-                    }
-                }
-                
-            ]
-        )
-    except db_client.exceptions.TransactionCanceledException:
+    joined_at = int(time.time() * 1000)
+
+    # as the last failed write found it, unknown until a write fails
+    game, version = None, None
 
-        log.error(f'User {user.id} unable to join game {game_id}')
+    for _ in range(SEAT_ATTEMPTS):
+
+        if not game:
+            game_op = seat_key_update(
+                game_id,
+                user.id,
+                'SET players.#pid = :t ADD players_joined :one, version :one',
+                'attribute_not_exists(players.#pid) AND players_joined < last_seat',
+                {':t': joined_at},
+            )
+
+        elif user.id in game.players:
+            # player already in game so OK
+            return make_response(s.OK, {'id': game_id, 'joined_at': game.players[user.id]})
+
+        elif game.players_joined >= game.table_size:
+            return make_response(s.CONFLICT, {'message': 'Unable to join - game is full'})
+
+        else:
+            game.players[user.id] = joined_at
+            game.players_joined += 1
+            game_op = seat_update(game, version)
 
         try:
-            game = db.get_item(Key=GameMeta.make_key(game_id))['Item']
+            db_client.transact_write_items(
+                TransactItems=[
+                    game_op,
+                    join_user_update(user, game_id),
+                    version_bump(game_id),
+                ]
+            )
+        except db_client.exceptions.TransactionCanceledException as e:
+
+            changed, item = failed_game(e)
+
+            if not changed:
+                log.error('User %s unable to join game %s: %s', user.id, game_id, e)
+                return make_response(s.CONFLICT, {'message': 'Player unable to join'})
+
+            if not item:
+                return make_response(s.NOT_FOUND, {'message': 'Could not find game'})
+
+            log.info('Game %s not as assumed while user %s was joining', game_id, user.id)
+            game, version = GameMeta(**item), item.get('version', None)
+            continue
+
+        return make_response(s.OK, {'id': game_id, 'joined_at': joined_at})
+
+    return make_response(s.CONFLICT, {'message': 'Game is busy, try again'})
 
-            if game['players_joined'] == game['table_size']:
-                return make_response(s.CONFLICT, {'message': 'Unable to join - game is full'})
-            elif user.id in game['players']:
-                # player already in game so OK
-                return make_response(s.OK, GameMeta(**response['Item']).to_dict())
-        except:
-            pass
 
-        return make_response(s.CONFLICT, {'message': 'Player unable to join'})
+def add_bots(user: User, game_id: str):
+    '''Fills the free seats of the user's game with bots so it can be dealt
 
+    Only the creator can add bots. Bots are counted rather than named (see
+    seat_order), so the table is filled by a single write whatever its size,
+    and a player who joins first just leaves one bot fewer.
+    '''
 
-    response = db.get_item(
-        Key=GameMeta.make_key(game_id)
+    try:
+        item = db.update_item(
+            Key=GameMeta.make_key(game_id),
+            UpdateExpression='SET players_joined = table_size REMOVE lobby_pk, lobby_sk ADD version :one',
+            ConditionExpression='created_by = :uid AND players_joined < table_size',
+            ExpressionAttributeValues={':uid': user.id, ':one': 1},
+            ReturnValues='ALL_NEW',
+            ReturnValuesOnConditionCheckFailure='ALL_OLD',
+        )['Attributes']
+    except ClientError as e:
+
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+        item = e.response.get('Item', None)
+
+        if not item:
+            return make_response(s.NOT_FOUND, {'message': 'Could not find game'})
+
+        if deserializer.deserialize(item['created_by']) != user.id:
+            return make_response(s.FORBIDDEN, {'message': 'Only the creator can add bots'})
+
+        return make_response(s.CONFLICT, {'message': 'Game is already full'})
+
+    # counted after the write, so a poll in between sees the bots on its next request
+    db.update_item(
+        Key={'pk': f'GAME#{game_id}', 'sk': VERSION_SK},
+        UpdateExpression='ADD version :one',
+        ExpressionAttributeValues={':one': 1},
     )
 
-    if 'Item' not in response:
-        return make_response(s.OK, {'message', 'User added but could not get game data'})
+    bots = GameMeta(**item).bots
+
+    log.info('Added %d bots to game %s', len(bots), game_id)
 
-    return make_response(s.OK, GameMeta(**response['Item']).to_dict())
+    return make_response(s.OK, {
+        'id': game_id,
+        'bots': bots,
+    })
 
 
 def exit_game(user: User, game_id: str):
-    '''Removes a user from the game metadata'''
+    '''Removes a user from the game, freeing the seat and relisting the game in one transaction
+
+    As with joining, the seat is freed in place unless the table was full, when
+    the game returned by the failed write is written back relisted.
+    '''
 
     if not user.in_game:
-        return (s.CONFLICT, {'message': 'Cannot exit - not currently playing'})
+        return make_response(s.CONFLICT, {'message': 'Cannot exit - not currently playing'})
 
-    response = db.get_item(
-        Key=GameMeta.make_key(game_id)
-    )
+    game, version = None, None
 
-    if 'Item' not in response:
-        return make_response(s.NOT_FOUND, {'message', 'Could not find game meta'})
+    for _ in range(SEAT_ATTEMPTS):
 
-    game: GameMeta = GameMeta(**response['Item'])
+        if not game:
+            game_op = seat_key_update(
+                game_id,
+                user.id,
+                'REMOVE players.#pid ADD players_joined :minus, version :one',
+                'attribute_exists(players.#pid) AND players_joined < table_size',
+                {':minus': -1},
+            )
+
+        elif user.id not in game.players:
+            return make_response(s.CONFLICT, {'message': 'User not found in game'})
+
+        else:
+            del game.players[user.id]
+            game.players_joined -= 1
+            game_op = seat_update(game, version)
+
+        try:
+            db_client.transact_write_items(
+                TransactItems=[
+                    game_op,
+                    {
+                        'Update': {
+                            'TableName': table,
+                            'Key': as_dynamo_dict(user.get_key()),
+                            'UpdateExpression': 'set in_game = :g, game_id = :gid ADD version :v',
+                            'ConditionExpression': 'game_id = :old',
+                            'ExpressionAttributeValues': {
+                                ':g': serializer.serialize(False),
+                                ':gid': serializer.serialize(None),
+                                ':old': serializer.serialize(game_id),
+                                ':v': { 'N': '1' },
+                            },
+                        }
+                    },
+                    version_bump(game_id),
+                ]
+            )
+        except db_client.exceptions.TransactionCanceledException as e:
+
+            changed, item = failed_game(e)
+
+            if not changed:
+                log.error('Could not remove user due to exception %s', e)
+                return make_response(s.CONFLICT, {'message': 'User not found in game'})
+
+            if not item:
+                return make_response(s.CONFLICT, {'message': 'User not found in game'})
+
+            log.info('Game %s not as assumed while user %s was exiting', game_id, user.id)
+            game, version = GameMeta(**item), item.get('version', None)
+            continue
+
+        log.info('User %s exited game %s', user.id, game_id)
+        return make_response(200)
+
+    return make_response(s.CONFLICT, {'message': 'Game is busy, try again'})
+
+
+def join_queue(user: User, body: dict):
+    '''Adds the user to the matchmaking queue for a game type and table size'''
+
+    if user.in_game:
+        return make_response(s.CONFLICT, {'message': 'Cannot queue while currently playing'})
+
+    if user.queue_pk:
+        return make_response(s.CONFLICT, {'message': 'Already queued for a match'})
+
+    body = body or {}
+    game_type = body.get('game_type', GameTypesEnum.SHD)
+
+    if game_type not in GameTypesEnum.to_list():
+        return make_response(s.BAD_REQUEST, {'message': 'Invalid game type'})
 
     try:
-        user_index = game.players.index(user.id)
-    except ValueError:
-        return make_response(s.CONFLICT, {'message': 'User not found in game'})
-    
+        table_size = int(body.get('table_size', GameMeta.table_size))
+    except (TypeError, ValueError):
+        return make_response(s.BAD_REQUEST, {'message': 'Invalid table size'})
+
+    if not 2 <= table_size <= MAX_TABLE_SIZE:
+        return make_response(s.BAD_REQUEST, {'message': 'Invalid table size'})
+
+    entry = QueueEntry(user_id=user.id, game_type=game_type, table_size=table_size)
+
+    log.info('Queueing user %s in %s', user.id, entry.pk)
+
     try:
-        response = db_client.transact_write_items(
+        db_client.transact_write_items(
             TransactItems=[
+                {
+                    'Put': {
+                        'TableName': table,
+                        'Item': as_dynamo_dict(asdict(entry)),
+                        'ConditionExpression': 'attribute_not_exists(pk)',
+                    }
+                },
                 {
                     'Update': {
                         'TableName': table,
-                        'Key': as_dynamo_dict(GameMeta.make_key(game_id)),
-                        'UpdateExpression': f'SET players_joined = players_joined - :p REMOVE players[{user_index}]',
-                        'ConditionExpression': f'players[{user_index}] = :pid',
+                        'Key': as_dynamo_dict(user.get_key()),
+                        'UpdateExpression': 'SET queue_pk = :qpk, queue_sk = :qsk ADD version :v',
+                        'ConditionExpression': 'attribute_exists(pk) AND in_game <> :t AND attribute_not_exists(queue_pk)',
                         'ExpressionAttributeValues': {
-                            ':p': { 'N': '1' },
-                            ':pid': serializer.serialize(user.id),
-                        },
-                        'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+                            ':qpk': serializer.serialize(entry.pk),
+                            ':qsk': serializer.serialize(entry.sk),
+                            ':t': serializer.serialize(True),
+                            ':v': { 'N': '1' },
+                        }
+                    }
+                }
+            ]
+        )
+    except db_client.exceptions.TransactionCanceledException as e:
+        log.error('User %s unable to join queue: %s', user.id, e)
+        return make_response(s.CONFLICT, {'message': 'Unable to join queue'})
+
+    return make_response(s.CREATED, {
+        'game_type': entry.game_type,
+        'table_size': entry.table_size,
+        'enqueued_at': entry.enqueued_at,
+    })
+
+
+def leave_queue(user: User):
+    '''Removes the user from the matchmaking queue if they have not been matched yet'''
+
+    if not user.queue_pk:
+        return make_response(s.CONFLICT, {'message': 'Not queued for a match'})
+
+    try:
+        db_client.transact_write_items(
+            TransactItems=[
+                {
+                    'Delete': {
+                        'TableName': table,
+                        'Key': as_dynamo_dict({'pk': user.queue_pk, 'sk': user.queue_sk}),
+                        'ConditionExpression': 'attribute_exists(pk)',
                     }
                 },
                 {
                     'Update': {
                         'TableName': table,
                         'Key': as_dynamo_dict(user.get_key()),
-                        'UpdateExpression': 'set in_game = :g, game_id = :gid',
+                        'UpdateExpression': 'REMOVE queue_pk, queue_sk ADD version :v',
+                        'ConditionExpression': 'queue_sk = :qsk',
                         'ExpressionAttributeValues': {
-                            ':g': serializer.serialize(False),
-                            ':gid': serializer.serialize(None)
-                        },
-                        'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+                            ':qsk': serializer.serialize(user.queue_sk),
+                            ':v': { 'N': '1' },
+                        }
                     }
                 }
-                
             ]
         )
-
     except db_client.exceptions.TransactionCanceledException as e:
-        log.error(f'Could not remove user due to exception {e}')
-        return make_response(s.INTERNAL_SERVER_ERROR, {'message': 'Could not remove user from game'}) 
-
-    log.info(f'User {user.id} exited game {game_id}')
-    return make_response(200)
+        # the matcher got there first
+        log.error('User %s unable to leave queue: %s', user.id, e)
+        return make_response(s.CONFLICT, {'message': 'Already matched'})
 
+    return make_response(s.OK)
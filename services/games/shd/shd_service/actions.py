@@ -0,0 +1,176 @@
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from cards_common.log import get_logger, Fields
+
+from shd_service.game import Game
+from shd_service.exceptions import InvalidMessage
+
+log = get_logger()
+
+
+class Actions:
+    PING = 'PING'
+    DEAL = 'DEAL'
+    SWAP = 'SWAP'
+    READY = 'READY'
+    PLAY = 'PLAY'
+    BURN = 'BURN'
+    PICKUP = 'PICKUP'
+    # ends a game only bots are left in, never sent by clients
+    RESOLVE = 'RESOLVE'
+
+
+# game and card ids are uuids, anything much longer is not one
+MAX_ID_LENGTH = 64
+# at most the four cards of a rank are played together
+MAX_PLAY_CARDS = 4
+
+ID = 'id'
+IDS = 'ids'
+
+# data fields each action must carry
+SCHEMAS = {
+    Actions.PING: {},
+    Actions.DEAL: {},
+    Actions.SWAP: {'hand': ID, 'table': ID},
+    Actions.READY: {},
+    Actions.PLAY: {'cardIds': IDS},
+    Actions.BURN: {},
+    Actions.PICKUP: {},
+}
+
+
+def is_id(value: Any) -> bool:
+    return isinstance(value, str) and 0 < len(value) <= MAX_ID_LENGTH
+
+
+def is_ids(value: Any) -> bool:
+    return (
+        isinstance(value, list)
+        and 0 < len(value) <= MAX_PLAY_CARDS
+        and all(is_id(v) for v in value)
+    )
+
+
+def compile_schema(action_type: str, fields: dict) -> Callable[[Any], None]:
+    '''Check of an action's data, built once so a message costs only the checks it needs
+
+    Raises InvalidMessage when a field is missing or of the wrong kind. Fields
+    that are not in the schema are ignored, as the engine never reads them.
+    '''
+
+    checks = [(name, is_id if kind == ID else is_ids) for name, kind in fields.items()]
+
+    def validate(data: Any):
+
+        if not checks:
+            if data is not None and not isinstance(data, dict):
+                raise InvalidMessage(f'{action_type} data must be an object')
+            return
+
+        if not isinstance(data, dict):
+            raise InvalidMessage(f'{action_type} needs data')
+
+        for name, check in checks:
+            if not check(data.get(name, None)):
+                raise InvalidMessage(f'{action_type} has invalid {name}')
+
+    return validate
+
+
+VALIDATORS = {action_type: compile_schema(action_type, fields) for action_type, fields in SCHEMAS.items()}
+
+
+@dataclass
+class Action:
+
+    game_id: str = None
+    type: str = None
+    data: dict = None
+    # client generated, so a retried message is only applied once
+    id: str = None
+
+    @classmethod
+    def from_message(cls, message: dict):
+
+        if not isinstance(message, dict):
+            raise InvalidMessage('Message must be an object')
+
+        game_id = message.get('gameId', None)
+        action_type = message.get('type', None)
+        data = message.get('data', None)
+        action_id = message.get('actionId', None)
+
+        if not game_id:
+            raise InvalidMessage('No game ID provided')
+        elif not action_type:
+            raise InvalidMessage('No action or type')
+        elif not is_id(game_id):
+            raise InvalidMessage('Invalid game ID')
+        elif not isinstance(action_type, str) or action_type not in VALIDATORS:
+            raise InvalidMessage('Unknown action type')
+
+        elif action_id is not None and not is_id(action_id):
+            raise InvalidMessage('Invalid action ID')
+
+        VALIDATORS[action_type](data)
+
+        return cls(
+            game_id=game_id,
+            type=action_type,
+            data=data,
+            id=action_id,
+        )
+
+
+def apply_action(game: Game, player_id: str, action_type: str, data: dict = None):
+    '''Applies a player's action to the game, as sent in a websocket message'''
+
+    if action_type == Actions.DEAL:
+
+        game.deal(player_id)
+
+    elif action_type == Actions.SWAP:
+
+        log.info(Fields('swap', player=player_id, hand=data['hand'], table=data['table']))
+        game.swap_table(player_id, data['hand'], data['table'])
+
+    elif action_type == Actions.READY:
+
+        log.info(Fields('ready', player=player_id))
+        game.player_ready(player_id)
+
+    elif action_type == Actions.PLAY:
+
+        card_ids = data.get('cardIds', None) or [] 
+
+        game_player = game.get_player(player_id)
+
+        if not game_player.has_hand and not game_player.has_table:
+
+            log.info(Fields('play hidden', player=player_id, cards=card_ids))
+            game.play_hidden(player_id, card_ids[0])
+
+        else:
+
+            log.info(Fields('play', player=player_id, cards=card_ids))
+            game.play_cards(player_id, card_ids)
+
+    elif action_type == Actions.PICKUP:
+
+        log.info(Fields('pickup', player=player_id))
+        game.pickup_table(player_id)
+
+    elif action_type == Actions.BURN:
+
+        log.info(Fields('burn', player=player_id))
+        game.burn_table(player_id)
+
+    elif action_type == Actions.RESOLVE:
+
+        log.info(Fields('resolve', player=player_id))
+        game.resolve()
+
+    else:
+        raise InvalidMessage(f'Unknown action type {action_type}')
@@ -0,0 +1,183 @@
+'''End of game pipeline, taking a finished game out of the live partitions
+
+The result is archived as one compact item, every player's user item is
+released in one transaction, the players' clients are sent the final state
+and the game's live items are deleted in batches, so the live table holds
+only games in progress.
+
+Each step can be repeated, and the END state is deleted last, so a teardown
+cut short is finished by running it again from the state left behind.
+'''
+import os
+import time
+import zlib
+
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+from cards_common.aws import Lazy, gateway_client
+from cards_common.data import projection, query_items
+from cards_common.encoding import dumps_bytes
+from cards_common.log import get_logger, Fields
+from cards_common.views import STATE_SK
+
+from . import db, db_client, db_resource, table
+
+from shd_service.bot import is_bot
+from shd_service.game import Game
+
+log = get_logger()
+
+serializer = TypeSerializer()
+
+# finished games can be kept apart from the live table
+archive_table = os.environ.get('ARCHIVE_TABLE', table)
+archive = Lazy(lambda: db_resource.Table(archive_table))
+
+WEBSOCKET_ENDPOINT = os.environ.get('WEBSOCKET_ENDPOINT', None)
+gateway = Lazy(lambda: gateway_client(WEBSOCKET_ENDPOINT)) if WEBSOCKET_ENDPOINT else None
+
+KEY_FIELDS = projection('pk', 'sk')
+CONNECTION_FIELDS = projection('connection_id')
+
+
+def make_key(game_id: str) -> dict:
+    return {
+        'pk': f'ARCHIVE#{game_id}',
+        'sk': 'RESULT',
+    }
+
+
+def archive_item(game: Game, game_type: str, record: dict = None) -> dict:
+    '''Result and scores, with the final state and action record compressed'''
+
+    return {
+        **make_key(game.game_id),
+        'id': game.game_id,
+        'game_type': game_type,
+        'players': [p.id for p in game.state.players],
+        'finished_at': int(time.time()),
+        **game.results(),
+        'state': zlib.compress(dumps_bytes({'game': game.to_dict(), 'record': record})),
+    }
+
+
+def spectator_connections(game_id: str) -> list:
+
+    return [
+        c['connection_id'] for c in query_items(
+            db,
+            KeyConditionExpression=Key('pk').eq(f'GAME#{game_id}') & Key('sk').begins_with('VIEW#'),
+            **CONNECTION_FIELDS
+        )
+    ]
+
+
+def post_game_end(game: Game, connection_ids: list):
+    '''Sends the final view and result to players and spectators, as the live
+    items it would stream from are deleted'''
+
+    if not gateway:
+        log.warning('No websocket endpoint to send the end of game %s', game.game_id)
+        return
+
+    connection_ids = connection_ids + spectator_connections(game.game_id)
+
+    data = dumps_bytes({
+        'type': 'game_end',
+        'data': {**game.results(), 'state': game.sanitised_state()},
+    })
+
+    for connection_id in connection_ids:
+        try:
+            gateway.post_to_connection(ConnectionId=connection_id, Data=data)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'GoneException':
+                raise
+            log.warning('Gone exception for %s', connection_id)
+
+
+def release_players(game_id: str, player_ids: list):
+    '''Takes every player out of the game in one transaction
+
+    Each update is conditional on the user still being in this game. Players
+    who have already moved on are dropped and the rest retried.
+    '''
+
+    updates = [
+        {
+            'Update': {
+                'TableName': table,
+                'Key': {
+                    'pk': serializer.serialize(f'USER#{player_id}'),
+                    'sk': serializer.serialize('ENTITY'),
+                },
+                'UpdateExpression': 'set in_game = :g, game_id = :gid ADD version :v',
+                'ConditionExpression': 'game_id = :old',
+                'ExpressionAttributeValues': {
+                    ':g': serializer.serialize(False),
+                    ':gid': serializer.serialize(None),
+                    ':old': serializer.serialize(game_id),
+                    ':v': {'N': '1'},
+                },
+            }
+        }
+        for player_id in player_ids
+    ]
+
+    while updates:
+        try:
+            db_client.transact_write_items(TransactItems=updates)
+            return
+        except db_client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+            remaining = [
+                update for update, reason in zip(updates, reasons)
+                if reason.get('Code', None) != 'ConditionalCheckFailed'
+            ]
+            if not reasons or len(remaining) == len(updates):
+                raise
+            log.warning('Not releasing %s players no longer in game %s', len(updates) - len(remaining), game_id)
+            updates = remaining
+
+
+def delete_game_items(game_id: str) -> int:
+    '''Deletes every item in the game's partition, returning the number deleted'''
+
+    deleted = 0
+    state_key = None
+
+    # keys are deleted as each page arrives, so memory stays bounded for large audiences
+    with db.batch_writer() as batch:
+        for key in query_items(db, KeyConditionExpression=Key('pk').eq(f'GAME#{game_id}'), **KEY_FIELDS):
+            if key['sk'] == STATE_SK:
+                state_key = key
+                continue
+            batch.delete_item(Key=key)
+            deleted += 1
+
+    # the state goes once everything else has, as it is what a retry resumes from
+    if state_key:
+        db.delete_item(Key=state_key)
+        deleted += 1
+
+    return deleted
+
+
+def end_game(game: Game, game_type: str, record: dict = None, connection_ids: list = None):
+    '''Archives a finished game and removes it from the live data'''
+
+    archive.put_item(Item=archive_item(game, game_type, record))
+
+    release_players(game.game_id, [p.id for p in game.state.players if not is_bot(p.id)])
+
+    # clients missing the end still see the game gone, so it does not hold up the rest
+    try:
+        post_game_end(game, connection_ids or [])
+    except Exception as e:
+        log.warning('Unable to send the end of game %s: %s', game.game_id, e)
+
+    deleted = delete_game_items(game.game_id)
+
+    log.info(Fields('game archived', game_id=game.game_id, deleted=deleted, **game.results()))
@@ -0,0 +1,391 @@
+'''Bot players, so a game can start without waiting for a full table
+
+Bots take their turns inside the handler invocation, straight after the
+human move that handed them the turn. A move is picked by determinised Monte
+Carlo search: the cards the bot cannot see (other hands, every hidden card
+and the stack) are dealt at random onto a copy of the game, which is then
+played out with a simple policy. Each candidate move is scored by its
+average finishing position over as many rollouts as fit the time budget.
+
+All the bot turns of one invocation share a budget well inside the function
+timeout, and once it is spent bots play the simple policy. Once only bots
+hold cards nobody is left to send another message, so the game is played
+out with the simple policy there and then, and if that runs long the bots
+left are ranked by the cards they hold. The same goes for a bot left to act
+that cannot, as no human message would move the game on either.
+'''
+import os
+import random
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from cards_common.log import get_logger, Fields
+from cards_common.seats import is_bot
+
+from shd_service.game import Game
+from shd_service.actions import Actions
+from shd_service.entities import Player, Status, evolve
+
+log = get_logger()
+
+ENABLED = os.environ.get('BOTS_ENABLED', '1') == '1'
+
+# search time per move, the handler waits on every bot turn in a row
+MOVE_BUDGET_MS = float(os.environ.get('BOT_MOVE_BUDGET_MS', 50))
+
+# time for every bot turn in one invocation, well inside the 3s function timeout
+TURN_BUDGET_MS = float(os.environ.get('BOT_TURN_BUDGET_MS', 1000))
+
+# bounds a rollout or a run of bot turns, should the engine stop progressing
+MAX_ROLLOUT_MOVES = 300
+MAX_BOT_MOVES = 60
+
+# moves a game left to the bots is played out for before they are ranked
+MAX_ENDGAME_MOVES = 1000
+
+# replaced in tests so searches do not depend on the machine's speed
+clock = time.perf_counter
+
+# fields dealt at random when determinising
+CARD_FACE = ('suit', 'rank', 'value', 'suit_value', 'is_special')
+
+Move = Tuple[str, Optional[dict]]
+
+
+def bots_only(game: Game) -> bool:
+    '''Whether every player still holding cards is a bot, so no human will act again'''
+
+    state = game.state
+
+    return state.status == Status.PLAYING and all(is_bot(p.id) for p in state.players if not p.is_out)
+
+
+def candidate_moves(game: Game, player: Player) -> List[Move]:
+    '''Moves worth searching for the active player, an empty list if there are none'''
+
+    state = game.state
+
+    if player.can_burn:
+        return [(Actions.BURN, None)]
+
+    cards = player.hand if player.has_hand else player.table
+
+    if not cards:
+        if player.has_hidden:
+            # the bot cannot tell its hidden cards apart
+            return [(Actions.PLAY, {'cardIds': [player.hidden[0].id]})]
+        # a hidden card that could not be played is on the table
+        return [(Actions.PICKUP, None)] if state.table else []
+
+    by_value = {}
+    for card in cards:
+        if state.can_play_card(card):
+            by_value.setdefault(card.value, []).append(card.id)
+
+    if not by_value:
+        return [(Actions.PICKUP, None)]
+
+    moves = []
+    for card_ids in by_value.values():
+        moves.append((Actions.PLAY, {'cardIds': card_ids}))
+        if len(card_ids) > 1:
+            # holding some back can keep a burn for later
+            moves.append((Actions.PLAY, {'cardIds': card_ids[:1]}))
+
+    return moves
+
+
+def default_move(game: Game, player: Player) -> Optional[Move]:
+    '''Rollout policy: play every card of the lowest playable value'''
+
+    moves = candidate_moves(game, player)
+
+    if not moves:
+        return None
+
+    plays = [m for m in moves if m[0] == Actions.PLAY]
+
+    if len(plays) <= 1:
+        return moves[0]
+
+    cards = {c.id: c for c in player.hand + player.table}
+
+    return min(plays, key=lambda m: (cards[m[1]['cardIds'][0]].value, -len(m[1]['cardIds'])))
+
+
+def perform(game: Game, player: Player, move: Move):
+    '''Runs a move on the engine directly, as apply_action would but without logging'''
+
+    action_type, data = move
+
+    if action_type == Actions.PLAY:
+        if not player.has_hand and not player.has_table:
+            game.play_hidden(player.id, data['cardIds'][0])
+        else:
+            game.play_cards(player.id, data['cardIds'])
+
+    elif action_type == Actions.BURN:
+        game.burn_table(player.id)
+
+    elif action_type == Actions.PICKUP:
+        game.pickup_table(player.id)
+
+    elif action_type == Actions.READY:
+        game.player_ready(player.id)
+
+    elif action_type == Actions.RESOLVE:
+        game.resolve()
+
+
+def perform_or_fallback(game: Game, player: Player, move: Move) -> Optional[Move]:
+    '''Runs a move, or the default policy's then a pickup should the engine reject it
+
+    Returns the move made, None if the engine rejected every one.
+    '''
+
+    fallbacks = [move, default_move(game, player), (Actions.PICKUP, None)]
+
+    for i, candidate in enumerate(fallbacks):
+
+        if candidate is None or candidate in fallbacks[:i]:
+            continue
+
+        try:
+            perform(game, player, candidate)
+            return candidate
+        except Exception as e:
+            log.warning('Bot %s could not %s in game %s: %s', player.id, candidate[0], game.game_id, e)
+
+    return None
+
+
+def determinise(game: Game, player_id: str, rng: random.Random) -> Game:
+    '''Copy of the game with the cards hidden from the player dealt at random'''
+
+    state = game.state
+
+    unseen = list(state.stack)
+    for p in state.players:
+        unseen += p.hidden
+        if p.id != player_id:
+            unseen += p.hand
+
+    faces = [tuple(getattr(c, f) for f in CARD_FACE) for c in unseen]
+    rng.shuffle(faces)
+
+    # ids stay with their slots so moves chosen on the copy apply to the game
+    dealt = {c.id: evolve(c, **dict(zip(CARD_FACE, face))) for c, face in zip(unseen, faces)}
+    deal = lambda pile: tuple(dealt.get(c.id, c) for c in pile)
+
+    world = game.copy()
+    world.state = evolve(
+        state,
+        players=tuple(evolve(p, hand=deal(p.hand), hidden=deal(p.hidden)) for p in state.players),
+        stack=deal(state.stack),
+    )
+
+    return world
+
+
+def score(game: Game, player_id: str) -> float:
+    '''1 for going out first down to 0 for the shithead, by cards held when unfinished'''
+
+    state = game.state
+    n_players = state.n_players
+
+    if player_id in state.finished:
+        return 1 - state.finished.index(player_id) / (n_players - 1)
+
+    held = {p.id: len(p.hand) + len(p.table) + len(p.hidden) for p in state.players}
+    most = max(held.values()) or 1
+
+    return 0.5 * (1 - held[player_id] / most)
+
+
+def rollout(world: Game, player_id: str, move: Move, deadline: float = None) -> Optional[float]:
+    '''Plays the move then the rest of the game with the default policy
+
+    Returns None if the deadline passes first, as the rollout is unfinished.
+    '''
+
+    try:
+        perform(world, world.state.get_player(player_id), move)
+
+        for _ in range(MAX_ROLLOUT_MOVES):
+
+            if deadline is not None and clock() >= deadline:
+                return None
+
+            state = world.state
+
+            if state.status != Status.PLAYING or player_id in state.finished:
+                break
+
+            player = state.active_player
+            next_move = default_move(world, player)
+
+            if not next_move:
+                break
+
+            perform(world, player, next_move)
+
+    except Exception:
+        # a move the engine rejects in this world says nothing about the others
+        return 0.0
+
+    return score(world, player_id)
+
+
+def choose_move(game: Game, player_id: str, budget_ms: float = None, rng: random.Random = None) -> Optional[Move]:
+    '''Best scoring candidate over as many determinised rollouts as fit the budget
+
+    The deadline is checked within rollouts too, so the search stops on time
+    and returns the best move found so far.
+    '''
+
+    player = game.state.get_player(player_id)
+    moves = candidate_moves(game, player)
+
+    if len(moves) <= 1:
+        return moves[0] if moves else None
+
+    rng = rng or random.Random()
+    budget_ms = MOVE_BUDGET_MS if budget_ms is None else budget_ms
+    deadline = clock() + budget_ms / 1000
+
+    totals = [0.0] * len(moves)
+    counts = [0] * len(moves)
+
+    while clock() < deadline:
+        world = determinise(game, player_id, rng)
+        for i, move in enumerate(moves):
+            # copies share the determinised state, so each costs nothing
+            result = rollout(world.copy(), player_id, move, deadline)
+            if result is None:
+                break
+            totals[i] += result
+            counts[i] += 1
+
+    searched = [i for i in range(len(moves)) if counts[i]]
+
+    if not searched:
+        return default_move(game, player)
+
+    best = max(searched, key=lambda i: totals[i] / counts[i])
+
+    log.debug(Fields('bot search', player=player_id, rollouts=sum(counts), moves=len(moves)))
+
+    return moves[best]
+
+
+def next_bot_move(game: Game, budget_ms: float = None, rng: random.Random = None) -> Optional[Tuple[str, str, Optional[dict]]]:
+    '''(bot id, action type, data) when a bot has something to do'''
+
+    state = game.state
+
+    if state.status == Status.PREP:
+        bot = next((p for p in state.players if is_bot(p.id) and not p.is_ready), None)
+        return (bot.id, Actions.READY, None) if bot else None
+
+    if state.status != Status.PLAYING:
+        return None
+
+    player = next((p for p in state.players if p.is_active), None)
+
+    if not player or not is_bot(player.id):
+        return None
+
+    move = choose_move(game, player.id, budget_ms, rng)
+
+    return (player.id, *move) if move else None
+
+
+def play_out(game: Game, deadline: float) -> Iterator[Tuple[str, str, Optional[dict]]]:
+    '''Finishes a game only bots are left in with the default policy, yielding each move
+
+    Should that not settle it within MAX_ENDGAME_MOVES or the deadline, the
+    bots still holding cards are ranked by how many they hold.
+    '''
+
+    for _ in range(MAX_ENDGAME_MOVES):
+
+        if game.state.status != Status.PLAYING or clock() >= deadline:
+            break
+
+        player = game.state.active_player
+        move = default_move(game, player)
+
+        if not move:
+            break
+
+        perform(game, player, move)
+
+        yield (player.id, *move)
+
+    if game.state.status == Status.PLAYING:
+        yield resolve(game)
+
+
+def resolve(game: Game) -> Tuple[str, str, Optional[dict]]:
+    '''Ranks the players still holding cards, as the move of the active player'''
+
+    player = game.state.active_player
+    log.info(Fields('bots resolved', game_id=game.game_id, cards=[len(p.hand) + len(p.table) + len(p.hidden) for p in game.state.players]))
+    game.resolve()
+
+    return (player.id, Actions.RESOLVE, None)
+
+
+def bot_to_act(game: Game) -> bool:
+    '''Whether a game in play waits on a bot, which only this invocation can move'''
+
+    state = game.state
+    player = next((p for p in state.players if p.is_active), None)
+
+    return state.status == Status.PLAYING and player is not None and is_bot(player.id)
+
+
+def play_bots(game: Game, budget_ms: float = None, rng: random.Random = None) -> Iterator[Tuple[str, str, Optional[dict]]]:
+    '''Plays bot turns until a human is to act or the game ends, yielding each move
+
+    Turns share TURN_BUDGET_MS. Once it is spent the remaining turns take the
+    default policy rather than a search, so a human is never left waiting on
+    a bot. A move the engine rejects falls back to the default policy, and a
+    bot that is still to act once the bots stop has the game resolved.
+    '''
+
+    if not ENABLED:
+        return
+
+    budget_ms = MOVE_BUDGET_MS if budget_ms is None else budget_ms
+    deadline = clock() + TURN_BUDGET_MS / 1000
+
+    for _ in range(MAX_BOT_MOVES):
+
+        if bots_only(game):
+            yield from play_out(game, deadline)
+            return
+
+        remaining_ms = max(0, (deadline - clock()) * 1000)
+        bot_move = next_bot_move(game, min(budget_ms, remaining_ms), rng)
+
+        if not bot_move:
+            break
+
+        bot_id, action_type, data = bot_move
+
+        log.info(Fields('bot move', player=bot_id, type=action_type, data=data))
+        move = perform_or_fallback(game, game.state.get_player(bot_id), (action_type, data))
+
+        if not move:
+            break
+
+        yield (bot_id, *move)
+
+    else:
+        log.warning('Stopped bots in game %s after %d moves', game.game_id, MAX_BOT_MOVES)
+
+    # a bot that cannot move would hold the game up for good, so it ends here
+    if bot_to_act(game):
+        log.warning('Bots stuck in game %s', game.game_id)
+        yield resolve(game)
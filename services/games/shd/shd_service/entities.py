@@ -1,15 +1,77 @@
+'''Entities are immutable: a change builds a new object with evolve, and
+anything not changed (piles, cards, other players) is shared with the old one.
+Holding on to a state is a snapshot, so rolling back or searching never
+copies the game.
+'''
 import uuid
-from enum import Enum
-from hashlib import md5
-from random import shuffle
-from random import randint, random
-from typing import Dict, List, Any
-from dataclasses import dataclass, field, asdict
+from typing import Tuple
+from dataclasses import dataclass, field, is_dataclass
+
+from cards_common.views import hidden_card, player_view, public_player, sanitised_state
 
 from shd_service.exceptions import InvalidState, InvalidAction
 from shd_service.constants import RANKS, SPECIALS, SUITS
 
-@dataclass
+
+def evolve(entity, **changes):
+    '''Copy of an entity with some fields changed, sharing every other field
+
+    Skips __init__ and __post_init__, as every field is already built.
+    '''
+
+    new = object.__new__(type(entity))
+    new.__dict__.update(entity.__dict__)
+    new.__dict__.update(changes)
+    return new
+
+
+def plain(value):
+    '''Entity as stored - dicts and lists all the way down'''
+
+    if is_dataclass(value):
+        return {k: plain(v) for k, v in value.__dict__.items()}
+
+    if isinstance(value, (tuple, list)):
+        return [plain(v) for v in value]
+
+    return value
+
+
+def remove_at(pile: tuple, index: int) -> tuple:
+    return pile[:index] + pile[index + 1:]
+
+
+# stored by older versions, now derived from the id with card_jitter
+JITTER_FIELDS = ('rotation', 'x_offset', 'y_offset')
+
+
+def as_cards(pile) -> Tuple['Card', ...]:
+    return tuple(
+        c if isinstance(c, Card) else Card(**{k: v for k, v in c.items() if k not in JITTER_FIELDS})
+        for c in pile
+    )
+
+
+def card_jitter(card_id: str) -> Tuple[int, int, int]:
+    '''Rotation (0-359 degrees) and x and y offsets (0-5) a client draws a card with
+
+    Presentation only, so never stored or sent: clients work it out from the
+    card id the same way. h is the 32 bit FNV-1a hash of the id's UTF-8 bytes
+    (offset basis 2166136261, prime 16777619, multiplying modulo 2^32), then
+
+        rotation = h % 360
+        x_offset = (h >> 9) % 6
+        y_offset = (h >> 17) % 6
+    '''
+
+    h = 2166136261
+    for byte in card_id.encode('utf-8'):
+        h = ((h ^ byte) * 16777619) & 0xffffffff
+
+    return h % 360, (h >> 9) % 6, (h >> 17) % 6
+
+
+@dataclass(frozen=True)
 class Card(object):
 
     id: str = None
@@ -21,36 +83,28 @@ class Card(object):
     is_hidden: bool = None
     order: int = None
     played_by: str = None
-    rotation: int = 0
-    x_offset: int = 0
-    y_offset: int = 0
 
     def __post_init__(self):
-        self.value = RANKS.index(self.rank) + 2
-        self.suit_value = SUITS.index(self.suit)
-        self.is_special = self.rank in SPECIALS
-        self.id = self.id or str(uuid.uuid4())
-        self.rotation = self.rotation or randint(0, 359) 
-        self.x_offset = self.x_offset or randint(0,5)
-        self.y_offset = self.y_offset or randint(0,5)
+        self.__dict__.update(
+            value=RANKS.index(self.rank) + 2,
+            suit_value=SUITS.index(self.suit),
+            is_special=self.rank in SPECIALS,
+            id=self.id or str(uuid.uuid4()),
+        )
 
     def to_hidden(self) -> dict:
-        return {
-            'id': self.id,
-            'is_hidden': self.is_hidden,
-            'order': self.order,
-        }
+        return hidden_card(self.__dict__)
 
 
-@dataclass
+@dataclass(frozen=True)
 class Player(object):
 
     id: str = None
     order: int = None
     sh_count: int = 0
-    hand: List[Card] = field(default_factory=list)
-    table: List[Card] = field(default_factory=list)
-    hidden: List[Card] = field(default_factory=list)
+    hand: Tuple[Card, ...] = ()
+    table: Tuple[Card, ...] = ()
+    hidden: Tuple[Card, ...] = ()
     is_dealer: bool = False
     is_active: bool = False
     is_ready: bool = False
@@ -61,9 +115,11 @@ class Player(object):
 
     def __post_init__(self):
         '''populate objects if dicts given'''
-        self.hand = [ Card(**c) for c in self.hand if type(c) == dict]
-        self.table = [ Card(**c) for c in self.table if type(c) == dict]
-        self.hidden = [ Card(**c) for c in self.hidden if type(c) == dict]
+        self.__dict__.update(
+            hand=as_cards(self.hand),
+            table=as_cards(self.table),
+            hidden=as_cards(self.hidden),
+        )
 
     @property
     def has_hand(self) -> bool:
@@ -77,31 +133,28 @@ class Player(object):
     def has_hidden(self) -> bool:
         return len(self.hidden) > 0
 
+    @property
+    def has_cards(self) -> bool:
+        return self.has_hand or self.has_table or self.has_hidden
+
     @property
     def has_special(self):
-        
+
         if self.has_hand:
             return any((c.is_special for c in self.hand))
         else:
             return any((c.is_special for c in self.table))
 
-    
+
     def sanitise_for_game(self) -> dict:
-        player = asdict(self)
-        for key in ['can_burn', 'can_play']:
-            del player[key]
-        player['hand'] = len(player['hand'])
-        player['hidden'] = [c.to_hidden() for c in self.hidden]
-        return player
+        return public_player(plain(self))
+
 
-    
     def sanitise_for_player(self):
-        player = asdict(self)
-        player['hidden'] = [c.to_hidden() for c in self.hidden]
-        return player
+        return player_view(plain(self))
 
 
-    def swap_table(self, hand_id: str = None, table_id: str = None):
+    def swap_table(self, hand_id: str = None, table_id: str = None) -> 'Player':
 
         if (self.is_ready):
             raise InvalidAction('Cannot swap after player is ready')
@@ -116,14 +169,14 @@ class Player(object):
         except ValueError:
             raise ValueError('Cannot find card on players table')
 
-        hand_card = self.hand.pop(hand_index)
-        table_card = self.table.pop(table_index)
+        hand_card = self.hand[hand_index]
+        table_card = self.table[table_index]
 
-        hand_card.order = table_card.order
-        table_card.order = None
-
-        self.hand.append(table_card)
-        self.table.append(hand_card)
+        return evolve(
+            self,
+            hand=remove_at(self.hand, hand_index) + (evolve(table_card, order=None),),
+            table=remove_at(self.table, table_index) + (evolve(hand_card, order=table_card.order),),
+        )
 
 
     def get_hand_index(self, card_id: str) -> int:
@@ -155,23 +208,28 @@ class Status(object):
     END: str = 'END'
 
 
-@dataclass
+@dataclass(frozen=True)
 class State(object):
 
     status: str = Status.INIT
     current_value: int = 0
     total_players: int = 3
-    players: List[Player] = field(default_factory=list)
-    table: List[Card] = field(default_factory=list)
-    stack: List[Card] = field(default_factory=list)
-    dead: List[Card] = field(default_factory=list)
+    players: Tuple[Player, ...] = ()
+    table: Tuple[Card, ...] = ()
+    stack: Tuple[Card, ...] = ()
+    dead: Tuple[Card, ...] = ()
+    # player ids in the order they went out
+    finished: Tuple[str, ...] = ()
 
     def __post_init__(self):
         '''populate objects if dicts given'''
-        self.players = [ Player(**p) for p in self.players if type(p) == dict ]
-        self.table = [ Card(**c) for c in self.table if type(c) == dict ]
-        self.stack = [ Card(**c) for c in self.stack if type(c) == dict ]
-        self.dead = [ Card(**c) for c in self.dead if type(c) == dict ]
+        self.__dict__.update(
+            players=tuple(p if isinstance(p, Player) else Player(**p) for p in self.players),
+            table=as_cards(self.table),
+            stack=as_cards(self.stack),
+            dead=as_cards(self.dead),
+            finished=tuple(self.finished),
+        )
 
     @property
     def n_players(self) -> int:
@@ -179,11 +237,11 @@ class State(object):
 
     @property
     def players_ready(self) -> int:
-        return len([ p for p in self.players if p.is_ready ])
+        return len([p for p in self.players if p.is_ready])
 
     @property
     def players_remaining(self) -> int:
-        return len([ p for p in self.players if not p.is_out ])
+        return len([p for p in self.players if not p.is_out])
 
     @property
     def active_player(self) -> Player:
@@ -196,23 +254,15 @@ class State(object):
     @property
     def next_player(self) -> Player:
 
-        next_order = self.active_player.order + 1
-        if next_order >= self.n_players:
-            next_order = 0
-        return next(
-            (p for p in self.players if p.order >= next_order and not p.is_out), 
-            None
-        )
+        # seats after the active player, wrapping round the table
+        active = self.active_player.order
+        seats = sorted(self.players, key=lambda p: (p.order - active - 1) % self.n_players)
+
+        return next((p for p in seats if not p.is_out), None)
 
     def sanitise_dict(self) -> dict:
+        return sanitised_state(plain(self))
 
-        state = asdict(self)
-        state['stack'] = len(self.stack)
-        state['dead'] = len(self.dead)
-        state['players'] = [p.sanitise_for_game() for p in self.players]
-        
-        return state
-        
 
     def get_player(self, player_id: str) -> Player:
 
@@ -222,10 +272,16 @@ class State(object):
         return player
 
 
+    def with_player(self, player: Player) -> 'State':
+        '''New state with the player in the same seat replaced'''
+
+        return evolve(self, players=tuple(player if p.id == player.id else p for p in self.players))
+
+
     def player_can_play(self, player_id) -> bool:
 
         player = self.get_player(player_id)
-        
+
         if player.has_special:
             return True
 
@@ -233,7 +289,7 @@ class State(object):
 
             if player.has_hand:
                 return any((c.value <= self.current_value for c in player.hand))
-                
+
             elif player.has_table:
                 return (any(c.value <= self.current_value for c in player.table))
 
@@ -241,7 +297,7 @@ class State(object):
 
             if player.has_hand:
                 return any((c.value >= self.current_value for c in player.hand))
-                
+
             elif player.has_table:
                 return (any(c.value >= self.current_value for c in player.table))
 
@@ -249,7 +305,16 @@ class State(object):
             return True
 
 
-    def burn_table(self):
-        self.dead += self.table
-        self.table = []
-        self.current_value = 0
+    def can_play_card(self, card: Card) -> bool:
+
+        if card.is_special:
+            return True
+
+        if self.current_value == 7:
+            return card.value <= 7
+
+        return card.value >= self.current_value
+
+
+    def burn_table(self) -> 'State':
+        return evolve(self, dead=self.dead + self.table, table=(), current_value=0)
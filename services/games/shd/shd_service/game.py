@@ -1,309 +1,398 @@
-from enum import Enum
-from hashlib import md5
 from random import shuffle
-from typing import Dict, List, Any
-from dataclasses import dataclass, field, asdict
+from typing import List
 
 from shd_service.constants import SUITS, RANKS
 from shd_service.exceptions import InvalidAction, InvalidState
 from shd_service.entities import (
-    Card, Meta, State, Status, Player
+    Card, Meta, State, Status, Player, evolve, plain, remove_at
 )
 
 class Game(object):
+    '''Holds the current state of a game
+
+    Each action builds a new state and only replaces the current one once it
+    has succeeded, so an invalid action leaves the game as it was. States are
+    immutable and share whatever an action did not change, so keeping one
+    as a snapshot and putting it back later is free.
+    '''
 
     def __init__(self, game: dict):
-        
+
         if not game:
             raise ValueError('Game cannot be None')
 
         self.game_id: str = game['game_id']
         self.state: State = State(**game['state'])
 
-    
+
     @classmethod
     def new(cls, n_players: int = 3, game_id: str = '') -> 'Game':
 
-        game = {
-            'game_id': game_id,
-            'state': asdict(State(total_players=n_players)),
-        }
-
         deck = [Card(suit=s, rank=r) for s in SUITS for r in RANKS]
         shuffle(deck)
 
-        game['state']['stack'] = [ asdict(c) for c in deck ]
+        return cls({
+            'game_id': game_id,
+            'state': {'total_players': n_players, 'stack': deck},
+        })
+
+
+    def copy(self) -> 'Game':
+        '''Game to try moves on, sharing this game's state until either moves'''
+
+        game = Game.__new__(Game)
+        game.game_id = self.game_id
+        game.state = self.state
+        return game
 
-        return cls(game)
 
-    
     def to_dict(self) -> dict:
         return {
             'game_id': self.game_id,
-            'state': asdict(self.state)
+            'state': plain(self.state)
         }
 
-    
+
     def sanitised_state(self) -> dict:
         return self.state.sanitise_dict()
 
-        
+
     def get_player_index(self, player_id: str) -> int:
-        
+
         try:
             return [ p.id for p in self.state.players ].index(player_id)
         except ValueError:
             raise ValueError(f'Cannot find player with id {player_id}')
 
-    
+
     def get_player(self, player_id: str) -> Player:
         return self.state.players[self.get_player_index(player_id)]
 
-    
+
     def add_player(self, player_id: str):
 
-        n_players = self.state.n_players
+        state = self.state
+        n_players = state.n_players
 
-        self.state.players.append(
-            Player(
-                id=player_id,
-                order=n_players,
-                is_dealer=n_players == 0,
-                is_active=n_players == 1,
-                can_play=n_players == 1,
-            )
+        player = Player(
+            id=player_id,
+            order=n_players,
+            is_dealer=n_players == 0,
+            is_active=n_players == 1,
+            can_play=n_players == 1,
         )
-        
-        if self.state.n_players == self.state.total_players:
-            self.state.status = Status.DEAL
 
-    
+        self.state = evolve(
+            state,
+            players=state.players + (player,),
+            status=Status.DEAL if n_players + 1 == state.total_players else state.status,
+        )
+
+
     def deal(self, player_id):
 
-        if self.state.status != Status.DEAL:
+        state = self.state
+
+        if state.status != Status.DEAL:
             raise InvalidState('Not ready to deal')
 
-        player = self.state.get_player(player_id)
+        player = state.get_player(player_id)
 
         if not player.is_dealer:
             raise InvalidAction('Player is not the dealer')
 
-        for player in self.state.players:
-            for i in range(3):
+        stack = list(state.stack)
+        players = []
 
-                h = self.state.stack.pop()
-                h.is_hidden = True
-                h.order = i
+        for player in state.players:
 
-                player.hidden.append(h)
+            hand, table, hidden = list(player.hand), list(player.table), list(player.hidden)
 
-                t = self.state.stack.pop()
-                t.order = i
-                player.table.append(t)
+            for i in range(3):
+                hidden.append(evolve(stack.pop(), is_hidden=True, order=i))
+                table.append(evolve(stack.pop(), order=i))
+                hand.append(stack.pop())
+
+            players.append(evolve(player, hand=tuple(hand), table=tuple(table), hidden=tuple(hidden)))
 
-                player.hand.append(self.state.stack.pop())
+        self.state = evolve(state, players=tuple(players), stack=tuple(stack), status=Status.PREP)
 
-        self.state.status = Status.PREP
 
-    
     def swap_table(self, player_id: str, hand_id: str, table_id: str):
 
-        if self.state.status != Status.PREP:
+        state = self.state
+
+        if state.status != Status.PREP:
             raise InvalidState('Cannot swap cards when not in prep stage')
-        
-        idx = self.get_player_index(player_id)
 
-        self.state.players[idx].swap_table(
-            hand_id=hand_id,
-            table_id=table_id
+        player = state.players[self.get_player_index(player_id)]
+
+        self.state = state.with_player(
+            player.swap_table(
+                hand_id=hand_id,
+                table_id=table_id
+            )
         )
 
 
     def player_ready(self, player_id):
-        
-        if self.state.status != Status.PREP:
+
+        state = self.state
+
+        if state.status != Status.PREP:
             raise InvalidState('Cannot be ready outside of prep stage')
 
-        idx = self.get_player_index(player_id)
+        player = state.players[self.get_player_index(player_id)]
+
+        state = state.with_player(evolve(player, is_ready=True))
 
-        self.state.players[idx].is_ready = True
+        if state.players_ready == state.total_players:
+            state = evolve(state, status=Status.PLAYING)
 
-        if self.state.players_ready == self.state.total_players:
-            self.state.status = Status.PLAYING
+        self.state = state
 
 
     def play_cards(self, player_id: str, card_ids: List[str]):
-        
-        if self.state.status != Status.PLAYING:
+
+        state = self.state
+
+        if state.status != Status.PLAYING:
             raise InvalidState('Cannot play card outside of playing stage')
 
-        player = self.state.get_player(player_id)
+        player = state.get_player(player_id)
 
         if not player.is_active:
             raise InvalidState('Player is not active so cannot play')
 
         elif not player.has_hand and not player.has_table:
-            # if we're playing hidden cards they will temporarily be in the hand
             raise InvalidState('Player has no cards to play')
 
         elif player.can_burn:
             raise InvalidAction('Player is able to burn the table')
 
-        card_set = player.hand if player.has_hand else player.table
-
-        cards = [ c for c in card_set if c.id in card_ids ]
-
-        # cards must be of same rank to play together
-        if not all([c.value == cards[0].value for c in cards]):
-            raise InvalidAction('Cards are not all of the same value')
-
-        # must be equal for all cards as per previous check
-        value = cards[0].value
-        is_special = cards[0].is_special
-
-        # playing 4 cards means we can burn
-        player.can_burn = len(cards) >= 4 or value == 10
-
-        # check for invalid play of 'normal' cards
-        if not is_special:
-            if self.state.current_value == 7:
-                if value > 7:
-                    raise InvalidAction('Must play equal or below a 7')
-            elif value < self.state.current_value:
-                raise InvalidAction('Must play a rank equal or higher')
-
-        # cards are fine to play
-        for card in cards:
-            idx = [ c.id for c in card_set ].index(card.id)
-            played_card = card_set.pop(idx)
-            played_card.played_by = player.id
-            self.state.table.append(played_card)
-
-        # if previous 4 cards are same value then we can burn
-        if len(self.state.table) >= 4:
-            player.can_burn = player.can_burn or all(c.value == value for c in self.state.table[-4:])
-
-        # normal cards set a new value
-        if not is_special and not player.can_burn:
-            self.state.current_value = value
-
-        # can play any card after a 2 or when burnt
-        elif value == 2 or player.can_burn:
-            self.state.current_value = 0
-
-        # 3 is invisible
-        elif value == 3:
-            pass
-
-        # change active player if not burning
-        if not player.can_burn:
-            self._end_turn()
+        self.state = self._play_cards(state, player, card_ids)
 
 
     def play_hidden(self, player_id: str, hidden_id: str):
 
-        if self.state.status != Status.PLAYING:
+        state = self.state
+
+        if state.status != Status.PLAYING:
             raise InvalidState('Cannot play card outside of playing stage')
 
-        player = self.state.get_player(player_id)
+        player = state.get_player(player_id)
+
+        if not player.is_active:
+            raise InvalidState('Player is not active so cannot play')
 
         if player.has_hand or player.has_table:
             raise InvalidAction('Player cannot play hidden cards yet')
 
-        card_idx = None
         try:
             card_idx = [ c.id for c in player.hidden].index(hidden_id)
         except ValueError:
             raise InvalidAction(f'Hidden card {hidden_id} not in players hidden cards')
 
-        card = player.hidden.pop(card_idx)
-
-        if not card:
-            raise InvalidAction('Cannot find hidden card on players table')
-
-        card.played_by = player.id
+        card = evolve(player.hidden[card_idx], played_by=player.id)
+        hidden = remove_at(player.hidden, card_idx)
 
-        if card.is_special:
-            player.hand.append(card)
-            self.play_cards(player.id, [card.id])
+        if state.can_play_card(card):
 
-        elif self.state.current_value == 7:
-            if card.value <= 7:
-                player.hand.append(card)
-                self.play_cards(player_id, [card.id])
+            if player.can_burn:
+                raise InvalidAction('Player is able to burn the table')
 
-        elif card.value >= self.state.current_value:
-            player.hand.append(card)
-            self.play_cards(player_id, [card.id])
+            # played from the hand like any other card
+            player = evolve(player, hidden=hidden, hand=(card,))
+            self.state = self._play_cards(state.with_player(player), player, [card.id])
 
         else:
-            self.state.table.append(card)
             # player must need to pick up
-            player.can_play = False
+            player = evolve(player, hidden=hidden, can_play=False)
+            self.state = evolve(state.with_player(player), table=state.table + (card,))
 
 
     def burn_table(self, player_id: str):
 
-        if self.state.status != Status.PLAYING:
-            raise InvalidState('Cannot burn when not in playing stage')
+        state = self.state
 
-        player = self.state.get_player(player_id)
+        if state.status != Status.PLAYING:
+            raise InvalidState('Cannot burn when not in playing stage')
 
-        if not player:
-            raise IndexError(f'Could not find player with ID {player_id} in game')
+        player = state.get_player(player_id)
 
         if not player.is_active and not player.can_burn:
             raise InvalidAction('Player is not active, or is not able to burn the deck')
 
-        self.state.burn_table()
-        player.can_burn = False
+        player = evolve(player, can_burn=False)
+        state = state.with_player(player).burn_table()
+
+        # burning the last cards goes out, otherwise the player goes again
+        if not player.has_cards:
+            state = self._end_turn(state)
+
+        self.state = state
+
 
-    
     def pickup_table(self, player_id: str):
 
-        if self.state.status != Status.PLAYING:
-            raise InvalidState('Cannot pickup when not in playing stage')
+        state = self.state
 
-        player = self.state.get_player(player_id)
+        if state.status != Status.PLAYING:
+            raise InvalidState('Cannot pickup when not in playing stage')
 
-        if not player:
-            raise IndexError(f'Could not find player with ID {player_id} in game')
+        player = state.get_player(player_id)
 
         if not player.is_active:
             raise InvalidAction('Cannot pick up if the player is not active')
 
-        while len(self.state.table) > 0:
-            player.hand.append(self.state.table.pop())
+        player = evolve(player, hand=player.hand + state.table[::-1])
+
+        self.state = self._end_turn(evolve(state.with_player(player), table=(), current_value=0))
+
+
+    def resolve(self):
+        '''Ends the round now, players still holding cards going out in order of how many they hold
+
+        For games left to bots whose play does not settle it, so it still ends.
+        '''
+
+        state = self.state
+
+        if state.status != Status.PLAYING:
+            raise InvalidState('Cannot resolve outside of playing stage')
+
+        remaining = sorted(
+            (p for p in state.players if not p.is_out),
+            key=lambda p: (len(p.hand) + len(p.table) + len(p.hidden), p.order),
+        )
+
+        # the player holding the most is left as the shithead
+        for player in remaining[:-1]:
+            state = evolve(state.with_player(evolve(player, is_out=True)), finished=state.finished + (player.id,))
+
+        self.state = self._end_round(state)
+
+
+    def _play_cards(self, state: State, player: Player, card_ids: List[str]) -> State:
+        '''State after the active player plays cards from their hand, or table once it is empty'''
+
+        pile = 'hand' if player.has_hand else 'table'
+        card_set = getattr(player, pile)
+
+        cards = [ c for c in card_set if c.id in card_ids ]
+
+        if not cards:
+            raise InvalidAction('None of the cards are the players to play')
+
+        # cards must be of same rank to play together
+        if not all([c.value == cards[0].value for c in cards]):
+            raise InvalidAction('Cards are not all of the same value')
+
+        # must be equal for all cards as per previous check
+        value = cards[0].value
+        is_special = cards[0].is_special
+
+        # check for invalid play of 'normal' cards
+        if not is_special:
+            if state.current_value == 7:
+                if value > 7:
+                    raise InvalidAction('Must play equal or below a 7')
+            elif value < state.current_value:
+                raise InvalidAction('Must play a rank equal or higher')
+
+        # playing 4 cards means we can burn
+        can_burn = len(cards) >= 4 or value == 10
+
+        played_ids = {c.id for c in cards}
+        table = state.table + tuple(evolve(c, played_by=player.id) for c in cards)
 
-        self.state.current_value = 0
+        # if previous 4 cards are same value then we can burn
+        if len(table) >= 4:
+            can_burn = can_burn or all(c.value == value for c in table[-4:])
 
-        self._end_turn()
+        current_value = state.current_value
 
-        
-    def _end_turn(self):
+        # normal cards set a new value
+        if not is_special and not can_burn:
+            current_value = value
 
-        player = self.state.active_player
+        # can play any card after a 2 or when burnt
+        elif value == 2 or can_burn:
+            current_value = 0
+
+        # 3 is invisible
+
+        player = evolve(
+            player,
+            can_burn=can_burn,
+            **{pile: tuple(c for c in card_set if c.id not in played_ids)}
+        )
+
+        state = evolve(state.with_player(player), table=table, current_value=current_value)
+
+        # change active player if not burning
+        if not can_burn:
+            state = self._end_turn(state)
+
+        return state
+
+
+    def _end_turn(self, state: State) -> State:
+
+        player = state.active_player
 
         # pick up if needed and cards are available
-        while len(player.hand) < 3 and len(self.state.stack) > 0:
-            player.hand.append(self.state.stack.pop())
+        draw = min(max(3 - len(player.hand), 0), len(state.stack))
+        if draw:
+            player = evolve(player, hand=player.hand + state.stack[:-draw - 1:-1])
+            state = evolve(state, stack=state.stack[:-draw])
+
+        if not player.has_cards:
+            player = evolve(player, is_out=True)
+            state = evolve(state, finished=state.finished + (player.id,))
+
+        state = state.with_player(player)
+
+        if state.players_remaining == 1:
+            return self._end_round(state)
+
+        next_player = state.next_player
 
-        if not player.has_hand and not player.has_table and not player.has_hidden:
-            player.is_out = True
+        state = state.with_player(evolve(player, is_active=False))
 
-        next_player = self.state.next_player
+        return state.with_player(
+            evolve(next_player, is_active=True, can_play=state.player_can_play(next_player.id))
+        )
+
+
+    def _end_round(self, state: State) -> State:
+        '''The last player holding cards is the shithead'''
+
+        loser = next(p for p in state.players if not p.is_out)
 
-        player.is_active = False
-        next_player.is_active = True
+        players = tuple(
+            evolve(p, is_active=False, can_play=False, is_sh=True, sh_count=p.sh_count + 1)
+            if p.id == loser.id else
+            evolve(p, is_active=False, can_play=False)
+            for p in state.players
+        )
 
-        next_player.can_play = self.state.player_can_play(next_player.id)
+        return evolve(
+            state,
+            players=players,
+            finished=state.finished + (loser.id,),
+            status=Status.END,
+        )
 
-        if len([ p.id for p in self.state.players if not p.is_out ]) == 1:
-            self._end_roud()
-        
 
-    def _end_roud(self):
-        pass
+    def results(self) -> dict:
+        '''Finishing order, loser and points per player (one per player beaten)'''
 
+        finished = self.state.finished
+        n_players = len(finished)
 
-    
\ No newline at end of file
+        return {
+            'result': list(finished),
+            'loser': finished[-1] if finished else None,
+            'scores': {player_id: n_players - 1 - i for i, player_id in enumerate(finished)},
+        }
@@ -1,16 +1,25 @@
+import os
 import json
-import decimal
-import logging
-from json import JSONEncoder
 from http import HTTPStatus as s
-from dataclasses import dataclass, asdict
 
 from boto3.dynamodb.conditions import Key
 from boto3.dynamodb.types import TypeSerializer
 
-from . import db
+from cards_common.cache import TTLCache
+from cards_common.data import query_items, Capacity
+from cards_common.encoding import make_response
+from cards_common.log import get_logger, log_event, Fields
+from cards_common.ratelimit import RateLimiter
+from cards_common.seats import seat_order
+from cards_common.timing import timed, span, tag
+from cards_common.views import SANITISED_SK, PLAYER_PREFIX, VERSION_SK
 
+from . import db, db_client
+
+from shd_service import bot, recorder
+from shd_service.archive import end_game
 from shd_service.game import Game
+from shd_service.actions import Action, Actions, apply_action
 from shd_service.entities import Status
 from shd_service.exceptions import (
     InvalidMessage,
@@ -19,102 +28,133 @@ from shd_service.exceptions import (
 )
 
 
-log = logging.getLogger()
-log.setLevel(logging.INFO)
+log = get_logger()
 
 serialiser = TypeSerializer()
 
-class DecimalEncoder(JSONEncoder):
-    def default(self, o): # pylint: disable=method-hidden
-        if isinstance(o, decimal.Decimal):
-            if abs(o) % 1 > 0:
-                return float(o)
-            else:
-                return int(o)
-        return super(DecimalEncoder, self).default(o)
-
-
-def make_response(code: int, body: dict = {}) -> dict:
-    '''Generates HTTP response expected by API gateway'''
-
-    return {
-        'statusCode': code,
-        'headers': {
-                'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps(body, cls=DecimalEncoder)
-    }
-
-
-class Actions:
-    PING = 'PING'
-    DEAL = 'DEAL'
-    SWAP = 'SWAP'
-    READY = 'READY'
-    PLAY = 'PLAY'
-    BURN = 'BURN'
-    PICKUP = 'PICKUP'
-
-
-@dataclass
-class Action:
-
-    game_id: str = None
-    type: str = None
-    data: dict = None
-
-    @classmethod
-    def from_message(cls, message: dict):
-
-        game_id = message.get('gameId', None)
-        action_type = message.get('type', None)
-        data = message.get('data', None) 
-
-        if not game_id:
-            raise InvalidMessage('No game ID provided')
-        elif not action_type:
-            raise InvalidMessage('No action or type')
-        
-        return cls(
-            game_id=game_id,
-            type=action_type,
-            data=data
+SPECTATOR_PREFIX = 'VIEW#'
+
+# api gateway allows far more, but no action needs more than a few hundred bytes
+MAX_MESSAGE_BYTES = 4096
+
+# messages per second per connection, 0 to turn the limit off
+RATE_LIMIT = float(os.environ.get('RATE_LIMIT_PER_SECOND', 5))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', 20))
+# share buckets across containers through the table, at a write per message
+RATE_LIMIT_PERSIST = os.environ.get('RATE_LIMIT_PERSIST', '').lower() in ['1', 'true', 'yes']
+
+# write only the state item and leave the public and player views to the stream
+DERIVED_VIEWS = os.environ.get('DERIVED_VIEWS', '').lower() in ['1', 'true', 'yes']
+
+# player:action ids of the latest actions applied to a game, kept on its state for retries
+APPLIED_WINDOW = int(os.environ.get('APPLIED_WINDOW', 32))
+
+# (game id, player id, action id) of actions this container applied, so retries of
+# actions that have left the state's window are still acknowledged
+applied_actions = TTLCache(max_size=1024, ttl=600)
+
+limiter = RateLimiter(
+    rate=RATE_LIMIT,
+    burst=RATE_LIMIT_BURST,
+    table=db if RATE_LIMIT_PERSIST else None,
+) if RATE_LIMIT else None
+
+
+def view_items(game: Game, version: int) -> list:
+    '''Public view and each player's view of the game, stored for the stream to send'''
+
+    state = game.sanitised_state()
+    state['pk'] = f'GAME#{game.game_id}'
+    state['sk'] = 'SANITISED#SHD'
+    state['version'] = version
+
+    items = [state]
+
+    # bots have no client to send their view to
+    for p in game.state.players:
+        if bot.is_bot(p.id):
+            continue
+        p = p.sanitise_for_player()
+        p['pk'] = f'GAME#{game.game_id}'
+        p['sk'] = f'PLAYER#{p["id"]}'
+        p['version'] = version
+        items.append(p)
+
+    return items
+
+
+def finish(game: Game, meta: dict, record: dict, game_entities: list):
+    '''Takes a game whose END state is stored out of the live data'''
+
+    with span('persist'):
+        end_game(
+            game,
+            game_type=meta.get('game_type', 'SHD') if meta else 'SHD',
+            record=record,
+            connection_ids=[e['connection_id'] for e in game_entities if e['sk'].startswith('CONN#')],
         )
 
 
+@timed('shd')
 def handle(event, context):
 
     try:
 
-        log.info(event)
+        log_event(log, event)
            
         # ws message
-        request_context = event.get('requestContext', None)
-        body = json.loads(event.get('body', None))
-        connection_id = request_context.get('connectionId', None)
+        with span('parse'):
+            request_context = event.get('requestContext', None)
+            raw_body = event.get('body', None) or ''
+
+            if len(raw_body) > MAX_MESSAGE_BYTES:
+                return make_response(s.REQUEST_ENTITY_TOO_LARGE, {'message': 'Message too large'})
+
+            try:
+                body = json.loads(raw_body)
+            except ValueError:
+                return make_response(s.BAD_REQUEST, {'message': 'Message is not JSON'})
+
+            connection_id = request_context.get('connectionId', None)
 
         if not request_context or not body:
-            return make_response(s.BAD_REQUEST, {'message', 'Cannot find context or message body'})
+            return make_response(s.BAD_REQUEST, {'message': 'Cannot find context or message body'})
         elif not connection_id:
-            return make_response(s.BAD_REQUEST, {'message', 'Cannot find connection ID'})
+            return make_response(s.BAD_REQUEST, {'message': 'Cannot find connection ID'})
 
         action = None
 
         try:
-            action = Action.from_message(body)
+            with span('parse'):
+                action = Action.from_message(body)
         except InvalidMessage as e:
-            log.error(f'Unable to load action due to error {e}')
-            return make_response(s.BAD_REQUEST, {'message': 'Invalid message schema'})
+            log.error('Unable to load action due to error %s', e)
+            return make_response(s.BAD_REQUEST, {'message': f'Invalid message schema: {e}'})
+
+        tag(action=action.type, game_id=action.game_id)
 
         if (action.type == Actions.PING):
-            log.info(f'PONG')
+            log.info('PONG')
             return make_response(s.OK, {})
 
-        log.info(f'Processing action: {asdict(action)}')
+        # every message past here reads the game, so limit them before it does
+        if limiter and not limiter.allow(connection_id):
+            log.warning('Rate limited connection %s', connection_id)
+            return make_response(s.TOO_MANY_REQUESTS, {'message': 'Too many messages'})
+
+        log.info(Fields('action', game_id=action.game_id, type=action.type, data=action.data, action_id=action.id))
+
+        read = Capacity()
 
-        game_entities = db.query(
-            KeyConditionExpression=Key('pk').eq(f'GAME#{action.game_id}')
-        ).get('Items', None)
+        with span('load'):
+            # spectator connections sort last (VIEW#), so the audience is never read here
+            game_entities = list(query_items(
+                db,
+                KeyConditionExpression=Key('pk').eq(f'GAME#{action.game_id}') & Key('sk').lt(SPECTATOR_PREFIX),
+                capacity=read,
+            ))
+
+        tag(read_units=read.units)
 
         meta = None
         state = None
@@ -131,87 +171,161 @@ def handle(event, context):
             elif sk == 'STATE#SHD':
                 state = entity
 
-        log.info(meta)
-        log.info(state)
-        log.info(player_conn)
+        log.debug(Fields('game loaded', meta=meta, state=state, connection=player_conn))
             
+        if not player_id:
+            return make_response(s.FORBIDDEN, {'message': 'Connection is not playing this game'})
+
+        if meta:
+            tag(players=int(meta['table_size']))
+
         game = None if not state else Game(state)
+        record = state.get('record', None) if state else None
+        applied = list(state.get('applied', [])) if state else []
 
-        if action.type == Actions.DEAL:
-            
-            if int(meta['table_size']) != len(meta['players']):
-                return make_response(s.CONFLICT, {'message', 'Game not full, cannot start'})
+        # action ids are only unique to the client that made them
+        applied_id = f'{player_id}:{action.id}' if action.id else None
+
+        if game and game.state.status == Status.END:
+            # the end was stored but its teardown cut short, which any message picks up again
+            finish(game, meta, record, game_entities)
+
+        duplicate = applied_id and (
+            applied_id in applied
+            or applied_actions.get((action.game_id, player_id, action.id), None) is not None
+        )
 
-            if not game:
-                game = Game.new(n_players=int(meta['table_size']), game_id=meta['id'])
-                for p in meta['players']:
-                    game.add_player(p)
+        if duplicate:
+            log.info('Action %s already applied to game %s', applied_id, action.game_id)
+            return make_response(s.OK, {'actionId': action.id, 'duplicate': True})
 
-            game.deal(player_id)
+        if game and game.state.status == Status.END:
+            return make_response(s.CONFLICT, {'message': 'Game has ended'})
 
-        elif action.type == Actions.SWAP:
+        with span('apply'):
 
-            log.info(f'Swapping hand {action.data["hand"]} for table {action.data["table"]}')
-            game.swap_table(player_id, action.data['hand'], action.data['table'])
+            if action.type == Actions.DEAL:
 
-        elif action.type == Actions.READY:
+                seats = seat_order(meta['players'], meta.get('players_joined', None))
 
-            log.info(f'Player {player_id} ready to play')
-            game.player_ready(player_id)
+                if int(meta['table_size']) != len(seats):
+                    return make_response(s.CONFLICT, {'message': 'Game not full, cannot start'})
 
-        elif action.type == Actions.PLAY:
+                if not game:
+                    game = Game.new(n_players=int(meta['table_size']), game_id=meta['id'])
+                    for p in seats:
+                        game.add_player(p)
 
-            card_ids = action.data.get('cardIds', None) or [] 
+                record = recorder.start(game)
 
-            game_player = game.get_player(player_id)
+            elif not game:
+                return make_response(s.CONFLICT, {'message': 'Game has not been dealt'})
 
-            if not game_player.has_hand and not game_player.has_table:
+            before = game.state
+            apply_action(game, player_id, action.type, action.data)
 
-                log.info(f'Player {player_id} playing hidden card {card_ids}')
-                game.play_hidden(player_id, card_ids[0])
+            if record:
+                record = recorder.append(record, before, player_id, action.type, action.data)
 
+            if action.id:
+                applied = (applied + [applied_id])[-APPLIED_WINDOW:]
+
+        with span('bots'):
+            # each bot move is yielded once applied, so the state it was applied to is the one before
+            before = game.state
+            for bot_id, bot_type, bot_data in bot.play_bots(game):
+                if record:
+                    record = recorder.append(record, before, bot_id, bot_type, bot_data)
+                before = game.state
+
+        # every item written for this action shares the new state version
+        version = int(state.get('version', 0)) + 1 if state else 1
+        ended = game.state.status == Status.END
+
+        with span('serialise'):
+
+            game_dict = game.to_dict()
+            game_dict['pk'] = f'GAME#{game.game_id}'
+            game_dict['sk'] = 'STATE#SHD'
+            game_dict['version'] = version
+
+            if record:
+                game_dict['record'] = record
+
+            if applied:
+                game_dict['applied'] = applied
+
+            stale = []
+
+            if ended:
+                # the end is stored like any other state so it is only written once, and its
+                # views would be deleted with the rest of the game straight after
+                items = [game_dict]
+            elif DERIVED_VIEWS:
+                # the connection manager builds and sends the views from the stream instead
+                game_dict['derived_views'] = True
+                items = [game_dict]
+                # views stored before the switch would go stale, so they are removed
+                stale = [
+                    {'pk': e['pk'], 'sk': e['sk']}
+                    for e in game_entities
+                    if e['sk'] == SANITISED_SK or e['sk'].startswith(PLAYER_PREFIX)
+                ]
             else:
+                items = [game_dict, *view_items(game, version)]
 
-                log.info(f'Player {player_id} playing cards {card_ids}')
-                game.play_cards(player_id, card_ids)
+        with span('persist'):
 
-        elif action.type == Actions.PICKUP:
+            try:
+                # the state goes first and only over the version the action was applied to,
+                # so of two deliveries of the same action read together only one is written
+                db.put_item(
+                    Item=game_dict,
+                    ConditionExpression='attribute_not_exists(version) OR version = :v',
+                    ExpressionAttributeValues={':v': version - 1},
+                )
+            except db_client.exceptions.ConditionalCheckFailedException:
+                log.warning('Game %s changed from version %s while applying %s', game.game_id, version - 1, action.type)
+                return make_response(s.CONFLICT, {'message': 'Game changed while applying action, retry'})
 
-            log.info(f'Player {player_id} picking up table')
-            game.pickup_table(player_id)
+        if ended:
 
-        elif action.type == Actions.BURN:
+            finish(game, meta, record, game_entities)
 
-            log.info(f'Player {player_id} burning deck')
-            game.burn_table(player_id)
+            if action.id:
+                applied_actions.put((action.game_id, player_id, action.id), version)
 
-        else:
-            return make_response(s.BAD_REQUEST, {'message': 'Unknown action type'})
-        
-        game_dict = game.to_dict()
-        game_dict['pk'] = f'GAME#{game.game_id}'
-        game_dict['sk'] = 'STATE#SHD'
+            return make_response(s.OK, {})
 
-        db.put_item(Item=game_dict)
+        with span('persist'):
 
-        state = game.sanitised_state()
+            # a delivery that wrote a later state may have written its views first
+            for item in items[1:]:
+                try:
+                    db.put_item(
+                        Item=item,
+                        ConditionExpression='attribute_not_exists(version) OR version < :v',
+                        ExpressionAttributeValues={':v': version},
+                    )
+                except db_client.exceptions.ConditionalCheckFailedException:
+                    log.info('Kept %s newer than version %s of game %s', item['sk'], version, game.game_id)
 
-        state['pk'] = f'GAME#{game.game_id}'
-        state['sk'] = 'SANITISED#SHD'
+            for key in stale:
+                db.delete_item(Key=key)
 
-        db.put_item(Item=state)
-        
-        players = game.state.players
+            # counted once everything the game route serves is written
+            db.update_item(
+                Key={'pk': f'GAME#{game.game_id}', 'sk': VERSION_SK},
+                UpdateExpression='SET derived_views = :d ADD version :one',
+                ExpressionAttributeValues={':d': DERIVED_VIEWS, ':one': 1},
+            )
 
-        for p in players:
-            p = p.sanitise_for_player()
-            p['pk'] = f'GAME#{game.game_id}'
-            p['sk'] = f'PLAYER#{p["id"]}'
-            db.put_item(Item=p)
+        if action.id:
+            applied_actions.put((action.game_id, player_id, action.id), version)
 
         return make_response(s.OK, {})
 
     except Exception as e:
-        log.error(f'Error when processing websocket message: {e}')
+        log.error('Error when processing websocket message: %s', e)
         raise
         #return make_response(s.INTERNAL_SERVER_ERROR, {'message': 'Error when processing message'})
\ No newline at end of file
@@ -0,0 +1,140 @@
+'''Records the actions applied to each game so it can be replayed offline
+
+A record is kept on the game's state item, so recording costs no extra
+writes, and is exported as one JSON line per game:
+
+    {"v": 1, "game_id": "...", "players": ["<id>", ...], "deck": ["10H", "AS", ...],
+     "actions": [[0, "DEAL"], [1, "SWAP", [12, 40]], [1, "PLAY", [7, 33]], ...]}
+
+Players are in seat order and actions name the player by seat. The deck is
+the stack before dealing (dealt from the end) and cards in actions are deck
+indices rather than ids, as ids are generated per game. Card ids are mapped
+to indices through their code, as rank and suit are unique within the deck,
+so the record carries nothing per card beyond its code.
+'''
+import os
+import json
+from typing import Iterator
+
+from cards_common.encoding import dumps
+
+from shd_service.game import Game
+from shd_service.entities import Card, State, evolve
+from shd_service.actions import Actions, apply_action
+
+VERSION = 1
+
+RECORDING = os.environ.get('RECORD_ACTIONS', '1').lower() in ['1', 'true', 'yes']
+
+
+def card_code(card: Card) -> str:
+    return f'{card.rank}{card.suit}'
+
+
+def start(game: Game) -> dict:
+    '''New record of a game about to be dealt, or None when not recording'''
+
+    if not RECORDING:
+        return None
+
+    return {
+        'v': VERSION,
+        'game_id': game.game_id,
+        'players': [p.id for p in game.state.players],
+        'deck': [card_code(c) for c in game.state.stack],
+        'actions': [],
+    }
+
+
+def append(record: dict, before: State, player_id: str, action_type: str, data: dict = None) -> dict:
+    '''Adds an action to the record, given the state it was applied to
+
+    Only cards the player held are recorded, as the engine ignores any other
+    ids it is sent with a play.
+    '''
+
+    seat = record['players'].index(player_id)
+    ids = card_ids(action_type, data)
+
+    if ids:
+        player = before.get_player(player_id)
+        held = {c.id: c for c in player.hand + player.table + player.hidden}
+        cards = [record['deck'].index(card_code(held[card_id])) for card_id in ids if card_id in held]
+    else:
+        cards = []
+
+    record['actions'].append([seat, action_type, cards] if cards else [seat, action_type])
+
+    return record
+
+
+def card_ids(action_type: str, data: dict = None) -> list:
+    '''Ids of the cards an action's message refers to'''
+
+    if action_type == Actions.PLAY:
+        return list((data or {}).get('cardIds', None) or [])
+    elif action_type == Actions.SWAP:
+        return [data['hand'], data['table']]
+
+    return []
+
+
+def message_data(action_type: str, cards: list) -> dict:
+    '''Inverse of card_ids, the data of a message for the given card ids'''
+
+    if action_type == Actions.PLAY:
+        return {'cardIds': cards}
+    elif action_type == Actions.SWAP:
+        return {'hand': cards[0], 'table': cards[1]}
+
+    return None
+
+
+def to_line(record: dict) -> str:
+    # records started before cards were mapped by code also kept their ids
+    return dumps({k: v for k, v in record.items() if k != 'ids'})
+
+
+def from_line(line: str) -> dict:
+
+    record = json.loads(line)
+
+    if record.get('v', None) != VERSION:
+        raise ValueError(f'Unsupported record version {record.get("v", None)}')
+
+    return record
+
+
+def new_game(record: dict, game_id: str = None) -> Game:
+    '''Game seated and ready to deal from the recorded deck'''
+
+    game = Game.new(n_players=len(record['players']), game_id=game_id or record['game_id'])
+    game.state = evolve(game.state, stack=tuple(Card(rank=code[:-1], suit=code[-1]) for code in record['deck']))
+
+    for player_id in record['players']:
+        game.add_player(player_id)
+
+    return game
+
+
+def actions(record: dict, ids: list) -> Iterator[tuple]:
+    '''(player id, action type, message data) of each recorded action, for a game
+    whose deck has the given card ids'''
+
+    players = record['players']
+
+    for entry in record['actions']:
+        cards = [ids[int(i)] for i in entry[2]] if len(entry) > 2 else []
+        yield players[int(entry[0])], entry[1], message_data(entry[1], cards)
+
+
+def replay(record: dict) -> Game:
+    '''Runs a recorded game through the engine alone'''
+
+    game = new_game(record)
+    ids = [c.id for c in game.state.stack]
+
+    for player_id, action_type, data in actions(record, ids):
+        apply_action(game, player_id, action_type, data)
+
+    return game
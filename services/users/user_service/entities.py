@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 
 @dataclass
 class User(object):
@@ -11,6 +11,9 @@ class User(object):
     phone: str = None
     in_game: bool = False
     game_id: str = None
+    queue_pk: str = None
+    queue_sk: str = None
+    version: int = 1
 
     def __post_init__(self):
         if self.id:
@@ -19,6 +22,15 @@ class User(object):
             if not self.sk:
                 self.sk = f'ENTITY'
 
+    def to_item(self) -> dict:
+        '''Item to store - queue keys are only present while queued'''
+
+        return {
+            k: v
+            for k, v in asdict(self).items()
+            if v is not None or k not in ['queue_pk', 'queue_sk']
+        }
+
     def to_dict(self):
         return {
             k: v
@@ -1,13 +1,11 @@
 import os
-import re
 import json
-import logging
-from typing import Any, List
 from http import HTTPStatus as s
-from dataclasses import asdict, dataclass, field
 
-import boto3
-from boto3.exceptions import Boto3Error
+from cards_common.etag import get_header
+from cards_common.log import get_logger, log_event
+from cards_common.router import Router, Route
+from cards_common.timing import timed, span, tag
 
 from user_service.entities import User
 from user_service.routes import (
@@ -15,21 +13,12 @@ from user_service.routes import (
     create_user,
     get_user,
     get_player,
+    get_players,
 )
 
 from . import db
 
-log = logging.getLogger()
-log.setLevel(logging.INFO)
-
-
-@dataclass
-class Route():
-    path: str = None
-    method: str = None
-    function: Any = None
-    args: List[Any] = field(default_factory=list)
-    kwargs: dict = field(default_factory=dict)
+log = get_logger()
 
 
 def get_user_from_claims(event: dict) -> User:
@@ -43,49 +32,51 @@ def get_user_from_claims(event: dict) -> User:
     )
 
 
-def handle(event, context):
+router = Router([
+    Route(method='GET', path='/user', function=get_user, args=('user', 'if_none_match')),
+    Route(method='GET', path='/user/{player_id}', function=get_player, args=('player_id',)),
+    Route(method='POST', path='/user', function=create_user, args=('user', 'body')),
+    Route(method='GET', path='/players', function=get_players, args=('params',)),
+])
+
 
-    guid = '[A-Za-z0-9-]+'
+@timed('users')
+def handle(event, context):
 
-    log.info(event)
+    log_event(log, event)
 
     try:
-        user = get_user_from_claims(event) 
+        with span('auth'):
+            user = get_user_from_claims(event)
     except KeyError:
         return make_response(s.UNAUTHORIZED, {'message': 'No user information in access token'})
 
-    player_id = None
-    if event['pathParameters']:
-        params = event['pathParameters']
-        player_id = params.get('player_id', None)
-
     try: 
 
         path = event['path']
         method = event['httpMethod']
-        body = json.loads(event['body']) if event['body'] else None
-
-        routes: List[Route] = [
-            Route(path='/user', method='GET', function=get_user, args=[user]),
-            Route(path=f'/user/{guid}', method='GET', function=get_player, args=[player_id]),
-            Route(path='/user', method='POST', function=create_user, args=[user, body]),
-        ]
-
-        route = next(
-            (r for r in routes if re.fullmatch(r.path, path) and r.method == method),
-            None
-        )
+
+        with span('parse'):
+            match = router.match(method, path, event.get('pathParameters', None))
     
-        if not route:
-            log.error(f'Unhandled request route: {path}, method: {method}')
+        if not match:
+            log.error('Unhandled request route: %s, method: %s', path, method)
             return make_response(s.BAD_REQUEST, {'message': 'Route or method not supported'})
 
-        log.info(f'Handling route [{path}] metho [{method}] with function {route.function.__name__}')
+        log.info('Handling route [%s] method [%s] with function %s', path, method, match.route.function.__name__)
+
+        tag(action=match.route.function.__name__)
 
-        return route.function(*route.args, **route.kwargs)
+        with span('route'):
+            return match.call(
+                user=lambda: user,
+                body=lambda: json.loads(event['body']) if event['body'] else None,
+                if_none_match=lambda: get_header(event, 'If-None-Match'),
+                params=lambda: event.get('queryStringParameters', None) or {},
+            )
 
     except Exception as e:
 
-        log.error(f'Exception when processing request: {str(e)}')
+        log.error('Exception when processing request: %s', e)
         raise
         # return make_response(500, {'message': 'Internal server error'})
\ No newline at end of file
@@ -1,67 +1,115 @@
-import json
-import decimal
-import logging
-from json import JSONEncoder
-from dataclasses import asdict
 from http import HTTPStatus as s
 
-from boto3.exceptions import Boto3Error
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Attr, Key
 
-from user_service.entities import User
+from cards_common.cache import TTLCache
+from cards_common.data import projection, batch_get_items
+from cards_common.encoding import make_response
+from cards_common.etag import make_etag, etag_matches, etag_headers, not_modified
+from cards_common.log import get_logger
 
-from . import db
+from user_service.entities import User
 
-log = logging.getLogger()
-log.setLevel(logging.INFO)
+from . import db, db_resource, table
 
+log = get_logger()
 
-class DecimalEncoder(JSONEncoder):
-    def default(self, o): # pylint: disable=method-hidden
-        if isinstance(o, decimal.Decimal):
-            if abs(o) % 1 > 0:
-                return float(o)
-            else:
-                return int(o)
-        return super(DecimalEncoder, self).default(o)
+# display profiles change rarely, so a short ttl is enough to stay current
+profile_cache = TTLCache(max_size=1024, ttl=30)
 
+MAX_BATCH_PLAYERS = 25
+PROFILE_FIELDS = projection('id', 'name')
 
-def make_response(code: int, body: dict = {}) -> dict:
-    '''Generates HTTP response expected by API gateway'''
 
-    return {
-        'statusCode': code,
-        'headers': {
-                'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps(body, cls=DecimalEncoder)
-    }
+def get_user(user: User, if_none_match: str = None) -> dict:
+    '''Returns the user, or 304 if the version the client has is current
 
-def get_user(user: User) -> dict:
+    The user item is small, so it is read whole and the ETag taken from its
+    version rather than reading the version on its own first.
+    '''
 
     result = db.get_item(
         Key=user.get_key(),
     )
 
-    found = 'Item' in result
-
-    if not found:
+    if not 'Item' in result:
         return make_response(s.NOT_FOUND, {'message': 'User does not exist'})
 
-    return make_response(s.OK, User(**result['Item']).to_dict())
+    etag = make_etag(user.id, result['Item'].get('version', 0))
+
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    return make_response(s.OK, User(**result['Item']).to_dict(), headers=etag_headers(etag))
 
 
 def get_player(player_id: str):
 
-    player_user = User(id=player_id)
+    profile = profile_cache.get(player_id)
+
+    if not profile:
+
+        player = db.get_item(
+            Key=User(id=player_id).get_key(),
+            **PROFILE_FIELDS
+        ).get('Item', None)
+
+        if not player:
+            return make_response(s.NOT_FOUND, {'message': 'Could not find player'})
+
+        profile = User(**player).to_player()
+        profile_cache.put(player_id, profile)
+
+    return make_response(s.OK, profile)
+
+
+def load_profiles(player_ids: list) -> dict:
+    '''Display profiles for the given ids from a single BatchGetItem, skipping unknown players'''
+
+    items = batch_get_items(
+        db_resource,
+        table,
+        [User(id=player_id).get_key() for player_id in player_ids],
+        PROFILE_FIELDS
+    )
+
+    return {item['id']: User(**item).to_player() for item in items}
+
+
+def get_players(params: dict):
+    '''Profiles for up to MAX_BATCH_PLAYERS comma separated ids, in the order asked'''
+
+    player_ids = list(dict.fromkeys(
+        player_id.strip()
+        for player_id in (params.get('ids', None) or '').split(',')
+        if player_id.strip()
+    ))
+
+    if not player_ids:
+        return make_response(s.BAD_REQUEST, {'message': 'No player ids requested'})
+
+    if len(player_ids) > MAX_BATCH_PLAYERS:
+        return make_response(s.BAD_REQUEST, {'message': f'Cannot request more than {MAX_BATCH_PLAYERS} players'})
+
+    profiles = {
+        player_id: profile_cache.get(player_id)
+        for player_id in player_ids
+        if profile_cache.get(player_id)
+    }
+
+    missing = [player_id for player_id in player_ids if player_id not in profiles]
 
-    player: User = db.get_item(Key=player_user.get_key()).get('Item', None)
+    if missing:
+        log.info('Loading %s of %s player profiles', len(missing), len(player_ids))
 
-    if not player:
-        return make_response(s.NOT_FOUND, {'message': 'Could not find player'})
+        for player_id, profile in load_profiles(missing).items():
+            profile_cache.put(player_id, profile)
+            profiles[player_id] = profile
 
-    return make_response(s.OK, User(**player).to_player())
+    return make_response(s.OK, {
+        'players': [profiles[player_id] for player_id in player_ids if player_id in profiles],
+    })
 
 
 def create_user(user: User, body: dict) -> dict:
@@ -79,7 +127,7 @@ def create_user(user: User, body: dict) -> dict:
 
     try:
         db.put_item(
-            Item=asdict(user),
+            Item=user.to_item(),
             ConditionExpression=Attr('pk').not_exists() & Attr('sk').not_exists()
         )
     except ClientError as e:
@@ -0,0 +1,89 @@
+'''CPU time spent encoding typical game payloads as JSON
+
+Run from the repository root:
+
+    python tests/benchmarks/bench_encoding.py [n_frames]
+
+Builds the items a dealt four player SHD game writes (full state,
+sanitised state and player views), round trips them through dynamo's type
+(de)serialiser so numbers come back as Decimal, then encodes each as a
+websocket frame with the old per-value DecimalEncoder hook and with
+cards_common.encoding on the stdlib and orjson backends.
+'''
+import os
+import sys
+import json
+import time
+import decimal
+from pathlib import Path
+from json import JSONEncoder
+
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+
+sys.path.append(str(Path(os.getcwd()) / 'services' / 'games' / 'shd'))
+sys.path.append(str(Path(os.getcwd()) / 'layers' / 'common'))
+
+from cards_common import encoding
+from shd_service.game import Game
+
+n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+class DecimalEncoder(JSONEncoder):
+    def default(self, o): # pylint: disable=method-hidden
+        if isinstance(o, decimal.Decimal):
+            if abs(o) % 1 > 0:
+                return float(o)
+            else:
+                return int(o)
+        return super(DecimalEncoder, self).default(o)
+
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+def from_dynamo(item: dict) -> dict:
+    return {k: deserializer.deserialize(serializer.serialize(v)) for k, v in item.items()}
+
+
+game = Game.new(n_players=4, game_id='bench')
+for i in range(4):
+    game.add_player(f'player-{i}')
+game.deal('player-0')
+
+payloads = [from_dynamo(game.to_dict()), from_dynamo(game.sanitised_state())]
+payloads += [from_dynamo(p.sanitise_for_player()) for p in game.state.players]
+payloads = [{'type': 'state_update', 'data': p} for p in payloads]
+
+frame_bytes = sum(len(encoding.dumps_bytes(p)) for p in payloads) / len(payloads)
+
+
+def legacy(payload):
+    return json.dumps(payload, cls=DecimalEncoder).encode('utf-8')
+
+
+def run(fn) -> float:
+
+    start = time.process_time()
+    for i in range(n_frames):
+        fn(payloads[i % len(payloads)])
+    return time.process_time() - start
+
+
+for payload in payloads:
+    assert json.loads(legacy(payload)) == json.loads(encoding.dumps_bytes(payload))
+
+results = [('DecimalEncoder', run(legacy))]
+
+fast = encoding.orjson
+encoding.orjson = None
+results.append(('encoding/json', run(encoding.dumps_bytes)))
+encoding.orjson = fast
+
+if fast is not None:
+    results.append(('encoding/orjson', run(encoding.dumps_bytes)))
+
+print(f'{n_frames} frames, {len(payloads)} payload kinds, {frame_bytes:.0f} bytes on average')
+for name, seconds in results:
+    print(f'{name:15s} {seconds:.3f}s CPU ({seconds / n_frames * 1e6:.0f} us/frame, {results[0][1] / seconds:.1f}x)')
@@ -0,0 +1,114 @@
+'''CPU time spent routing the recorded REST events with and without the shared router
+
+Run from the repository root:
+
+    python tests/benchmarks/bench_router.py [n_requests]
+
+Replays every API gateway event in tests/events against the game and user
+route tables, without calling the routes, and reports CPU time per request
+for the old per-invocation route list and for the precompiled router.
+'''
+import os
+import re
+import sys
+import json
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(os.getcwd()) / 'layers' / 'common'))
+
+from cards_common.router import Router, Route
+
+n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+guid = '[A-Za-z0-9-]+'
+
+events = []
+for path in sorted(Path('tests/events').glob('*.json')):
+    with open(path) as f:
+        event = json.load(f)
+    if 'httpMethod' in event:
+        events.append(event)
+
+
+def route_fn(*args):
+    return args
+
+
+# route tables as the handlers declare them
+routes = [
+    ('GET', '/games', ('user',)),
+    ('GET', '/games/open', ('params',)),
+    ('POST', '/games/queue', ('user', 'body')),
+    ('DELETE', '/games/queue', ('user',)),
+    ('POST', '/games', ('user', 'body')),
+    ('POST', '/games/{game_id}/players', ('user', 'game_id')),
+    ('DELETE', '/games/{game_id}/players', ('user', 'game_id')),
+    ('GET', '/user', ('user',)),
+    ('GET', '/user/{player_id}', ('player_id',)),
+    ('POST', '/user', ('user', 'body')),
+    ('GET', '/players', ('params',)),
+]
+
+
+def legacy(event):
+    '''Route list built per request, arguments built for every route'''
+
+    path_params = event['pathParameters'] or {}
+    body = json.loads(event['body']) if event['body'] else None
+    params = event.get('queryStringParameters', None) or {}
+
+    table = [
+        (method, re.sub(r'{\w+}', guid, path) + ('$' if '{' in path else ''), [
+            {'user': 'user', 'body': body, 'params': params}.get(a, path_params.get(a, None))
+            for a in args
+        ])
+        for method, path, args in routes
+    ]
+
+    route = next(
+        (r for r in table if re.fullmatch(r[1], event['path']) and r[0] == event['httpMethod']),
+        None
+    )
+
+    return route_fn(*route[2]) if route else None
+
+
+router = Router([
+    Route(method=method, path=path, function=route_fn, args=args)
+    for method, path, args in routes
+])
+
+
+def precompiled(event):
+
+    match = router.match(event['httpMethod'], event['path'], event.get('pathParameters', None))
+
+    if not match:
+        return None
+
+    return match.call(
+        user=lambda: 'user',
+        body=lambda: json.loads(event['body']) if event['body'] else None,
+        params=lambda: event.get('queryStringParameters', None) or {},
+    )
+
+
+def run(fn) -> float:
+
+    start = time.process_time()
+    for i in range(n_requests):
+        fn(events[i % len(events)])
+    return time.process_time() - start
+
+
+for event in events:
+    assert legacy(event) == precompiled(event), event['path']
+
+old = run(legacy)
+new = run(precompiled)
+
+print(f'{n_requests} requests over {len(events)} recorded events')
+print(f'route list: {old:.3f}s CPU ({old / n_requests * 1e6:.1f} us/request)')
+print(f'router:     {new:.3f}s CPU ({new / n_requests * 1e6:.1f} us/request)')
+print(f'speedup:    {old / new:.1f}x')
@@ -0,0 +1,64 @@
+'''CPU time spent validating connect tokens with and without the verified-token cache
+
+Run from the repository root:
+
+    python tests/benchmarks/bench_token_cache.py [n_connects] [n_tokens]
+
+Simulates a reconnect storm where n_tokens distinct users reconnect
+n_connects times in total, and reports process CPU time per connect.
+'''
+import os
+import sys
+import time
+from pathlib import Path
+
+import rsa
+from jose import jwk, jwt
+
+sys.path.append(str(Path(os.getcwd()) / 'services' / 'connections'))
+
+from cards_common.cache import TTLCache
+from connection_service import token
+
+n_connects = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+n_tokens = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+_, private = rsa.newkeys(2048)
+private_pem = private.save_pkcs1().decode('utf-8')
+
+public_jwk = jwk.construct(private_pem, 'RS256').public_key().to_dict()
+public_jwk['kid'] = 'bench'
+
+token.key_store.load([public_jwk])
+
+tokens = [
+    jwt.encode(
+        {'sub': f'user-{i}', 'aud': token.app_client_id, 'exp': int(time.time()) + 3600},
+        private_pem,
+        algorithm='RS256',
+        headers={'kid': 'bench'}
+    )
+    for i in range(n_tokens)
+]
+
+
+def run(cache_size: int) -> float:
+
+    token.token_cache = TTLCache(max_size=cache_size)
+
+    start = time.process_time()
+    for i in range(n_connects):
+        assert token.validate_and_decode(tokens[i % n_tokens])
+    return time.process_time() - start
+
+
+# silence per-token logging so only validation is measured
+token.log.disabled = True
+
+uncached = run(0)
+cached = run(1024)
+
+print(f'{n_connects} connects over {n_tokens} tokens')
+print(f'no cache:   {uncached:.3f}s CPU ({uncached / n_connects * 1e6:.0f} us/connect)')
+print(f'with cache: {cached:.3f}s CPU ({cached / n_connects * 1e6:.0f} us/connect)')
+print(f'speedup:    {uncached / cached:.1f}x')
@@ -0,0 +1,297 @@
+'''Local emulator of the websocket API for end to end runs on one machine
+
+Run from the repository root with DynamoDB Local (or moto_server) on port
+8000 and the table created by tests/scripts/setup_dynamo_local.py:
+
+    python -m tests.local.gateway [--port 8001] [--trust-tokens]
+
+Clients connect to ws://localhost:8001/?token=...&gameId=... as they would
+to the deployed stage. $connect and $disconnect go to the connections
+handler, messages are routed on their "game" attribute as the API's route
+selection expression does (SHD to the shd handler), and post_to_connection
+calls from the connection manager and the end of game pipeline are written
+to the matching socket. The table's stream is polled and fed to the
+connections handler, so a move reaches every client through the same path
+as when deployed.
+
+Each function handles one invocation at a time, like a single warm
+container. --trust-tokens skips Cognito and takes the token as the user ID.
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+ROOT = Path(__file__).resolve().parents[2]
+
+for code_uri in ['layers/common', 'services/connections', 'services/games/shd']:
+    sys.path.append(str(ROOT / code_uri))
+
+from tests.local.stream import LocalStream
+from tests.local.websocket import (
+    ConnectionClosed,
+    read_request,
+    read_message,
+    encode_frame,
+    handshake_response,
+    rejection_response,
+    TEXT,
+)
+
+log = logging.getLogger(__name__)
+
+
+class Connection(object):
+
+    def __init__(self, connection_id: str, writer: asyncio.StreamWriter):
+        self.connection_id = connection_id
+        self.writer = writer
+        self.outbox = asyncio.Queue()
+        self.connected_at = int(time.time() * 1000)
+
+    async def send_frames(self):
+        '''Writes posted data in the order it was posted'''
+
+        while True:
+            data = await self.outbox.get()
+            self.writer.write(encode_frame(TEXT, data))
+            await self.writer.drain()
+
+
+class ManagementApi(object):
+    '''Stands in for the apigatewaymanagementapi client used to post to connections'''
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    def post_to_connection(self, ConnectionId: str, Data) -> dict:
+
+        connection = self.gateway.connections.get(ConnectionId, None)
+
+        if not connection:
+            raise ClientError(
+                {'Error': {'Code': 'GoneException', 'Message': f'Connection {ConnectionId} is gone'}},
+                'PostToConnection'
+            )
+
+        data = Data if isinstance(Data, bytes) else Data.encode('utf-8')
+        self.gateway.loop.call_soon_threadsafe(connection.outbox.put_nowait, data)
+
+        return {}
+
+
+class LocalGateway(object):
+
+    def __init__(self, connect, disconnect, routes: dict, stage: str = 'local'):
+        '''connect, disconnect and the route handlers are lambda handlers'''
+
+        self.connect = connect
+        self.disconnect = disconnect
+        self.routes = routes
+        self.stage = stage
+        self.connections = {}
+        self.sessions = set()
+        self.executors = {}
+        self.loop = None
+
+    def executor(self, function) -> ThreadPoolExecutor:
+
+        if function not in self.executors:
+            self.executors[function] = ThreadPoolExecutor(max_workers=1)
+
+        return self.executors[function]
+
+    async def invoke(self, function, event: dict) -> dict:
+        return await self.loop.run_in_executor(self.executor(function), function, event, None)
+
+    def invoker(self, function):
+        '''Blocking call into a function's container, for the stream poller thread'''
+
+        return lambda event, context: self.executor(function).submit(function, event, context).result()
+
+    def request_context(self, connection_id: str, event_type: str, route_key: str) -> dict:
+
+        now = int(time.time() * 1000)
+
+        return {
+            'routeKey': route_key,
+            'eventType': event_type,
+            'messageId': str(uuid.uuid4()) if event_type == 'MESSAGE' else None,
+            'connectionId': connection_id,
+            'requestId': str(uuid.uuid4()),
+            'requestTimeEpoch': now,
+            'messageDirection': 'IN',
+            'stage': self.stage,
+            'domainName': 'localhost',
+            'apiId': 'local',
+        }
+
+    async def start(self, host: str = 'localhost', port: int = 8001):
+
+        self.loop = asyncio.get_running_loop()
+        return await asyncio.start_server(self.serve, host, port)
+
+    async def closed(self):
+        '''Waits for every session to finish, including its $disconnect'''
+
+        while self.sessions:
+            await asyncio.gather(*self.sessions, return_exceptions=True)
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+
+        session = asyncio.current_task()
+        self.sessions.add(session)
+
+        try:
+            await self.session(reader, writer)
+        finally:
+            self.sessions.discard(session)
+
+    async def session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+
+        path, params, headers = await read_request(reader)
+        connection_id = uuid.uuid4().hex[:16]
+
+        response = await self.invoke(self.connect, {
+            'headers': headers,
+            'queryStringParameters': params or None,
+            'requestContext': self.request_context(connection_id, 'CONNECT', '$connect'),
+            'isBase64Encoded': False,
+        })
+
+        status = int(response.get('statusCode', 500)) if response else 500
+
+        if status != 200:
+            writer.write(rejection_response(status))
+            await writer.drain()
+            writer.close()
+            return
+
+        writer.write(handshake_response(headers))
+        await writer.drain()
+
+        connection = Connection(connection_id, writer)
+        self.connections[connection_id] = connection
+        sender = asyncio.ensure_future(connection.send_frames())
+
+        try:
+            while True:
+                body = (await read_message(reader, writer)).decode('utf-8')
+                await self.route(connection_id, body)
+        except ConnectionClosed:
+            pass
+        finally:
+            del self.connections[connection_id]
+            sender.cancel()
+            writer.close()
+            await self.invoke(self.disconnect, {
+                'requestContext': self.request_context(connection_id, 'DISCONNECT', '$disconnect'),
+                'isBase64Encoded': False,
+            })
+
+    async def route(self, connection_id: str, body: str):
+
+        try:
+            route_key = json.loads(body).get('game', None)
+        except (ValueError, AttributeError):
+            route_key = None
+
+        function = self.routes.get(route_key, None)
+
+        if not function:
+            # no $default route is deployed, so API gateway answers the client itself
+            error = json.dumps({'message': 'Forbidden', 'connectionId': connection_id})
+            self.connections[connection_id].outbox.put_nowait(error.encode('utf-8'))
+            return
+
+        await self.invoke(function, {
+            'requestContext': self.request_context(connection_id, 'MESSAGE', route_key),
+            'body': body,
+            'isBase64Encoded': False,
+        })
+
+
+def trusted_claims(token: str) -> dict:
+    return {'sub': token}
+
+
+def local_gateway(trust_tokens: bool = False) -> tuple:
+    '''(gateway, stream) wired to the connections and shd handlers'''
+
+    from cards_common.aws import dynamo_endpoint
+    from connection_service import handler as connections, manager, db_client, table
+    from shd_service import handler as shd, archive
+
+    gateway = LocalGateway(
+        connect=connections.handle,
+        disconnect=connections.handle,
+        routes={'SHD': shd.handle},
+    )
+
+    manager.client = ManagementApi(gateway)
+    archive.gateway = ManagementApi(gateway)
+
+    if trust_tokens:
+        connections.validate_and_decode = trusted_claims
+
+    stream = LocalStream(
+        client=db_client.resolve(),
+        streams_client=boto3.client('dynamodbstreams', **dynamo_endpoint()),
+        table=table,
+        consumers=[gateway.invoker(connections.handle)],
+    )
+
+    return gateway, stream
+
+
+async def run(gateway: LocalGateway, stream: LocalStream, host: str, port: int, stopped: threading.Event):
+    '''Serves and polls the stream until stopped is set'''
+
+    server = await gateway.start(host, port)
+    stream.enable()
+
+    poller = asyncio.get_running_loop().run_in_executor(None, stream.run, stopped)
+
+    try:
+        while not stopped.is_set():
+            await asyncio.sleep(0.1)
+    finally:
+        stopped.set()
+        server.close()
+        await server.wait_closed()
+        await poller
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Local websocket gateway')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--trust-tokens', action='store_true', help='take tokens as user IDs instead of validating them')
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-2')
+
+    gateway, stream = local_gateway(trust_tokens=args.trust_tokens)
+    stopped = threading.Event()
+
+    log.info(f'Serving websocket API on ws://{args.host}:{args.port}')
+
+    try:
+        asyncio.run(run(gateway, stream, args.host, args.port, stopped))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+'''Time from a client's move to every client's screen through the local gateway
+
+Run from the repository root with DynamoDB Local (or moto_server) on port
+8000 and the table created by tests/scripts/setup_dynamo_local.py:
+
+    python -m tests.local.latency [--games 20] [--players 4]
+
+Seats users in new full games directly in the table, connects a client per
+player through the local gateway, then has the dealer deal. Reports how long
+after the DEAL was sent the first and the last client had the dealt table
+and their own hand, through the shd handler, the table's stream and the
+connection manager.
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import threading
+import statistics
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.append(str(ROOT / 'services' / 'games' / 'meta'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-2')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from tests.local.gateway import local_gateway
+from tests.local.websocket import Client
+
+
+def seat_game(db, n_players: int) -> tuple:
+    '''(game id, player ids in seat order) of a new full game'''
+
+    from meta_service.entities import GameMeta
+
+    players = [f'latency-{uuid.uuid4().hex[:8]}' for _ in range(n_players)]
+    joined = int(time.time() * 1000)
+
+    game = GameMeta(
+        created_by=players[0],
+        private=True,
+        table_size=n_players,
+        players_joined=n_players,
+        players={p: joined + i for i, p in enumerate(players)},
+    )
+
+    with db.batch_writer() as batch:
+        batch.put_item(Item=game.to_item())
+        for p in players:
+            batch.put_item(Item={'pk': f'USER#{p}', 'sk': 'ENTITY', 'id': p, 'in_game': True, 'game_id': game.id})
+
+    return game.id, players
+
+
+async def screen_updated(client: Client, sent_at: float) -> float:
+    '''Seconds from sent_at until the client had both the table state and its hand'''
+
+    waiting = {'state_update', 'player_update'}
+
+    while waiting:
+        message = json.loads(await client.recv())
+        if message.get('type') == 'state_update' and message['data'].get('sk') != 'SANITISED#SHD':
+            continue
+        waiting.discard(message.get('type'))
+
+    return time.perf_counter() - sent_at
+
+
+async def deal_round(db, port: int, n_players: int) -> list:
+
+    game_id, players = seat_game(db, n_players)
+
+    clients = [
+        await Client.connect('localhost', port, f'/?token={p}&gameId={game_id}')
+        for p in players
+    ]
+
+    sent_at = time.perf_counter()
+    await clients[0].send(json.dumps({'game': 'SHD', 'gameId': game_id, 'type': 'DEAL'}))
+
+    try:
+        return sorted(await asyncio.wait_for(
+            asyncio.gather(*[screen_updated(c, sent_at) for c in clients]),
+            timeout=30,
+        ))
+    finally:
+        for c in clients:
+            await c.close()
+
+
+def report(name: str, samples: list):
+
+    samples = sorted(s * 1000 for s in samples)
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+
+    print(f'{name:<8} p50 {statistics.median(samples):8.1f} ms  p95 {p95:8.1f} ms  max {samples[-1]:8.1f} ms')
+
+
+async def measure(n_games: int, n_players: int, port: int):
+
+    gateway, stream = local_gateway(trust_tokens=True)
+
+    from connection_service import db
+
+    server = await gateway.start('localhost', port)
+    stream.enable()
+
+    stopped = threading.Event()
+    poller = asyncio.get_running_loop().run_in_executor(None, stream.run, stopped)
+
+    first, last = [], []
+
+    try:
+        for _ in range(n_games):
+            times = await deal_round(db, port, n_players)
+            first.append(times[0])
+            last.append(times[-1])
+    finally:
+        await gateway.closed()
+        stopped.set()
+        server.close()
+        await server.wait_closed()
+        await poller
+
+    print(f'{n_games} deals to {n_players} players')
+    report('first', first)
+    report('last', last)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Move to screen latency through the local gateway')
+    parser.add_argument('--games', type=int, default=20)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8001)
+    args = parser.parse_args()
+
+    asyncio.run(measure(args.games, args.players, args.port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+'''Replays recorded games at full speed to catch engine and persistence regressions
+
+Run from the repository root:
+
+    python -m tests.local.replay export corpus.jsonl [game_id ...]
+    python -m tests.local.replay run corpus.jsonl [--handler] [--repeat N]
+
+export appends the record of each game (every recorded game when none are
+given) from the table to a corpus file, one JSON line per game. run feeds
+every game in the corpus through the engine alone, or with --handler through
+shd_service.handler against DynamoDB Local (or moto_server) on port 8000 with
+the table created by tests/scripts/setup_dynamo_local.py. Every recorded
+action was accepted when it was played, so any action that fails to apply is
+reported as a regression. Bots and the rate limit are switched off in the
+handler, recorded bot moves are sent like any other player's. Prints games
+and actions per second.
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+for code_uri in ['layers/common', 'services/games/shd', 'services/connections']:
+    sys.path.append(str(ROOT / code_uri))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-2')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from boto3.dynamodb.conditions import Attr
+
+from shd_service import recorder
+
+
+def export(db, path: str, game_ids: list) -> int:
+
+    if game_ids:
+        items = [
+            db.get_item(Key={'pk': f'GAME#{game_id}', 'sk': 'STATE#SHD'}).get('Item', None)
+            for game_id in game_ids
+        ]
+    else:
+        items, kwargs = [], {'FilterExpression': Attr('sk').eq('STATE#SHD') & Attr('record').exists()}
+        while True:
+            response = db.scan(**kwargs)
+            items += response['Items']
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    records = [item['record'] for item in items if item and item.get('record', None)]
+
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(recorder.to_line(record) + '\n')
+
+    return len(records)
+
+
+def seed(db, record: dict) -> tuple:
+    '''(game id, connection id per player, card ids) of a copy of the recorded game
+    stored ready to deal, with every player connected'''
+
+    from connection_service.entities import UserGameConnection
+
+    game_id = f'replay-{uuid.uuid4()}'
+    game = recorder.new_game(record, game_id=game_id)
+    joined = int(time.time() * 1000)
+
+    connections = {p: f'replay-{uuid.uuid4().hex[:12]}' for p in record['players']}
+
+    with db.batch_writer() as batch:
+
+        batch.put_item(Item={
+            'pk': f'GAME#{game_id}',
+            'sk': 'META',
+            'id': game_id,
+            'table_size': len(record['players']),
+            'players_joined': len(record['players']),
+            'players': {p: joined + i for i, p in enumerate(record['players'])},
+            'version': 1,
+        })
+
+        batch.put_item(Item={**game.to_dict(), 'pk': f'GAME#{game_id}', 'sk': 'STATE#SHD', 'version': 0})
+
+        for player_id, connection_id in connections.items():
+            connection = UserGameConnection(connection_id=connection_id, game_id=game_id, user_id=player_id, connected_at=joined)
+            batch.put_item(Item=connection.__dict__)
+
+    return game_id, connections, [c.id for c in game.state.stack]
+
+
+def replay_handler(db, handle, record: dict):
+    '''Sends each recorded action to the shd handler as its player's websocket message'''
+
+    game_id, connections, ids = seed(db, record)
+
+    for player_id, action_type, data in recorder.actions(record, ids):
+
+        response = handle({
+            'requestContext': {'routeKey': 'SHD', 'eventType': 'MESSAGE', 'connectionId': connections[player_id]},
+            'body': json.dumps({'game': 'SHD', 'gameId': game_id, 'type': action_type, 'data': data}),
+        }, None)
+
+        if int(response['statusCode']) != 200:
+            raise AssertionError(f'{action_type} by {player_id} returned {response["statusCode"]}: {response["body"]}')
+
+
+def run(path: str, through_handler: bool = False, repeat: int = 1) -> bool:
+
+    with open(path) as f:
+        records = [recorder.from_line(line) for line in f if line.strip()]
+
+    if through_handler:
+        from shd_service import bot, db, handler
+        bot.ENABLED = False
+        handler.limiter = None
+        handle = handler.handle
+        replay = lambda record: replay_handler(db, handle, record)
+    else:
+        replay = recorder.replay
+
+    n_actions = sum(len(r['actions']) for r in records) * repeat
+    failures = 0
+
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        for record in records:
+            try:
+                replay(record)
+            except Exception as e:
+                failures += 1
+                print(f'Game {record["game_id"]} failed to replay: {e!r}')
+
+    elapsed = time.perf_counter() - start
+    mode = 'handler' if through_handler else 'engine'
+
+    print(f'{len(records) * repeat} games, {n_actions} actions through the {mode} in {elapsed:.2f}s')
+    print(f'{len(records) * repeat / elapsed:10.1f} games/s {n_actions / elapsed:10.1f} actions/s')
+
+    return failures == 0
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Record and replay games')
+    commands = parser.add_subparsers(dest='command')
+
+    export_parser = commands.add_parser('export', help='append game records from the table to a corpus')
+    export_parser.add_argument('corpus')
+    export_parser.add_argument('game_ids', nargs='*')
+
+    run_parser = commands.add_parser('run', help='replay every game in a corpus')
+    run_parser.add_argument('corpus')
+    run_parser.add_argument('--handler', action='store_true', help='replay through the handler and local table')
+    run_parser.add_argument('--repeat', type=int, default=1)
+
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        from shd_service import db
+        print(f'Exported {export(db, args.corpus, args.game_ids)} games to {args.corpus}')
+    elif args.command == 'run':
+        sys.exit(0 if run(args.corpus, args.handler, args.repeat) else 1)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+'''Just enough of RFC 6455 for the local gateway and its test clients
+
+Text, binary, ping and close frames over asyncio streams, with no extensions.
+Frames from clients are masked as the protocol requires.
+'''
+import os
+import base64
+import struct
+import asyncio
+import hashlib
+from urllib.parse import urlsplit, parse_qsl
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+CONTINUATION = 0x0
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+def accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+
+
+def encode_frame(opcode: int, payload: bytes, mask: bool = False) -> bytes:
+
+    length = len(payload)
+    head = bytes([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+
+    if length < 126:
+        head += bytes([mask_bit | length])
+    elif length < 1 << 16:
+        head += bytes([mask_bit | 126]) + struct.pack('!H', length)
+    else:
+        head += bytes([mask_bit | 127]) + struct.pack('!Q', length)
+
+    if not mask:
+        return head + payload
+
+    key = os.urandom(4)
+    return head + key + bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple:
+    '''(final, opcode, payload) of the next frame'''
+
+    try:
+        b1, b2 = await reader.readexactly(2)
+        length = b2 & 0x7f
+
+        if length == 126:
+            length, = struct.unpack('!H', await reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', await reader.readexactly(8))
+
+        key = await reader.readexactly(4) if b2 & 0x80 else None
+        payload = await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        raise ConnectionClosed()
+
+    if key:
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+
+    return bool(b1 & 0x80), b1 & 0x0f, payload
+
+
+async def read_message(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, mask: bool = False) -> bytes:
+    '''Payload of the next data message, answering pings and joining fragments'''
+
+    message = b''
+
+    while True:
+
+        final, opcode, payload = await read_frame(reader)
+
+        if opcode == PING:
+            writer.write(encode_frame(PONG, payload, mask))
+            continue
+        elif opcode == PONG:
+            continue
+        elif opcode == CLOSE:
+            raise ConnectionClosed()
+
+        message += payload
+
+        if final:
+            return message
+
+
+async def read_request(reader: asyncio.StreamReader) -> tuple:
+    '''(path, query parameters, headers) of an opening handshake'''
+
+    request_line = (await reader.readline()).decode('latin-1').strip()
+    headers = {}
+
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip()] = value.strip()
+
+    _, target, _ = request_line.split(' ', 2)
+    url = urlsplit(target)
+
+    return url.path, dict(parse_qsl(url.query)), headers
+
+
+def handshake_response(headers: dict) -> bytes:
+
+    key = next(v for k, v in headers.items() if k.lower() == 'sec-websocket-key')
+
+    return (
+        'HTTP/1.1 101 Switching Protocols\r\n'
+        'Upgrade: websocket\r\n'
+        'Connection: Upgrade\r\n'
+        f'Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n'
+    ).encode()
+
+
+def rejection_response(status: int) -> bytes:
+    return f'HTTP/1.1 {status} Rejected\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.encode()
+
+
+class Client(object):
+    '''Websocket client for driving the local gateway'''
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host: str, port: int, path: str = '/'):
+
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+
+        writer.write((
+            f'GET {path} HTTP/1.1\r\n'
+            f'Host: {host}:{port}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\n'
+            'Sec-WebSocket-Version: 13\r\n\r\n'
+        ).encode())
+        await writer.drain()
+
+        status = (await reader.readline()).decode('latin-1').split(' ')
+        while (await reader.readline()).strip():
+            pass
+
+        if len(status) < 2 or status[1] != '101':
+            writer.close()
+            raise ConnectionRefusedError(f'Handshake rejected with status {status[1:2]}')
+
+        return cls(reader, writer)
+
+    async def send(self, text: str):
+        self.writer.write(encode_frame(TEXT, text.encode('utf-8'), mask=True))
+        await self.writer.drain()
+
+    async def recv(self) -> str:
+        return (await read_message(self.reader, self.writer, mask=True)).decode('utf-8')
+
+    async def close(self):
+
+        try:
+            self.writer.write(encode_frame(CLOSE, b'', mask=True))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+
+        self.writer.close()
@@ -0,0 +1,105 @@
+'''Reports per-module import time for each Lambda package
+
+Run from the repository root:
+
+    python tests/scripts/import_times.py [--eager] [--top N] [package ...]
+
+Each handler is imported in a fresh interpreter with python -X importtime,
+with its CodeUri and the common layer on the path as in Lambda. Prints the
+total import time and the slowest modules by self and cumulative time, and
+the time per top level package. --eager sets EAGER_INIT so clients are
+built at import for comparison.
+'''
+import os
+import sys
+import argparse
+import subprocess
+from pathlib import Path
+from collections import defaultdict
+
+ROOT = Path(__file__).resolve().parents[2]
+
+PACKAGES = {
+    'users': ('services/users', 'user_service.handler'),
+    'games': ('services/games/meta', 'meta_service.handler'),
+    'matchmaking': ('services/games/meta', 'meta_service.matcher'),
+    'shd': ('services/games/shd', 'shd_service.handler'),
+    'connections': ('services/connections', 'connection_service.handler'),
+}
+
+
+def import_times(code_uri: str, module: str, eager: bool = False) -> list:
+    '''(module, self us, cumulative us) for every module the handler imports'''
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([str(ROOT / code_uri), str(ROOT / 'layers' / 'common')])
+    env.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-2')
+    env.pop('EAGER_INIT', None)
+
+    if eager:
+        env['EAGER_INIT'] = '1'
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        env=env,
+        cwd=str(ROOT / code_uri),
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed:\n{result.stderr[-2000:]}')
+
+    times = []
+
+    for line in result.stderr.splitlines():
+
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    return times
+
+
+def report(name: str, times: list, top: int):
+
+    total = sum(t[1] for t in times)
+
+    by_package = defaultdict(int)
+    for module, self_us, _ in times:
+        by_package[module.split('.')[0]] += self_us
+
+    print(f'== {name}: {len(times)} modules, {total / 1000:.1f} ms')
+
+    print('  slowest packages (self time summed):')
+    for package, us in sorted(by_package.items(), key=lambda p: -p[1])[:top]:
+        print(f'    {us / 1000:8.1f} ms  {package}')
+
+    print('  slowest modules (self / cumulative):')
+    for module, self_us, cumulative_us in sorted(times, key=lambda t: -t[1])[:top]:
+        print(f'    {self_us / 1000:8.1f} ms  {cumulative_us / 1000:8.1f} ms  {module}')
+
+    print()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('packages', nargs='*', default=list(PACKAGES), help=', '.join(PACKAGES))
+    parser.add_argument('--eager', action='store_true', help='build clients at import')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    unknown = set(args.packages) - set(PACKAGES)
+    if unknown:
+        parser.error(f'unknown packages: {", ".join(sorted(unknown))}')
+
+    for name in args.packages:
+        code_uri, module = PACKAGES[name]
+        report(name, import_times(code_uri, module, args.eager), args.top)
+
+
+if __name__ == '__main__':
+    main()
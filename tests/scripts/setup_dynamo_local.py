@@ -25,8 +25,59 @@ table = dynamodb.create_table(
             'AttributeName': 'sk',
             'AttributeType': 'S'
         },
+        {
+            'AttributeName': 'lobby_pk',
+            'AttributeType': 'S'
+        },
+        {
+            'AttributeName': 'lobby_sk',
+            'AttributeType': 'S'
+        },
+        {
+            'AttributeName': 'connection_id',
+            'AttributeType': 'S'
+        },
 
     ],
+    GlobalSecondaryIndexes=[
+        {
+            'IndexName': 'LobbyIndex',
+            'KeySchema': [
+                {
+                    'AttributeName': 'lobby_pk',
+                    'KeyType': 'HASH'
+                },
+                {
+                    'AttributeName': 'lobby_sk',
+                    'KeyType': 'RANGE'
+                }
+            ],
+            'Projection': {
+                'ProjectionType': 'INCLUDE',
+                'NonKeyAttributes': ['id', 'game_type', 'table_size', 'players_joined', 'created_by', 'created_at']
+            },
+            'ProvisionedThroughput': {
+                'ReadCapacityUnits': 5,
+                'WriteCapacityUnits': 5
+            }
+        },
+        {
+            'IndexName': 'ConnectionIndex',
+            'KeySchema': [
+                {
+                    'AttributeName': 'connection_id',
+                    'KeyType': 'HASH'
+                }
+            ],
+            'Projection': {
+                'ProjectionType': 'KEYS_ONLY'
+            },
+            'ProvisionedThroughput': {
+                'ReadCapacityUnits': 5,
+                'WriteCapacityUnits': 5
+            }
+        }
+    ],
     ProvisionedThroughput={
         'ReadCapacityUnits': 10,
         'WriteCapacityUnits': 10
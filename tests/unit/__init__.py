@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import warnings
 from pathlib import Path
@@ -10,6 +11,9 @@ import docker
 from docker import DockerClient
 from docker.models.containers import Container
 
+# shared lambda layer, found under /opt/python when deployed
+sys.path.append(str(Path(os.getcwd()) / 'layers' / 'common'))
+
 class BaseTestCase(TestCase):
 
     @classmethod
@@ -141,8 +145,59 @@ class BaseTestCase(TestCase):
                     'AttributeName': 'sk',
                     'AttributeType': 'S'
                 },
+                {
+                    'AttributeName': 'lobby_pk',
+                    'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'lobby_sk',
+                    'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'connection_id',
+                    'AttributeType': 'S'
+                },
 
             ],
+            GlobalSecondaryIndexes=[
+                {
+                    'IndexName': 'LobbyIndex',
+                    'KeySchema': [
+                        {
+                            'AttributeName': 'lobby_pk',
+                            'KeyType': 'HASH'
+                        },
+                        {
+                            'AttributeName': 'lobby_sk',
+                            'KeyType': 'RANGE'
+                        }
+                    ],
+                    'Projection': {
+                        'ProjectionType': 'INCLUDE',
+                        'NonKeyAttributes': ['id', 'game_type', 'table_size', 'players_joined', 'created_by', 'created_at']
+                    },
+                    'ProvisionedThroughput': {
+                        'ReadCapacityUnits': 5,
+                        'WriteCapacityUnits': 5
+                    }
+                },
+                {
+                    'IndexName': 'ConnectionIndex',
+                    'KeySchema': [
+                        {
+                            'AttributeName': 'connection_id',
+                            'KeyType': 'HASH'
+                        }
+                    ],
+                    'Projection': {
+                        'ProjectionType': 'KEYS_ONLY'
+                    },
+                    'ProvisionedThroughput': {
+                        'ReadCapacityUnits': 5,
+                        'WriteCapacityUnits': 5
+                    }
+                }
+            ],
             ProvisionedThroughput={
                 'ReadCapacityUnits': 10,
                 'WriteCapacityUnits': 10
@@ -0,0 +1,53 @@
+import os
+import sys
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'layers' / 'common')
+sys.path.append(test_path)
+
+from cards_common import aws
+from cards_common.aws import Lazy
+
+
+class TestLazy(TestCase):
+
+    def test_built_on_first_use(self):
+
+        factory = MagicMock()
+        client = Lazy(factory)
+
+        self.assertFalse(client.resolved)
+        factory.assert_not_called()
+
+        client.get_item(Key={})
+        client.put_item(Item={})
+
+        factory.assert_called_once()
+        factory.return_value.get_item.assert_called_once_with(Key={})
+
+
+    def test_eager_init(self):
+
+        factory = MagicMock()
+
+        with patch.object(aws, 'EAGER_INIT', True):
+            client = Lazy(factory)
+
+        self.assertTrue(client.resolved)
+        factory.assert_called_once()
+
+
+    def test_patched_attributes_take_precedence(self):
+
+        target = MagicMock()
+        client = Lazy(lambda: target)
+
+        with patch.object(client, 'query', return_value='patched'):
+            self.assertEqual('patched', client.query())
+
+        client.query()
+        target.query.assert_called_once()
@@ -4,9 +4,14 @@ import uuid
 import json
 from pathlib import Path
 from unittest import TestCase
-from unittest.mock import patch
+from copy import deepcopy
+from unittest.mock import patch, MagicMock
 from http import HTTPStatus as s
 
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
 from . import BaseTestCase
 
 sys.dont_write_bytecode = True
@@ -25,6 +30,7 @@ from services.games.meta.meta_service.handler import handle as games_handle
 from services.users.user_service.handler import handle as user_handle
 
 from services.connections.connection_service import handler
+from connection_service import manager
 
 class TestConnectionsHandler(BaseTestCase):
 
@@ -104,6 +110,64 @@ class TestConnectionsHandler(BaseTestCase):
         self.assertEqual(s.UNAUTHORIZED, response['statusCode'])
 
 
+    def test_reconnect_replaces_session(self):
+
+        with patch.object(handler, 'validate_and_decode', return_value={'sub': self.users[0]}):
+
+            for connection_id in ['conn-1', 'conn-2']:
+
+                event = self.replace_request_context_param(
+                    self.websocket_connect_event,
+                    'connectionId',
+                    connection_id
+                )
+
+                response = handler.handle(event, None)
+                self.assertEqual(s.OK, response['statusCode'])
+
+        connections = self.db.query(
+            KeyConditionExpression=Key('pk').eq(f'GAME#{self.game_id}') & Key('sk').begins_with('CONN#')
+        )['Items']
+
+        self.assertEqual(1, len(connections))
+        self.assertEqual('conn-2', connections[0]['connection_id'])
+        self.assertEqual(f'CONN#{self.users[0]}', connections[0]['sk'])
+
+
+    def test_connect_with_game_id(self):
+
+        event = self.replace_query_params(
+            self.websocket_connect_event,
+            'gameId',
+            self.game_id
+        )
+
+        with patch.object(handler, 'validate_and_decode', return_value={'sub': self.users[0]}):
+            response = handler.handle(event, None)
+
+        self.assertEqual(s.OK, response['statusCode'])
+
+        connection = self.db.get_item(
+            Key={'pk': f'GAME#{self.game_id}', 'sk': f'CONN#{self.users[0]}'}
+        ).get('Item', None)
+
+        self.assertIsNotNone(connection)
+
+
+    def test_connect_with_game_id_not_in_game(self):
+
+        event = self.replace_query_params(
+            self.websocket_connect_event,
+            'gameId',
+            self.game_id
+        )
+
+        with patch.object(handler, 'validate_and_decode', return_value={'sub': self.users[1]}):
+            response = handler.handle(event, None)
+
+        self.assertEqual(s.CONFLICT, response['statusCode'])
+
+
     def test_stream_handler_game_update(self):
 
         with patch.object(handler, 'validate_and_decode', return_value={'sub': self.users[0]}):
@@ -116,4 +180,187 @@ class TestConnectionsHandler(BaseTestCase):
 
 
 
-        
\ No newline at end of file
+        
+
+
+    def test_disconnect_removes_connection(self):
+
+        with patch.object(handler, 'validate_and_decode', return_value={'sub': self.users[0]}):
+            response = handler.handle(self.websocket_connect_event, None)
+            self.assertEqual(s.OK, response['statusCode'])
+
+        key = {'pk': f'GAME#{self.game_id}', 'sk': f'CONN#{self.users[0]}'}
+        self.assertIn('Item', self.db.get_item(Key=key))
+
+        event = self.replace_request_context_param(self.websocket_connect_event, 'eventType', 'DISCONNECT')
+
+        response = handler.handle(event, None)
+        self.assertEqual(s.OK, response['statusCode'])
+
+        self.assertNotIn('Item', self.db.get_item(Key=key))
+
+
+    def test_disconnect_keeps_newer_connection(self):
+
+        self.db.put_item(Item={'pk': f'GAME#{self.game_id}', 'sk': f'CONN#{self.users[0]}', 'connection_id': 'newer', 'user_id': self.users[0]})
+
+        removed = manager.remove_connection({'pk': f'GAME#{self.game_id}', 'sk': f'CONN#{self.users[0]}', 'connection_id': 'older'})
+
+        self.assertFalse(removed)
+        self.assertIn('Item', self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': f'CONN#{self.users[0]}'}))
+
+
+    def test_legacy_connections_not_sent_to(self):
+
+        with self.db.batch_writer() as batch:
+            batch.put_item(Item={'pk': f'GAME#{self.game_id}', 'sk': f'CONN#{self.users[0]}', 'connection_id': 'player', 'user_id': self.users[0]})
+            batch.put_item(Item={'pk': f'GAME#{self.game_id}', 'sk': 'CONN#legacy', 'connection_id': 'legacy', 'user_id': self.users[0]})
+
+        client = MagicMock()
+
+        with patch.object(manager, 'client', client):
+            manager.process_stream([deepcopy(self.game_update_stream_event['Records'][1])])
+
+        sent_to = [c[1]['ConnectionId'] for c in client.post_to_connection.call_args_list]
+
+        self.assertEqual(['player'], sent_to)
+        self.assertNotIn('Item', self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': 'CONN#legacy'}))
+
+
+    def test_gone_connections_removed(self):
+
+        with self.db.batch_writer() as batch:
+            batch.put_item(Item={'pk': f'GAME#{self.game_id}', 'sk': f'CONN#{self.users[0]}', 'connection_id': 'player', 'user_id': self.users[0]})
+            batch.put_item(Item={'pk': f'GAME#{self.game_id}', 'sk': f'VIEW#{self.users[1]}', 'connection_id': 'gone', 'user_id': self.users[1]})
+
+        def post(ConnectionId, Data):
+            if ConnectionId == 'gone':
+                raise ClientError({'Error': {'Code': 'GoneException'}}, 'PostToConnection')
+
+        client = MagicMock()
+        client.post_to_connection.side_effect = post
+
+        with patch.object(manager, 'client', client):
+            manager.process_stream([deepcopy(self.game_update_stream_event['Records'][1])])
+
+        self.assertIn('Item', self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': f'CONN#{self.users[0]}'}))
+        self.assertNotIn('Item', self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': f'VIEW#{self.users[1]}'}))
+
+
+    def test_stream_handler_counts_processed_records(self):
+
+        event = deepcopy(self.game_update_stream_event)
+        event['Records'].append({'eventName': 'REMOVE', 'dynamodb': {'Keys': event['Records'][1]['dynamodb']['Keys']}})
+
+        with patch.object(manager, 'client', MagicMock()):
+            response = handler.handle(event, None)
+
+        self.assertEqual(s.OK, response['statusCode'])
+        self.assertEqual('Processed 4 records', json.loads(response['body'])['message'])
+
+
+    def connect_spectator(self, user_id: str) -> dict:
+
+        event = self.replace_query_params(self.websocket_connect_event, 'gameId', self.game_id)
+        event = self.replace_query_params(event, 'spectate', 'true')
+
+        with patch.object(handler, 'validate_and_decode', return_value={'sub': user_id}):
+            return handler.handle(event, None)
+
+
+    def test_connect_as_spectator(self):
+
+        # games are created private, and only public games can be watched
+        self.assertEqual(s.NOT_FOUND, self.connect_spectator(self.users[1])['statusCode'])
+
+        self.db.update_item(
+            Key={'pk': f'GAME#{self.game_id}', 'sk': 'META'},
+            UpdateExpression='SET #private = :f',
+            ExpressionAttributeNames={'#private': 'private'},
+            ExpressionAttributeValues={':f': False},
+        )
+
+        self.assertEqual(s.OK, self.connect_spectator(self.users[1])['statusCode'])
+
+        connection = self.db.get_item(
+            Key={'pk': f'GAME#{self.game_id}', 'sk': f'VIEW#{self.users[1]}'}
+        ).get('Item', None)
+
+        self.assertIsNotNone(connection)
+
+
+    def test_update_sent_to_every_player_and_spectator(self):
+
+        with self.db.batch_writer() as batch:
+            batch.put_item(Item={'pk': f'GAME#{self.game_id}', 'sk': f'CONN#{self.users[0]}', 'connection_id': 'player', 'user_id': self.users[0]})
+            for i in range(25):
+                batch.put_item(Item={'pk': f'GAME#{self.game_id}', 'sk': f'VIEW#{i}', 'connection_id': f'viewer-{i}', 'user_id': str(i)})
+
+        client = MagicMock()
+
+        # small pages so every page of the audience has to be followed
+        with patch.object(manager, 'client', client), \
+                patch.object(manager, 'CONNECTION_FIELDS', {**manager.CONNECTION_FIELDS, 'Limit': 10}):
+            manager.process_stream([deepcopy(self.game_update_stream_event['Records'][1])])
+
+        calls = client.post_to_connection.call_args_list
+        sent_to = sorted(c[1]['ConnectionId'] for c in calls)
+
+        self.assertEqual(sorted(['player'] + [f'viewer-{i}' for i in range(25)]), sent_to)
+
+        # one payload built for everyone
+        self.assertEqual(1, len({id(c[1]['Data']) for c in calls}))
+
+
+    def test_views_derived_from_state(self):
+
+        card = lambda i, **kw: {'id': f'card-{i}', 'suit': 'S', 'rank': '9', 'value': 9, **kw}
+        state = {
+            'status': 'PLAYING',
+            'stack': [card(9)],
+            'dead': [],
+            'table': [],
+            'players': [
+                {'id': user_id, 'hand': [card(i)], 'table': [], 'hidden': [card(i + 4, is_hidden=True, order=0)], 'can_play': True}
+                for i, user_id in enumerate(self.users[:2])
+            ],
+        }
+
+        with self.db.batch_writer() as batch:
+            for i, user_id in enumerate(self.users[:2]):
+                batch.put_item(Item={'pk': f'GAME#{self.game_id}', 'sk': f'CONN#{user_id}', 'connection_id': f'player-{i}', 'user_id': user_id})
+            batch.put_item(Item={'pk': f'GAME#{self.game_id}', 'sk': f'VIEW#{self.users[2]}', 'connection_id': 'viewer', 'user_id': self.users[2]})
+
+        item = {'pk': f'GAME#{self.game_id}', 'sk': 'STATE#SHD', 'version': 3, 'derived_views': True, 'state': state}
+        record = {
+            'eventName': 'MODIFY',
+            'dynamodb': {
+                'Keys': {'pk': {'S': item['pk']}, 'sk': {'S': item['sk']}},
+                'NewImage': {k: TypeSerializer().serialize(v) for k, v in item.items()},
+            },
+        }
+
+        client = MagicMock()
+
+        with patch.object(manager, 'client', client):
+            manager.process_stream([record])
+
+        sent = {}
+        for call in client.post_to_connection.call_args_list:
+            message = json.loads(call[1]['Data'])
+            sent.setdefault(call[1]['ConnectionId'], {})[message['type']] = message['data']
+
+        self.assertEqual({'state_update'}, set(sent['viewer']))
+        self.assertEqual({'state_update', 'player_update'}, set(sent['player-0']))
+
+        public = sent['viewer']
+        self.assertEqual('SANITISED#SHD', public['state_update']['sk'])
+        self.assertEqual(1, public['state_update']['stack'])
+        self.assertEqual([1, 1], [p['hand'] for p in public['state_update']['players']])
+        self.assertNotIn('can_play', public['state_update']['players'][0])
+        self.assertNotIn('rank', public['state_update']['players'][0]['hidden'][0])
+
+        own = sent['player-1']['player_update']
+        self.assertEqual(f'PLAYER#{self.users[1]}', own['sk'])
+        self.assertEqual(['card-1'], [c['id'] for c in own['hand']])
+        self.assertEqual({'id': 'card-5', 'is_hidden': True, 'order': 0}, own['hidden'][0])
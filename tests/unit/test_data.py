@@ -0,0 +1,84 @@
+import os
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from boto3.dynamodb.conditions import Key
+
+from . import BaseTestCase
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'layers' / 'common')
+sys.path.append(test_path)
+
+from cards_common import data
+from cards_common.data import query_items, projection, batch_get_items, Capacity, UnprocessedKeysError
+
+
+class TestData(BaseTestCase):
+
+    def setUp(self):
+
+        super().setUp()
+
+        with self.db.batch_writer() as batch:
+            for i in range(25):
+                batch.put_item(Item={'pk': 'GAME#paged', 'sk': f'VIEW#{i:02}', 'connection_id': f'c{i}'})
+
+        self.condition = Key('pk').eq('GAME#paged') & Key('sk').begins_with('VIEW#')
+
+
+    def test_follows_every_page(self):
+
+        capacity = Capacity()
+
+        items = list(query_items(self.db, KeyConditionExpression=self.condition, page_size=10, capacity=capacity))
+
+        self.assertEqual([f'VIEW#{i:02}' for i in range(25)], [i['sk'] for i in items])
+        self.assertEqual(3, capacity.pages)
+        self.assertGreater(capacity.units, 0)
+
+
+    def test_stops_reading_when_done(self):
+
+        table = MagicMock(wraps=self.db)
+
+        items = query_items(table, KeyConditionExpression=self.condition, page_size=10, **projection('connection_id'))
+
+        self.assertEqual({'connection_id': 'c0'}, next(items))
+        self.assertEqual(1, table.query.call_count)
+
+        self.assertEqual(12, len(list(query_items(table, KeyConditionExpression=self.condition, limit=12, page_size=5))))
+        self.assertEqual(1 + 3, table.query.call_count)
+
+
+    def test_unprocessed_keys_retried_with_backoff(self):
+
+        keys = [{'pk': 'GAME#paged', 'sk': f'VIEW#{i:02}'} for i in range(3)]
+        unprocessed = {'Responses': {'t': []}, 'UnprocessedKeys': {'t': {'Keys': keys}}}
+
+        db_resource = MagicMock()
+        db_resource.batch_get_item.side_effect = [unprocessed, unprocessed, {'Responses': {'t': keys}}]
+
+        with patch.object(data.time, 'sleep') as sleep:
+            self.assertEqual(keys, batch_get_items(db_resource, 't', keys))
+
+        delays = [c[0][0] for c in sleep.call_args_list]
+
+        self.assertEqual(2, len(delays))
+        self.assertLessEqual(delays[0], data.BATCH_GET_BASE_DELAY)
+        self.assertGreaterEqual(delays[1], data.BATCH_GET_BASE_DELAY)
+
+
+    def test_unprocessed_keys_give_up(self):
+
+        keys = [{'pk': 'GAME#paged', 'sk': 'VIEW#00'}]
+
+        db_resource = MagicMock()
+        db_resource.batch_get_item.return_value = {'Responses': {}, 'UnprocessedKeys': {'t': {'Keys': keys}}}
+
+        with patch.object(data.time, 'sleep'), self.assertRaises(UnprocessedKeysError):
+            batch_get_items(db_resource, 't', keys)
+
+        self.assertEqual(data.BATCH_GET_ATTEMPTS, db_resource.batch_get_item.call_count)
@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+from decimal import Decimal
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'layers' / 'common')
+sys.path.append(test_path)
+
+from cards_common import encoding
+
+
+class TestEncoding(TestCase):
+
+    def setUp(self):
+        self.item = {
+            'players_joined': Decimal('3'),
+            'ratio': Decimal('0.5'),
+            'cards': [{'rank': Decimal('14'), 'suit': 'S'}],
+            'tags': {'a'},
+            'name': None,
+        }
+        self.expected = {
+            'players_joined': 3,
+            'ratio': 0.5,
+            'cards': [{'rank': 14, 'suit': 'S'}],
+            'tags': ['a'],
+            'name': None,
+        }
+
+
+    def test_decimals_and_sets(self):
+
+        data = json.loads(encoding.dumps_bytes(self.item))
+
+        self.assertEqual(self.expected, data)
+        self.assertIsInstance(data['players_joined'], int)
+
+
+    def test_stdlib_backend(self):
+
+        with patch.object(encoding, 'orjson', None):
+            self.assertEqual(self.expected, json.loads(encoding.dumps(self.item)))
+
+
+    def test_unknown_types_rejected(self):
+
+        with self.assertRaises(TypeError):
+            encoding.dumps({'x': object()})
+
+
+    def test_make_response(self):
+
+        response = encoding.make_response(200, self.item, headers={'ETag': 'W/"1"'})
+
+        self.assertEqual('*', response['headers']['Access-Control-Allow-Origin'])
+        self.assertEqual('W/"1"', response['headers']['ETag'])
+        self.assertEqual(self.expected, json.loads(response['body']))
@@ -4,6 +4,7 @@ import uuid
 import json
 from pathlib import Path
 from unittest import TestCase
+from unittest.mock import patch
 from http import HTTPStatus as s
 
 from . import BaseTestCase
@@ -16,8 +17,9 @@ sys.path.append(test_path)
 test_path = str(Path(os.getcwd()) / 'services' / 'users')
 sys.path.append(test_path)
 
-from services.games.meta.meta_service.entities import User
+from services.games.meta.meta_service.entities import User, GameMeta, seat_order, BOT_PREFIX
 from services.games.meta.meta_service.handler import handle
+from meta_service import routes
 from services.users.user_service.handler import handle as user_handle
 
 class TestGamesHandler(BaseTestCase):
@@ -56,6 +58,9 @@ class TestGamesHandler(BaseTestCase):
         with open('tests/events/get-game-authd.json') as f:
             self.get_game_authd_event = json.load(f)
 
+        with open('tests/events/get-open-games-authd.json') as f:
+            self.get_open_games_authd_event = json.load(f)
+
 
     def test_create_game_authd(self):
 
@@ -96,6 +101,111 @@ class TestGamesHandler(BaseTestCase):
 
 
     
+    def test_get_game_not_modified(self):
+
+        event = self.replace_event_username(
+            self.create_game_authd_event,
+            self.users[0]
+        )
+
+        response = handle(event, None)
+        game_id = json.loads(response['body'])['id']
+
+        get_event = self.replace_event_username(
+            self.get_game_authd_event,
+            self.users[0]
+        )
+
+        response = handle(get_event, None)
+        self.assertEqual(s.OK, response['statusCode'])
+        etag = response['headers']['ETag']
+
+        get_event['headers']['If-None-Match'] = etag
+
+        response = handle(get_event, None)
+        self.assertEqual(s.NOT_MODIFIED, response['statusCode'])
+        self.assertEqual('', response['body'])
+
+        # another player joining changes the game version
+        event = self.replace_event_username(
+            self.join_game_authd_event,
+            self.users[1]
+        )
+        event = self.replace_event_game_id(event, game_id)
+        handle(event, None)
+
+        response = handle(get_event, None)
+        self.assertEqual(s.OK, response['statusCode'])
+        self.assertNotEqual(etag, response['headers']['ETag'])
+        self.assertEqual(2, json.loads(response['body'])['meta']['players_joined'])
+
+
+    def test_get_game_polls_version_item(self):
+
+        event = self.replace_event_username(
+            self.create_game_authd_event,
+            self.users[0]
+        )
+
+        game_id = json.loads(handle(event, None)['body'])['id']
+
+        get_event = self.replace_event_username(
+            self.get_game_authd_event,
+            self.users[0]
+        )
+
+        get_event['headers']['If-None-Match'] = handle(get_event, None)['headers']['ETag']
+
+        with patch.object(routes.db, 'get_item', wraps=routes.db.get_item) as get_item, \
+                patch.object(routes.db_resource, 'batch_get_item', wraps=routes.db_resource.batch_get_item) as batch_get:
+            response = handle(get_event, None)
+
+        self.assertEqual(s.NOT_MODIFIED, response['statusCode'])
+        self.assertEqual(0, batch_get.call_count)
+        self.assertEqual(
+            [{'pk': f'GAME#{game_id}', 'sk': 'VERSION'}],
+            [c[1]['Key'] for c in get_item.call_args_list if c[1]['Key']['pk'].startswith('GAME#')]
+        )
+
+        # games stored before the version item are still served, untagged
+        self.db.delete_item(Key={'pk': f'GAME#{game_id}', 'sk': 'VERSION'})
+
+        response = handle(get_event, None)
+        self.assertEqual(s.OK, response['statusCode'])
+        self.assertNotIn('ETag', response['headers'])
+        self.assertEqual(game_id, json.loads(response['body'])['meta']['id'])
+
+
+    def test_get_game_reads_visible_items_by_key(self):
+
+        event = self.replace_event_username(
+            self.create_game_authd_event,
+            self.users[0]
+        )
+
+        game_id = json.loads(handle(event, None)['body'])['id']
+
+        # fill out the partition with state, player views and a connection
+        for sk in ['STATE#SHD', 'SANITISED#SHD', f'PLAYER#{self.users[0]}', f'PLAYER#{self.users[1]}', f'CONN#{self.users[0]}']:
+            self.db.put_item(Item={'pk': f'GAME#{game_id}', 'sk': sk, 'version': 1})
+
+        event = self.replace_event_username(
+            self.get_game_authd_event,
+            self.users[0]
+        )
+
+        with patch.object(routes.db_resource, 'batch_get_item', wraps=routes.db_resource.batch_get_item) as batch_get:
+            response = handle(event, None)
+
+        self.assertEqual(s.OK, response['statusCode'])
+
+        keys = batch_get.call_args[1]['RequestItems'][routes.table]['Keys']
+        self.assertEqual(
+            ['META', f'PLAYER#{self.users[0]}', 'SANITISED#SHD'],
+            sorted(k['sk'] for k in keys)
+        )
+
+
     def test_create_game_user_in_game(self):
 
         event = self.replace_event_username(
@@ -141,10 +251,16 @@ class TestGamesHandler(BaseTestCase):
         result = json.loads(response['body'])
 
         self.assertEqual(s.OK, response['statusCode'])
-        self.assertEqual(2, len(result['players']))
-        self.assertEqual(2, result['players_joined'])
-        self.assertTrue(self.users[0] in result['players'])
-        self.assertTrue(self.users[1] in result['players'])
+        self.assertEqual(game_id, result['id'])
+
+        game = self.db.get_item(
+            Key={'pk': f'GAME#{game_id}', 'sk': 'META'}
+        )['Item']
+
+        self.assertEqual(2, game['players_joined'])
+        self.assertEqual(2, len(game['players']))
+        self.assertEqual(self.users[:2], seat_order(game['players']))
+        self.assertEqual(result['joined_at'], game['players'][self.users[1]])
 
         user = self.db.get_item(
             Key=self.make_user_key(self.users[1])
@@ -267,6 +383,284 @@ class TestGamesHandler(BaseTestCase):
         response = handle(event, None)
         self.assertEqual(s.OK, response['statusCode'])
 
-        
+        game = self.db.get_item(
+            Key={'pk': f'GAME#{game_id}', 'sk': 'META'}
+        )['Item']
+
+        self.assertEqual(2, game['players_joined'])
+        self.assertNotIn(self.users[0], game['players'])
+
+        # exiting again is rejected rather than freeing a second seat
+        response = handle(event, None)
+        self.assertEqual(s.CONFLICT, response['statusCode'])
+
+
+    def create_public_game(self, user_id: str, table_size: int = 3) -> str:
+
+        event = self.replace_event_username(
+            self.create_game_authd_event,
+            user_id
+        )
+        event['body'] = json.dumps({'game_type': 'SHD', 'table_size': table_size, 'private': False})
+
+        response = handle(event, None)
+        self.assertEqual(s.CREATED, response['statusCode'])
+
+        return json.loads(response['body'])['id']
+
+
+    def get_open_games(self, user_id: str, **params) -> dict:
+
+        event = self.replace_event_username(
+            self.get_open_games_authd_event,
+            user_id
+        )
+        event['queryStringParameters'] = {'gameType': 'SHD', **params}
+
+        response = handle(event, None)
+        self.assertEqual(s.OK, response['statusCode'])
+
+        return json.loads(response['body'])
+
+
+    def test_open_games_lists_public_games(self):
+
+        game_id = self.create_public_game(self.users[0])
+
+        # private games are never listed
+        event = self.replace_event_username(
+            self.create_game_authd_event,
+            self.users[1]
+        )
+        response = handle(event, None)
+        self.assertEqual(s.CREATED, response['statusCode'])
+
+        result = self.get_open_games(self.users[2])
+
+        self.assertEqual([game_id], [g['id'] for g in result['games']])
+        self.assertEqual(1, result['games'][0]['players_joined'])
+        self.assertIsNone(result['cursor'])
+
+
+    def test_open_games_filter_by_table_size(self):
+
+        small_game = self.create_public_game(self.users[0], table_size=2)
+        large_game = self.create_public_game(self.users[1], table_size=4)
+
+        result = self.get_open_games(self.users[2], tableSize='4')
+        self.assertEqual([large_game], [g['id'] for g in result['games']])
+
+        result = self.get_open_games(self.users[2], tableSize='2')
+        self.assertEqual([small_game], [g['id'] for g in result['games']])
+
+
+    def test_open_games_pagination(self):
+
+        game_ids = {self.create_public_game(user_id) for user_id in self.users[:3]}
+
+        seen = []
+        result = self.get_open_games(self.users[3], limit='2')
+        seen += [g['id'] for g in result['games']]
+
+        while result['cursor']:
+            result = self.get_open_games(self.users[3], limit='2', cursor=result['cursor'])
+            seen += [g['id'] for g in result['games']]
+
+        self.assertEqual(game_ids, set(seen))
+        self.assertEqual(len(game_ids), len(seen))
+
+
+    def test_open_games_invalid_cursor(self):
+
+        event = self.replace_event_username(
+            self.get_open_games_authd_event,
+            self.users[0]
+        )
+        event['queryStringParameters'] = {'cursor': 'not-a-cursor'}
+
+        response = handle(event, None)
+        self.assertEqual(s.BAD_REQUEST, response['statusCode'])
+
+
+    def test_full_game_leaves_and_rejoins_lobby(self):
+
+        game_id = self.create_public_game(self.users[0], table_size=2)
+
+        event = self.replace_event_username(
+            self.join_game_authd_event,
+            self.users[1]
+        )
+        event = self.replace_event_game_id(event, game_id)
+
+        response = handle(event, None)
+        self.assertEqual(s.OK, response['statusCode'])
+
+        self.assertEqual([], self.get_open_games(self.users[2])['games'])
+
+        event = self.replace_event_username(
+            self.exit_game_authd_event,
+            self.users[1]
+        )
+        event = self.replace_event_game_id(event, game_id)
+
+        response = handle(event, None)
+        self.assertEqual(s.OK, response['statusCode'])
+
+        result = self.get_open_games(self.users[2])
+        self.assertEqual([game_id], [g['id'] for g in result['games']])
+
+
+    def test_create_game_with_bots(self):
+
+        event = self.replace_event_username(
+            self.create_game_authd_event,
+            self.users[0]
+        )
+        event['body'] = json.dumps({'game_type': 'SHD', 'table_size': 3, 'bots': True})
+
+        response = handle(event, None)
+        self.assertEqual(s.CREATED, response['statusCode'])
+
+        game = self.db.get_item(
+            Key={'pk': f'GAME#{json.loads(response["body"])["id"]}', 'sk': 'META'}
+        )['Item']
+
+        seats = seat_order(game['players'], game['players_joined'])
+
+        self.assertEqual(3, game['players_joined'])
+        self.assertEqual(3, len(seats))
+        self.assertEqual(self.users[0], seats[0])
+        self.assertTrue(all(p.startswith(BOT_PREFIX) for p in seats[1:]))
+        self.assertNotIn('lobby_pk', game)
+
+
+    def test_add_bots(self):
+
+        game_id = self.create_public_game(self.users[0], table_size=3)
+
+        event = self.replace_event_username(
+            self.join_game_authd_event,
+            self.users[1]
+        )
+        event = self.replace_event_game_id(event, game_id)
+        event['path'] = f'/games/{game_id}/bots'
+
+        # only the creator can fill the table
+        response = handle(event, None)
+        self.assertEqual(s.FORBIDDEN, response['statusCode'])
+
+        event = self.replace_event_username(event, self.users[0])
+
+        response = handle(event, None)
+        self.assertEqual(s.OK, response['statusCode'])
+        self.assertEqual(2, len(json.loads(response['body'])['bots']))
+
+        game = self.db.get_item(
+            Key={'pk': f'GAME#{game_id}', 'sk': 'META'}
+        )['Item']
+
+        self.assertEqual(3, game['players_joined'])
+        self.assertEqual(3, len(seat_order(game['players'], game['players_joined'])))
+        self.assertNotIn('lobby_pk', game)
+
+        response = handle(event, None)
+        self.assertEqual(s.CONFLICT, response['statusCode'])
+
+
+    def put_list_game(self, game_id: str, players: list, table_size: int = 3):
+        '''Stores a public game as it was before players became a map'''
+
+        game = GameMeta(id=game_id, created_by=players[0], table_size=table_size, private=False)
+        item = {**game.to_item(), 'players': players, 'players_joined': len(players)}
+        del item['version']
+
+        self.db.put_item(Item=item)
+
+        for user_id in players:
+            self.db.update_item(
+                Key=self.make_user_key(user_id),
+                UpdateExpression='SET in_game = :t, game_id = :gid',
+                ExpressionAttributeValues={':t': True, ':gid': game_id},
+            )
+
+
+    def test_seats_written_without_reading_game(self):
+
+        game_id = self.create_public_game(self.users[0], table_size=3)
+
+        client = routes.db_client.resolve()
+
+        with patch.object(client, 'transact_write_items', wraps=client.transact_write_items) as transact, \
+                patch.object(routes.db, 'get_item', wraps=routes.db.get_item) as get_item:
+
+            for user_id, writes in [(self.users[1], 1), (self.users[2], 3)]:
+                event = self.replace_event_username(self.join_game_authd_event, user_id)
+                event = self.replace_event_game_id(event, game_id)
+
+                response = handle(event, None)
+                self.assertEqual(s.OK, response['statusCode'])
+
+                # the last seat also delists the game, written once the first write returns it
+                self.assertEqual(writes, transact.call_count)
+
+        game_reads = [c for c in get_item.call_args_list if c[1]['Key'].get('sk', None) == 'META']
+        self.assertEqual([], game_reads)
+
+        game = self.db.get_item(Key={'pk': f'GAME#{game_id}', 'sk': 'META'})['Item']
+
+        self.assertEqual(self.users[:3], seat_order(game['players']))
+        self.assertEqual(3, game['players_joined'])
+        self.assertNotIn('lobby_pk', game)
+
+
+    def test_players_list_converted_on_join_and_exit(self):
+
+        game_id = 'list-game'
+        self.put_list_game(game_id, self.users[:2])
+
+        event = self.replace_event_username(self.join_game_authd_event, self.users[2])
+        event = self.replace_event_game_id(event, game_id)
+
+        response = handle(event, None)
+        self.assertEqual(s.OK, response['statusCode'])
+
+        game = self.db.get_item(Key={'pk': f'GAME#{game_id}', 'sk': 'META'})['Item']
+
+        self.assertEqual(self.users[:3], seat_order(game['players']))
+        self.assertEqual(1, game['version'])
+        self.assertNotIn('lobby_pk', game)
+
+        self.put_list_game(game_id, self.users[:2])
+
+        event = self.replace_event_username(self.exit_game_authd_event, self.users[0])
+        event = self.replace_event_game_id(event, game_id)
+
+        response = handle(event, None)
+        self.assertEqual(s.OK, response['statusCode'])
+
+        game = self.db.get_item(Key={'pk': f'GAME#{game_id}', 'sk': 'META'})['Item']
+
+        self.assertEqual({self.users[1]: 1}, game['players'])
+        self.assertEqual(1, game['players_joined'])
+        self.assertEqual([game_id], [g['id'] for g in self.get_open_games(self.users[3])['games']])
+
+
+    def test_add_bots_to_players_list(self):
+
+        game_id = 'list-game'
+        self.put_list_game(game_id, self.users[:1])
+
+        event = self.replace_event_username(self.join_game_authd_event, self.users[0])
+        event = self.replace_event_game_id(event, game_id)
+        event['path'] = f'/games/{game_id}/bots'
+
+        response = handle(event, None)
+        self.assertEqual(s.OK, response['statusCode'])
 
+        game = self.db.get_item(Key={'pk': f'GAME#{game_id}', 'sk': 'META'})['Item']
+        seats = seat_order(game['players'], game['players_joined'])
 
+        self.assertEqual(3, len(seats))
+        self.assertEqual(3, game['players_joined'])
+        self.assertEqual(self.users[0], seats[0])
+        self.assertTrue(all(p.startswith(BOT_PREFIX) for p in seats[1:]))
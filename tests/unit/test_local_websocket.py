@@ -0,0 +1,74 @@
+import asyncio
+from unittest import TestCase
+
+from tests.local.websocket import (
+    encode_frame,
+    read_message,
+    accept_key,
+    ConnectionClosed,
+    TEXT,
+    CONTINUATION,
+    CLOSE,
+    PING,
+)
+
+
+def reader_for(data: bytes) -> asyncio.StreamReader:
+
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+class Writer(object):
+
+    def __init__(self):
+        self.written = b''
+
+    def write(self, data: bytes):
+        self.written += data
+
+
+class TestLocalWebsocket(TestCase):
+
+    def read(self, data: bytes, writer: Writer = None) -> bytes:
+
+        async def read():
+            return await read_message(reader_for(data), writer or Writer())
+
+        return asyncio.run(read())
+
+
+    def test_accept_key(self):
+
+        # example handshake from RFC 6455 section 1.3
+        self.assertEqual('s3pPLMBiTxaQ9kYGzzhZRbK+xOo=', accept_key('dGhlIHNhbXBsZSBub25jZQ=='))
+
+
+    def test_masked_and_long_frames_round_trip(self):
+
+        for payload in [b'{"type": "PING"}', b'x' * 300, b'y' * 70000]:
+            self.assertEqual(payload, self.read(encode_frame(TEXT, payload, mask=True)))
+            self.assertEqual(payload, self.read(encode_frame(TEXT, payload)))
+
+
+    def test_fragments_joined_and_pings_answered(self):
+
+        first = bytes([TEXT]) + encode_frame(TEXT, b'hello ')[1:]
+        ping = encode_frame(PING, b'p', mask=True)
+        last = encode_frame(CONTINUATION, b'world', mask=True)
+
+        writer = Writer()
+
+        self.assertEqual(b'hello world', self.read(first + ping + last, writer))
+        self.assertEqual(b'\x8a\x01p', writer.written)
+
+
+    def test_close(self):
+
+        with self.assertRaises(ConnectionClosed):
+            self.read(encode_frame(CLOSE, b''))
+
+        with self.assertRaises(ConnectionClosed):
+            self.read(b'\x81')
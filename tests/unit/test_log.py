@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import logging
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'layers' / 'common')
+sys.path.append(test_path)
+
+from cards_common import log as log_module
+from cards_common.log import Fields, summarise, parse_rates, log_event
+
+
+class Unprintable(object):
+    def __str__(self):
+        raise AssertionError('formatted while level disabled')
+
+
+class TestLog(TestCase):
+
+    def setUp(self):
+        self.log = logging.getLogger('test_log')
+        self.log.propagate = False
+        self.log.setLevel(logging.INFO)
+
+
+    def test_fields_only_formatted_when_enabled(self):
+
+        # debug is disabled so the message is never turned into a string
+        self.log.debug(Fields('state', state=Unprintable()))
+
+        with self.assertLogs(self.log, logging.INFO) as logs:
+            self.log.info(Fields('action', type='PLAY'))
+
+        self.assertEqual({'message': 'action', 'type': 'PLAY'}, json.loads(logs.records[0].getMessage()))
+
+
+    def test_summarise(self):
+
+        summary = summarise({'players': [1, 2, 3], 'token': 'x' * 200, 'n': 1})
+
+        self.assertEqual('<list 3 items>', summary['players'])
+        self.assertTrue(summary['token'].endswith('<200 chars>'))
+        self.assertEqual(1, summary['n'])
+
+
+    def test_parse_rates(self):
+
+        self.assertEqual({'GET /games': 0.5, '*': 0.01}, parse_rates('GET /games=0.5, *=0.01'))
+        self.assertEqual({}, parse_rates(''))
+
+
+    def test_event_sampling(self):
+
+        event = {'httpMethod': 'GET', 'resource': '/games', 'path': '/games', 'body': None}
+
+        with patch.object(log_module, 'EVENT_SAMPLE_RATES', {'GET /games': 1}):
+            with self.assertLogs(self.log, logging.INFO) as logs:
+                log_event(self.log, event)
+
+        self.assertEqual(2, len(logs.records))
+        self.assertEqual(event, json.loads(logs.records[1].getMessage())['event'])
+
+        with patch.object(log_module, 'EVENT_SAMPLE_RATES', {}):
+            with self.assertLogs(self.log, logging.INFO) as logs:
+                log_event(self.log, event)
+
+        self.assertEqual(1, len(logs.records))
+        self.assertEqual('GET /games', json.loads(logs.records[0].getMessage())['route'])
@@ -0,0 +1,191 @@
+import os
+import sys
+import uuid
+import json
+from pathlib import Path
+from copy import deepcopy
+from http import HTTPStatus as s
+
+from . import BaseTestCase
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'services' / 'games' / 'meta')
+sys.path.append(test_path)
+
+test_path = str(Path(os.getcwd()) / 'services' / 'users')
+sys.path.append(test_path)
+
+from services.games.meta.meta_service.handler import handle
+from services.games.meta.meta_service import matcher
+from services.games.meta.meta_service.entities import GameMeta, seat_order
+from services.users.user_service.handler import handle as user_handle
+
+
+class TestMatcher(BaseTestCase):
+
+    def setUp(self):
+
+        super().setUp()
+
+        with open('tests/events/create-user-authd.json', 'r') as f:
+            create_user_authd_event = json.load(f)
+
+        self.users = []
+        for _ in range(5):
+
+            guid = str(uuid.uuid4())
+            self.users.append(guid)
+
+            event = self.replace_event_username(
+                create_user_authd_event,
+                guid
+            )
+
+            response = user_handle(event, None)
+            self.assertEqual(s.CREATED, response['statusCode'])
+
+        with open('tests/events/create-game-authd.json') as f:
+            self.create_game_authd_event = json.load(f)
+
+        self.join_queue_event = deepcopy(self.create_game_authd_event)
+        self.join_queue_event['path'] = '/games/queue'
+        self.join_queue_event['resource'] = '/games/queue'
+        self.join_queue_event['body'] = json.dumps({'game_type': 'SHD', 'table_size': 3})
+
+        self.leave_queue_event = deepcopy(self.join_queue_event)
+        self.leave_queue_event['httpMethod'] = 'DELETE'
+        self.leave_queue_event['body'] = None
+
+
+    def join_queue(self, user_id: str) -> dict:
+
+        event = self.replace_event_username(self.join_queue_event, user_id)
+        return handle(event, None)
+
+
+    def get_user(self, user_id: str) -> dict:
+        return self.db.get_item(Key=self.make_user_key(user_id))['Item']
+
+
+    def test_join_queue(self):
+
+        response = self.join_queue(self.users[0])
+        self.assertEqual(s.CREATED, response['statusCode'])
+
+        user = self.get_user(self.users[0])
+        self.assertEqual('QUEUE#SHD#3', user['queue_pk'])
+
+        response = self.join_queue(self.users[0])
+        self.assertEqual(s.CONFLICT, response['statusCode'])
+
+
+    def test_leave_queue(self):
+
+        self.join_queue(self.users[0])
+
+        event = self.replace_event_username(self.leave_queue_event, self.users[0])
+        response = handle(event, None)
+        self.assertEqual(s.OK, response['statusCode'])
+
+        self.assertNotIn('queue_pk', self.get_user(self.users[0]))
+        self.assertEqual([], matcher.waiting_entries('QUEUE#SHD#3'))
+
+
+    def test_match_new_game(self):
+
+        for user_id in self.users[:4]:
+            self.assertEqual(s.CREATED, self.join_queue(user_id)['statusCode'])
+
+        matches = matcher.match_queue('QUEUE#SHD#3')
+
+        self.assertEqual(1, len(matches))
+        game_id, user_ids = matches[0]
+        self.assertEqual(self.users[:3], user_ids)
+
+        game = self.db.get_item(Key={'pk': f'GAME#{game_id}', 'sk': 'META'})['Item']
+        self.assertEqual(3, game['players_joined'])
+        self.assertNotIn('lobby_pk', game)
+
+        for user_id in self.users[:3]:
+            user = self.get_user(user_id)
+            self.assertTrue(user['in_game'])
+            self.assertEqual(game_id, user['game_id'])
+            self.assertNotIn('queue_pk', user)
+
+        # the fourth user keeps waiting for more players
+        entries = matcher.waiting_entries('QUEUE#SHD#3')
+        self.assertEqual([self.users[3]], [e['user_id'] for e in entries])
+
+
+    def test_match_fills_open_game(self):
+
+        event = self.replace_event_username(self.create_game_authd_event, self.users[0])
+        event['body'] = json.dumps({'game_type': 'SHD', 'table_size': 3, 'private': False})
+
+        response = handle(event, None)
+        self.assertEqual(s.CREATED, response['statusCode'])
+        game_id = json.loads(response['body'])['id']
+
+        for user_id in self.users[1:3]:
+            self.join_queue(user_id)
+
+        matches = matcher.match_queue('QUEUE#SHD#3')
+        self.assertEqual([(game_id, self.users[1:3])], matches)
+
+        game = self.db.get_item(Key={'pk': f'GAME#{game_id}', 'sk': 'META'})['Item']
+        self.assertEqual(3, game['players_joined'])
+        self.assertEqual(self.users[:3], seat_order(game['players']))
+        self.assertNotIn('lobby_pk', game)
+
+
+    def test_match_skips_game_with_players_list(self):
+
+        # stored before players became a map, so seats cannot be set by id
+        game = GameMeta(id='list-game', created_by=self.users[0], table_size=3, private=False)
+        game.players_joined = 1
+        game.update_lobby()
+        self.db.put_item(Item={**game.to_item(), 'players': [self.users[0]]})
+
+        for user_id in self.users[1:4]:
+            self.join_queue(user_id)
+
+        matches = matcher.match_queue('QUEUE#SHD#3')
+
+        self.assertEqual(1, len(matches))
+        self.assertNotEqual('list-game', matches[0][0])
+
+        game = self.db.get_item(Key={'pk': 'GAME#list-game', 'sk': 'META'})['Item']
+        self.assertEqual([self.users[0]], game['players'])
+
+
+    def test_match_skips_users_who_left(self):
+
+        for user_id in self.users[:4]:
+            self.join_queue(user_id)
+
+        # leave behind the matcher's back so its read of the queue is stale
+        entries = matcher.waiting_entries('QUEUE#SHD#3')
+        event = self.replace_event_username(self.leave_queue_event, self.users[1])
+        handle(event, None)
+
+        original = matcher.waiting_entries
+        matcher.waiting_entries = lambda queue_pk: entries
+
+        try:
+            matches = matcher.match_queue('QUEUE#SHD#3')
+        finally:
+            matcher.waiting_entries = original
+
+        self.assertEqual(1, len(matches))
+        self.assertEqual([self.users[0], self.users[2], self.users[3]], matches[0][1])
+        self.assertFalse(self.get_user(self.users[1])['in_game'])
+
+
+    def test_queued_user_cannot_create_game(self):
+
+        self.join_queue(self.users[0])
+
+        event = self.replace_event_username(self.create_game_authd_event, self.users[0])
+        response = handle(event, None)
+        self.assertEqual(s.CONFLICT, response['statusCode'])
@@ -0,0 +1,65 @@
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+from . import BaseTestCase
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'layers' / 'common')
+sys.path.append(test_path)
+
+from cards_common import ratelimit
+from cards_common.ratelimit import TokenBucket, RateLimiter
+
+
+class TestRateLimit(BaseTestCase):
+
+    def test_bucket_refills_at_rate(self):
+
+        bucket = TokenBucket(rate=2, burst=3)
+
+        self.assertEqual([True, True, True, False], [bucket.take(100.0) for _ in range(4)])
+
+        # half a second buys one token back
+        self.assertTrue(bucket.take(100.5))
+        self.assertFalse(bucket.take(100.5))
+
+        # never more than the burst
+        self.assertEqual([True, True, True, False], [bucket.take(200.0) for _ in range(4)])
+
+    def test_limits_each_key(self):
+
+        limiter = RateLimiter(rate=1, burst=2)
+
+        with patch.object(ratelimit.time, 'time', return_value=100.0):
+            self.assertEqual([True, True, False], [limiter.allow('a') for _ in range(3)])
+            self.assertTrue(limiter.allow('b'))
+
+        with patch.object(ratelimit.time, 'time', return_value=101.0):
+            self.assertTrue(limiter.allow('a'))
+            self.assertFalse(limiter.allow('a'))
+
+    def test_persisted_limit_is_shared(self):
+
+        containers = [RateLimiter(rate=1, burst=3, table=self.db) for _ in range(2)]
+
+        with patch.object(ratelimit.time, 'time', return_value=100.0):
+            allowed = [containers[i % 2].allow('conn') for i in range(4)]
+
+        self.assertEqual([True, True, True, False], allowed)
+
+        item = self.db.get_item(Key={'pk': 'RATE#conn', 'sk': 'LIMIT'})['Item']
+        self.assertEqual(103, item['full_at'])
+
+        with patch.object(ratelimit.time, 'time', return_value=101.0):
+            self.assertTrue(containers[0].allow('conn'))
+            self.assertFalse(containers[1].allow('conn'))
+
+        # a full bucket starts again from now
+        with patch.object(ratelimit.time, 'time', return_value=200.0):
+            self.assertTrue(containers[1].allow('conn'))
+
+        item = self.db.get_item(Key={'pk': 'RATE#conn', 'sk': 'LIMIT'})['Item']
+        self.assertEqual(201, item['full_at'])
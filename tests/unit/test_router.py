@@ -0,0 +1,62 @@
+import os
+import sys
+from pathlib import Path
+from unittest import TestCase
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'layers' / 'common')
+sys.path.append(test_path)
+
+from cards_common.router import Router, Route
+
+
+def echo(*args):
+    return args
+
+
+class TestRouter(TestCase):
+
+    def setUp(self):
+
+        self.router = Router([
+            Route(method='GET', path='/games', function=echo, args=('user',)),
+            Route(method='GET', path='/games/open', function=echo, args=('params',)),
+            Route(method='POST', path='/games/{game_id}/players', function=echo, args=('user', 'game_id')),
+        ])
+
+
+    def test_static_route(self):
+
+        match = self.router.match('GET', '/games')
+        self.assertEqual(('bob',), match.call(user=lambda: 'bob'))
+
+
+    def test_path_parameters(self):
+
+        match = self.router.match('POST', '/games/abc-123/players')
+
+        self.assertEqual({'game_id': 'abc-123'}, match.params)
+        self.assertEqual(('bob', 'abc-123'), match.call(user=lambda: 'bob'))
+
+
+    def test_gateway_path_parameters_preferred(self):
+
+        match = self.router.match('POST', '/games/abc/players', {'game_id': 'def'})
+        self.assertEqual({'game_id': 'def'}, match.params)
+
+
+    def test_method_and_path_must_match(self):
+
+        self.assertIsNone(self.router.match('DELETE', '/games'))
+        self.assertIsNone(self.router.match('POST', '/games/abc/players/extra'))
+        self.assertIsNone(self.router.match('POST', '/games/a.b/players'))
+
+
+    def test_arguments_are_lazy(self):
+
+        def fail():
+            raise AssertionError('unused argument resolved')
+
+        match = self.router.match('GET', '/games/open')
+        self.assertEqual(({},), match.call(user=fail, params=lambda: {}))
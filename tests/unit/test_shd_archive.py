@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import zlib
+import random
+from unittest.mock import patch
+from pathlib import Path
+
+from boto3.dynamodb.conditions import Key
+
+from . import BaseTestCase
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'services' / 'games' / 'shd')
+sys.path.append(test_path)
+
+from shd_service import archive, recorder
+from shd_service.game import Game
+from shd_service.entities import Status
+from shd_service.actions import apply_action
+
+from tests.unit.test_shd_recorder import next_action
+
+
+class TestShdArchive(BaseTestCase):
+
+    def finished_game(self) -> tuple:
+
+        random.seed(3)
+
+        game = Game.new(n_players=3, game_id='finished')
+        for p in ['a', 'b', 'c']:
+            game.add_player(p)
+
+        record = recorder.start(game)
+
+        while game.state.status != Status.END:
+            player_id, action_type, data = next_action(game)
+            before = game.state
+            apply_action(game, player_id, action_type, data)
+            recorder.append(record, before, player_id, action_type, data)
+
+        return game, record
+
+
+    def store_game(self, game: Game):
+
+        pk = f'GAME#{game.game_id}'
+
+        with self.db.batch_writer() as batch:
+
+            batch.put_item(Item={'pk': pk, 'sk': 'META', 'id': game.game_id})
+            batch.put_item(Item={**game.to_dict(), 'pk': pk, 'sk': 'STATE#SHD'})
+            batch.put_item(Item={**game.sanitised_state(), 'pk': pk, 'sk': 'SANITISED#SHD'})
+
+            for p in game.state.players:
+                batch.put_item(Item={**p.sanitise_for_player(), 'pk': pk, 'sk': f'PLAYER#{p.id}'})
+                batch.put_item(Item={'pk': pk, 'sk': f'CONN#{p.id}', 'connection_id': p.id, 'user_id': p.id})
+
+                # c has already left for another game
+                game_id = 'another' if p.id == 'c' else game.game_id
+                batch.put_item(Item={**self.make_user_key(p.id), 'id': p.id, 'in_game': True, 'game_id': game_id, 'version': 1})
+
+
+    def test_end_game(self):
+
+        game, record = self.finished_game()
+        pk = f'GAME#{game.game_id}'
+
+        self.store_game(game)
+
+        archive.end_game(game, 'SHD', record, connection_ids=['a', 'b', 'c'])
+
+        self.assertEqual([], self.db.query(KeyConditionExpression=Key('pk').eq(pk))['Items'])
+
+        for p in ['a', 'b']:
+            user = self.db.get_item(Key=self.make_user_key(p))['Item']
+            self.assertFalse(user['in_game'])
+            self.assertIsNone(user['game_id'])
+            self.assertEqual(2, user['version'])
+
+        user = self.db.get_item(Key=self.make_user_key('c'))['Item']
+        self.assertEqual('another', user['game_id'])
+        self.assertEqual(1, user['version'])
+
+        item = self.db.get_item(Key=archive.make_key(game.game_id))['Item']
+        results = game.results()
+
+        self.assertEqual(results['result'], item['result'])
+        self.assertEqual(results['loser'], item['loser'])
+        self.assertEqual(results['scores'], {k: int(v) for k, v in item['scores'].items()})
+
+        final = json.loads(zlib.decompress(item['state'].value))
+
+        self.assertEqual(Status.END, final['game']['state']['status'])
+        self.assertEqual(len(record['actions']), len(final['record']['actions']))
+
+
+    def test_end_game_finished_when_clients_unreachable(self):
+
+        game, record = self.finished_game()
+        self.store_game(game)
+
+        with patch.object(archive, 'post_game_end', side_effect=RuntimeError('endpoint down')):
+            archive.end_game(game, 'SHD', record, connection_ids=['a', 'b', 'c'])
+
+        self.assertEqual([], self.db.query(KeyConditionExpression=Key('pk').eq(f'GAME#{game.game_id}'))['Items'])
+        self.assertFalse(self.db.get_item(Key=self.make_user_key('a'))['Item']['in_game'])
+
+
+    def test_end_game_repeated_after_partial_delete(self):
+
+        game, record = self.finished_game()
+        pk = f'GAME#{game.game_id}'
+
+        self.store_game(game)
+
+        with patch.object(archive.db, 'delete_item', side_effect=RuntimeError('timed out')):
+            with self.assertRaises(RuntimeError):
+                archive.end_game(game, 'SHD', record, connection_ids=['a', 'b', 'c'])
+
+        # only the state is left, which is where a retry starts from
+        self.assertEqual(['STATE#SHD'], [i['sk'] for i in self.db.query(KeyConditionExpression=Key('pk').eq(pk))['Items']])
+
+        archive.end_game(game, 'SHD', record, connection_ids=['a', 'b', 'c'])
+
+        self.assertEqual([], self.db.query(KeyConditionExpression=Key('pk').eq(pk))['Items'])
+        self.assertEqual(2, self.db.get_item(Key=self.make_user_key('a'))['Item']['version'])
+        self.assertIn('Item', self.db.get_item(Key=archive.make_key(game.game_id)))
@@ -0,0 +1,224 @@
+import os
+import sys
+import time
+import random
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'services' / 'games' / 'shd')
+sys.path.append(test_path)
+
+from shd_service import bot, recorder
+from shd_service.game import Game
+from shd_service.entities import Status, evolve
+from shd_service.actions import Actions, apply_action
+
+
+def new_game(player_ids: list) -> Game:
+
+    game = Game.new(n_players=len(player_ids), game_id='bots')
+    for p in player_ids:
+        game.add_player(p)
+
+    apply_action(game, player_ids[0], Actions.DEAL)
+    return game
+
+
+class FakeClock(object):
+    '''Advances a fixed step each time it is read, so searches run the same on any machine'''
+
+    def __init__(self, step: float = 0.001):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self) -> float:
+        self.now += self.step
+        return self.now
+
+
+class TestShdBot(TestCase):
+
+    def test_copy_shares_state_until_a_move(self):
+
+        game = new_game(['a', 'b', 'c'])
+        copy = game.copy()
+
+        self.assertIs(game.state, copy.state)
+
+        apply_action(copy, 'a', Actions.READY)
+
+        self.assertFalse(game.state.players[0].is_ready)
+        self.assertTrue(copy.state.players[0].is_ready)
+
+        # only the changed player is new, every pile is shared
+        self.assertIs(game.state.stack, copy.state.stack)
+        self.assertIs(game.state.players[1], copy.state.players[1])
+        self.assertIs(game.state.players[0].hand, copy.state.players[0].hand)
+
+    def test_determinise_keeps_known_cards(self):
+
+        game = new_game(['bot-a', 'b', 'c'])
+        world = bot.determinise(game, 'bot-a', random.Random(1))
+
+        for original, dealt in zip(game.state.players, world.state.players):
+
+            self.assertEqual([c.id for c in original.hidden], [c.id for c in dealt.hidden])
+            self.assertEqual([c.__dict__ for c in original.table], [c.__dict__ for c in dealt.table])
+
+            if original.id == 'bot-a':
+                self.assertEqual([c.__dict__ for c in original.hand], [c.__dict__ for c in dealt.hand])
+
+        faces = lambda g: sorted(
+            (c.rank, c.suit)
+            for p in g.state.players for c in p.hand + p.table + p.hidden
+        ) + sorted((c.rank, c.suit) for c in g.state.stack)
+
+        self.assertEqual(52, len(set(faces(world))))
+
+    def test_choose_move_is_legal_and_within_budget(self):
+
+        game = new_game(['a', 'bot-b', 'c'])
+        for p in game.state.players:
+            apply_action(game, p.id, Actions.READY)
+
+        start = time.perf_counter()
+        move = bot.choose_move(game, 'bot-b', budget_ms=30, rng=random.Random(2))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        self.assertIn(move, bot.candidate_moves(game, game.state.get_player('bot-b')))
+        self.assertLess(elapsed_ms, 100)
+
+        apply_action(game, 'bot-b', *move)
+
+    def test_search_stops_at_deadline(self):
+
+        game = new_game(['a', 'bot-b', 'c'])
+        for p in game.state.players:
+            apply_action(game, p.id, Actions.READY)
+
+        clock = FakeClock()
+
+        with patch.object(bot, 'clock', clock):
+            move = bot.choose_move(game, 'bot-b', budget_ms=200, rng=random.Random(3))
+
+        # started at the first read, and stopped at the first read past the deadline
+        self.assertLessEqual(round(clock.now, 9), round(clock.step + 0.2 + clock.step, 9))
+        self.assertIn(move, bot.candidate_moves(game, game.state.get_player('bot-b')))
+
+    def test_bots_play_to_the_end(self):
+
+        random.seed(5)
+
+        game = new_game(['bot-a', 'bot-b', 'bot-c'])
+
+        with patch.object(bot, 'clock', FakeClock()):
+            played = list(bot.play_bots(game, budget_ms=2, rng=random.Random(5)))
+
+        # nobody would send another message, so one invocation finishes it
+        self.assertTrue(played)
+        self.assertEqual(Status.END, game.state.status)
+        self.assertEqual(3, len(game.state.finished))
+
+    def test_bots_finish_once_humans_are_out(self):
+
+        random.seed(6)
+
+        game = new_game(['a', 'bot-b', 'bot-c'])
+        rng = random.Random(6)
+
+        with patch.object(bot, 'clock', FakeClock()):
+
+            apply_action(game, 'a', Actions.READY)
+            list(bot.play_bots(game, budget_ms=5, rng=rng))
+
+            # each human move is a message, followed by the bots' turns
+            for _ in range(500):
+
+                player = game.state.get_player('a')
+
+                if game.state.status == Status.END or player.is_out:
+                    break
+
+                self.assertTrue(player.is_active)
+
+                bot.perform(game, player, bot.default_move(game, player))
+                list(bot.play_bots(game, budget_ms=5, rng=rng))
+
+        self.assertEqual(Status.END, game.state.status)
+        self.assertEqual(3, len(game.state.finished))
+
+    def test_long_endgame_resolved(self):
+
+        game = Game.new(n_players=3, game_id='bots')
+        for p in ['bot-a', 'bot-b', 'bot-c']:
+            game.add_player(p)
+
+        record = recorder.start(game)
+
+        before = game.state
+        apply_action(game, 'bot-a', Actions.DEAL)
+        recorder.append(record, before, 'bot-a', Actions.DEAL)
+
+        before = game.state
+        with patch.object(bot, 'MAX_ENDGAME_MOVES', 10):
+            for bot_id, action_type, data in bot.play_bots(game, budget_ms=1):
+                recorder.append(record, before, bot_id, action_type, data)
+                before = game.state
+
+        self.assertEqual(Actions.RESOLVE, record['actions'][-1][1])
+        self.assertEqual(Status.END, game.state.status)
+        self.assertEqual(3, len(game.state.finished))
+
+        held = {p.id: len(p.hand) + len(p.table) + len(p.hidden) for p in game.state.players}
+        self.assertEqual(sorted(held.values()), [held[p] for p in game.state.finished])
+
+        # replays end the same way
+        self.assertEqual(game.state.finished, recorder.replay(record).state.finished)
+
+    def test_bots_wait_for_humans(self):
+
+        game = new_game(['a', 'bot-b', 'c'])
+
+        played = list(bot.play_bots(game, budget_ms=1))
+
+        self.assertEqual([('bot-b', Actions.READY, None)], played)
+        self.assertEqual(Status.PREP, game.state.status)
+        self.assertFalse(list(bot.play_bots(game, budget_ms=1)))
+
+    def bot_to_play(self) -> Game:
+
+        game = new_game(['a', 'bot-b', 'c'])
+
+        for p in ['a', 'bot-b', 'c']:
+            apply_action(game, p, Actions.READY)
+
+        # whoever the deal started with, the bot is up
+        state = game.state.with_player(evolve(game.state.active_player, is_active=False))
+        game.state = state.with_player(evolve(state.get_player('bot-b'), is_active=True))
+
+        return game
+
+    def test_rejected_move_falls_back(self):
+
+        game = self.bot_to_play()
+        expected = bot.default_move(game, game.state.get_player('bot-b'))
+
+        with patch.object(bot, 'choose_move', return_value=(Actions.PLAY, {'cardIds': ['not-a-card']})):
+            played = list(bot.play_bots(game, budget_ms=1))
+
+        # the engine rejected the chosen play, so the default was made instead
+        self.assertEqual(('bot-b', *expected), played[0])
+        self.assertNotEqual('bot-b', game.state.active_player.id)
+
+    def test_stuck_bot_resolves_game(self):
+
+        game = self.bot_to_play()
+
+        with patch.object(bot, 'candidate_moves', return_value=[]):
+            played = list(bot.play_bots(game, budget_ms=1))
+
+        self.assertEqual([('bot-b', Actions.RESOLVE, None)], played)
+        self.assertEqual(Status.END, game.state.status)
@@ -0,0 +1,142 @@
+import os
+import sys
+import logging
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'services' / 'games' / 'shd')
+sys.path.append(test_path)
+
+from cards_common.log import Fields
+
+from shd_service.game import Game
+from shd_service.actions import Actions, apply_action
+from shd_service.entities import Card, Status, card_jitter, evolve, plain
+from shd_service.exceptions import InvalidAction, InvalidState
+
+
+def playing_game() -> Game:
+
+    game = Game.new(n_players=3, game_id='engine')
+    for p in ['a', 'b', 'c']:
+        game.add_player(p)
+
+    game.deal('a')
+    for p in ['a', 'b', 'c']:
+        game.player_ready(p)
+
+    return game
+
+
+def with_cards(game: Game, player_id: str, **piles) -> Game:
+
+    player = game.state.get_player(player_id)
+    piles = {k: tuple(Card(rank=r, suit='S') for r in ranks) for k, ranks in piles.items()}
+    game.state = game.state.with_player(evolve(player, **piles))
+    return game
+
+
+class TestShdGame(TestCase):
+
+    def test_invalid_action_leaves_state_unchanged(self):
+
+        game = with_cards(playing_game(), 'b', hand=['4', '5', '9'])
+        game.state = evolve(game.state, current_value=8)
+        before = game.state
+
+        low = game.state.get_player('b').hand[0]
+
+        with self.assertRaises(InvalidAction):
+            game.play_cards('b', [low.id])
+
+        self.assertIs(before, game.state)
+        self.assertEqual(3, len(game.state.get_player('b').hand))
+
+        with self.assertRaises(InvalidState):
+            game.play_cards('a', [game.state.get_player('a').hand[0].id])
+
+        self.assertIs(before, game.state)
+
+    def test_snapshot_restores_game(self):
+
+        game = with_cards(playing_game(), 'b', hand=['9', 'K', 'A'])
+        snapshot = game.state
+        stored = game.to_dict()
+
+        game.play_cards('b', [game.state.get_player('b').hand[0].id])
+
+        self.assertEqual(1, len(game.state.table))
+        self.assertTrue(game.state.get_player('c').is_active)
+
+        game.state = snapshot
+
+        self.assertEqual(0, len(game.state.table))
+        self.assertTrue(game.state.get_player('b').is_active)
+        self.assertEqual(stored, game.to_dict())
+        self.assertEqual(stored, Game(stored).to_dict())
+
+    def test_unplayable_hidden_card_goes_to_table(self):
+
+        game = with_cards(playing_game(), 'b', hand=[], table=[], hidden=['K', '4'])
+        game.state = evolve(game.state, current_value=7)
+
+        hidden = game.state.get_player('b').hidden[0]
+        game.play_hidden('b', hidden.id)
+
+        player = game.state.get_player('b')
+
+        self.assertEqual([hidden.id], [c.id for c in game.state.table])
+        self.assertEqual(1, len(player.hidden))
+        self.assertFalse(player.can_play)
+
+        game.pickup_table('b')
+
+        self.assertIn(hidden.id, [c.id for c in game.state.get_player('b').hand])
+        self.assertTrue(game.state.get_player('c').is_active)
+        self.assertEqual(Status.PLAYING, game.state.status)
+
+    def test_card_jitter_derived_from_id(self):
+
+        # clients reproduce these, so they must never change
+        self.assertEqual((61, 2, 2), card_jitter(''))
+        self.assertEqual((340, 2, 0), card_jitter('a'))
+        self.assertEqual((353, 5, 2), card_jitter('6f1c2d0e-1b6a-4c1e-9a55-3f2b8e7d9c10'))
+
+        card = plain(Card(rank='9', suit='S'))
+        self.assertFalse({'rotation', 'x_offset', 'y_offset'} & set(card))
+
+    def test_stored_jitter_is_dropped(self):
+
+        stored = playing_game().to_dict()
+        for card in stored['state']['stack']:
+            card.update(rotation=10, x_offset=1, y_offset=2)
+
+        game = Game(stored)
+
+        self.assertNotIn('rotation', game.to_dict()['state']['stack'][0])
+
+    def test_actions_not_formatted_when_info_disabled(self):
+
+        game = playing_game()
+        player = game.state.active_player
+        card = player.hand[0]
+
+        def unprintable(fields):
+            raise AssertionError('formatted while level disabled')
+
+        root = logging.getLogger()
+        level = root.level
+        root.setLevel(logging.WARNING)
+
+        try:
+            with patch.object(Fields, '__str__', unprintable):
+                try:
+                    apply_action(game, player.id, Actions.PLAY, {'cardIds': [card.id]})
+                except InvalidAction:
+                    # whether the card can be played does not matter here
+                    pass
+        finally:
+            root.setLevel(level)
@@ -28,7 +28,10 @@ from services.games.meta.meta_service.handler import handle as meta_handle
 from services.users.user_service.handler import handle as user_handle
 from services.connections.connection_service import handler as conn_handler
 
+from services.games.shd.shd_service import handler as shd_handler
 from services.games.shd.shd_service.handler import handle
+from services.games.shd.shd_service.entities import Status, evolve
+from cards_common.ratelimit import RateLimiter
 
 class TestShdGameHandler(BaseTestCase):
 
@@ -181,3 +184,372 @@ class TestShdGameHandler(BaseTestCase):
         print(response)
 
 
+    def send_action(self, user_id: str, body: dict) -> dict:
+
+        event = self.replace_wbs_event_context(
+            self.websocket_message_event,
+            'connectionId',
+            user_id
+        )
+        event = self.replace_wbs_event_body(event, {'gameId': self.game_id, **body})
+        return handle(event, None)
+
+
+    def card_code(self, card: dict) -> str:
+        return f"{card['rank']}{card['suit']}"
+
+
+    def get_record(self) -> dict:
+        return self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': 'STATE#SHD'})['Item']['record']
+
+
+    def test_actions_recorded(self):
+
+        self.assertEqual(s.OK, self.send_action(self.users[0], {'type': 'DEAL'})['statusCode'])
+
+        event = self.replace_event_username(self.get_game_authd_event, self.users[0])
+        player = json.loads(meta_handle(event, None)['body'])['player']
+        hand, table = player['hand'][0], player['table'][0]
+
+        response = self.send_action(self.users[0], {'type': 'SWAP', 'data': {'hand': hand['id'], 'table': table['id']}})
+        self.assertEqual(s.OK, response['statusCode'])
+
+        record = self.get_record()
+
+        self.assertEqual(self.users, record['players'])
+        self.assertEqual([0, 'DEAL'], record['actions'][0])
+        self.assertEqual([0, 'SWAP'], record['actions'][1][:2])
+        self.assertEqual([self.card_code(hand), self.card_code(table)], [record['deck'][int(i)] for i in record['actions'][1][2]])
+        self.assertNotIn('ids', record)
+
+
+    def test_play_with_unknown_card_recorded(self):
+
+        self.send_action(self.users[0], {'type': 'DEAL'})
+        for user_id in self.users:
+            self.assertEqual(s.OK, self.send_action(user_id, {'type': 'READY'})['statusCode'])
+
+        state = self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': 'STATE#SHD'})['Item']['state']
+        player = next(p for p in state['players'] if p['is_active'])
+        card = player['hand'][0]
+
+        # the engine plays the card it knows and ignores the other
+        response = self.send_action(player['id'], {'type': 'PLAY', 'data': {'cardIds': [card['id'], 'not-a-card']}})
+        self.assertEqual(s.OK, response['statusCode'])
+
+        record = self.get_record()
+
+        self.assertEqual([self.users.index(player['id']), 'PLAY'], record['actions'][-1][:2])
+        self.assertEqual([self.card_code(card)], [record['deck'][int(i)] for i in record['actions'][-1][2]])
+
+
+    def test_bots_play_after_human(self):
+
+        with open('tests/events/create-user-authd.json', 'r') as f:
+            user_id = str(uuid.uuid4())
+            response = user_handle(self.replace_event_username(json.load(f), user_id), None)
+            self.assertEqual(s.CREATED, response['statusCode'])
+
+        event = self.replace_event_username(
+            self.create_game_authd_event,
+            user_id
+        )
+        event['body'] = json.dumps({'game_type': 'SHD', 'table_size': 3, 'bots': True})
+
+        response = meta_handle(event, None)
+        self.assertEqual(s.CREATED, response['statusCode'])
+        game_id = json.loads(response['body'])['id']
+
+        with patch.object(conn_handler, 'validate_and_decode', return_value={'sub': user_id}):
+            event = self.replace_request_context_param(
+                self.websocket_connect_event,
+                'connectionId',
+                user_id
+            )
+            conn_handler.handle(event, None)
+
+        for action_type in ['DEAL', 'READY']:
+
+            event = self.replace_wbs_event_context(
+                self.websocket_message_event,
+                'connectionId',
+                user_id
+            )
+            event = self.replace_wbs_event_body(event, {'gameId': game_id, 'type': action_type})
+
+            response = handle(event, None)
+            self.assertEqual(s.OK, response['statusCode'])
+
+        state = self.db.get_item(Key={'pk': f'GAME#{game_id}', 'sk': 'STATE#SHD'})['Item']
+        players = state['state']['players']
+
+        # the bots readied up then took their turns, leaving the human to play
+        self.assertEqual('PLAYING', state['state']['status'])
+        self.assertTrue(all(p['is_ready'] for p in players))
+        self.assertEqual(user_id, next(p['id'] for p in players if p['is_active']))
+        self.assertGreater(len(state['record']['actions']), 4)
+
+        views = self.db.query(
+            KeyConditionExpression='pk = :pk AND begins_with(sk, :sk)',
+            ExpressionAttributeValues={':pk': f'GAME#{game_id}', ':sk': 'PLAYER#'},
+        )['Items']
+        self.assertEqual([f'PLAYER#{user_id}'], [v['sk'] for v in views])
+
+
+    def test_malformed_messages_rejected_before_reading(self):
+
+        messages = [
+            {'gameId': self.game_id, 'type': 'SHUFFLE'},
+            {'gameId': self.game_id, 'type': 'PLAY'},
+            {'gameId': self.game_id, 'type': 'PLAY', 'data': {'cardIds': []}},
+            {'gameId': self.game_id, 'type': 'PLAY', 'data': {'cardIds': ['x' * 100]}},
+            {'gameId': self.game_id, 'type': 'SWAP', 'data': {'hand': 'a'}},
+            {'gameId': ['not', 'an', 'id'], 'type': 'DEAL'},
+        ]
+
+        with patch.object(shd_handler, 'query_items') as query:
+
+            for message in messages:
+
+                event = self.replace_wbs_event_context(
+                    self.websocket_message_event,
+                    'connectionId',
+                    self.users[0]
+                )
+                event = self.replace_wbs_event_body(event, message)
+
+                response = handle(event, None)
+                self.assertEqual(s.BAD_REQUEST, response['statusCode'], message)
+
+            event['body'] = '{"gameId": '
+            self.assertEqual(s.BAD_REQUEST, handle(event, None)['statusCode'])
+
+            query.assert_not_called()
+
+
+    def test_connection_rate_limited(self):
+
+        event = self.replace_wbs_event_context(
+            self.websocket_message_event,
+            'connectionId',
+            self.users[1]
+        )
+        event = self.replace_wbs_event_body(event, {'gameId': self.game_id, 'type': 'READY'})
+
+        with patch.object(shd_handler, 'limiter', RateLimiter(rate=0.001, burst=2)):
+
+            # not yet dealt, so the first two are refused by the game instead
+            statuses = [handle(event, None)['statusCode'] for _ in range(3)]
+
+        self.assertNotEqual(s.TOO_MANY_REQUESTS, statuses[0])
+        self.assertNotEqual(s.TOO_MANY_REQUESTS, statuses[1])
+        self.assertEqual(s.TOO_MANY_REQUESTS, statuses[2])
+
+
+    def test_retried_action_applied_once(self):
+
+        def state_item() -> dict:
+            return self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': 'STATE#SHD'})['Item']
+
+        self.assertEqual(s.OK, self.send_action(self.users[0], {'type': 'DEAL', 'actionId': 'a-1'})['statusCode'])
+
+        state = state_item()
+        self.assertEqual([f'{self.users[0]}:a-1'], state['applied'])
+
+        # a cold container answers from the window on the state, without applying it again
+        shd_handler.applied_actions.clear()
+
+        response = self.send_action(self.users[0], {'type': 'DEAL', 'actionId': 'a-1'})
+        self.assertEqual(s.OK, response['statusCode'])
+        self.assertTrue(json.loads(response['body'])['duplicate'])
+        self.assertEqual(state['version'], state_item()['version'])
+
+        # ids are per client, so another player's action with the same id is applied
+        response = self.send_action(self.users[1], {'type': 'READY', 'actionId': 'a-1'})
+        self.assertEqual(s.OK, response['statusCode'])
+        self.assertNotIn('duplicate', json.loads(response['body']))
+
+        state = state_item()
+        self.assertEqual([f'{self.users[0]}:a-1', f'{self.users[1]}:a-1'], state['applied'])
+
+        # a warm one still knows actions that have left the window
+        self.db.update_item(
+            Key={'pk': f'GAME#{self.game_id}', 'sk': 'STATE#SHD'},
+            UpdateExpression='REMOVE applied',
+        )
+
+        response = self.send_action(self.users[1], {'type': 'READY', 'actionId': 'a-1'})
+        self.assertEqual(s.OK, response['statusCode'])
+        self.assertTrue(json.loads(response['body'])['duplicate'])
+        self.assertEqual(state['version'], state_item()['version'])
+
+
+    def test_duplicate_from_another_connection_rejected(self):
+
+        self.assertEqual(s.OK, self.send_action(self.users[0], {'type': 'DEAL', 'actionId': 'a-1'})['statusCode'])
+
+        event = self.replace_wbs_event_context(self.websocket_message_event, 'connectionId', 'stranger')
+        event = self.replace_wbs_event_body(event, {'gameId': self.game_id, 'type': 'DEAL', 'actionId': 'a-1'})
+
+        self.assertEqual(s.FORBIDDEN, handle(event, None)['statusCode'])
+
+
+    def test_newer_views_kept(self):
+
+        self.assertEqual(s.OK, self.send_action(self.users[0], {'type': 'DEAL'})['statusCode'])
+
+        key = {'pk': f'GAME#{self.game_id}', 'sk': 'SANITISED#SHD'}
+
+        real_put = shd_handler.db.put_item
+
+        def put(**kwargs):
+            result = real_put(**kwargs)
+            if kwargs['Item']['sk'] == 'STATE#SHD':
+                # a later delivery's view lands between this one's state and its views
+                self.db.update_item(Key=key, UpdateExpression='SET version = :v', ExpressionAttributeValues={':v': 10})
+            return result
+
+        with patch.object(shd_handler.db, 'put_item', side_effect=put):
+            self.assertEqual(s.OK, self.send_action(self.users[1], {'type': 'READY'})['statusCode'])
+
+        self.assertEqual(10, self.db.get_item(Key=key)['Item']['version'])
+        self.assertEqual(2, self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': f'PLAYER#{self.users[1]}'})['Item']['version'])
+
+
+    def test_concurrent_write_conflicts(self):
+
+        event = self.replace_wbs_event_context(
+            self.websocket_message_event,
+            'connectionId',
+            self.users[0]
+        )
+        event = self.replace_wbs_event_body(event, {'gameId': self.game_id, 'type': 'DEAL'})
+
+        # another delivery wrote the state between this one's read and write
+        self.db.put_item(Item={'pk': f'GAME#{self.game_id}', 'sk': 'STATE#SHD', 'version': 5})
+
+        with patch.object(shd_handler, 'query_items', return_value=[
+            i for i in self.db.query(
+                KeyConditionExpression='pk = :pk',
+                ExpressionAttributeValues={':pk': f'GAME#{self.game_id}'},
+            )['Items'] if i['sk'] != 'STATE#SHD'
+        ]):
+            response = handle(event, None)
+
+        self.assertEqual(s.CONFLICT, response['statusCode'])
+        self.assertEqual(
+            5,
+            self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': 'STATE#SHD'})['Item']['version']
+        )
+
+
+    def test_derived_views_write_only_the_state(self):
+
+        event = self.replace_wbs_event_context(
+            self.websocket_message_event,
+            'connectionId',
+            self.users[0]
+        )
+        event = self.replace_wbs_event_body(event, {'gameId': self.game_id, 'type': 'DEAL'})
+
+        with patch.object(shd_handler, 'DERIVED_VIEWS', True):
+            self.assertEqual(s.OK, handle(event, None)['statusCode'])
+
+        items = self.db.query(
+            KeyConditionExpression='pk = :pk',
+            ExpressionAttributeValues={':pk': f'GAME#{self.game_id}'},
+        )['Items']
+
+        self.assertEqual([], [i['sk'] for i in items if i['sk'].startswith(('SANITISED#', 'PLAYER#'))])
+
+        # the game route builds the views from the state instead
+        event = self.replace_event_username(self.get_game_authd_event, self.users[1])
+        game = json.loads(meta_handle(event, None)['body'])
+
+        self.assertEqual(self.users[1], game['player']['id'])
+        self.assertEqual(3, len(game['player']['hand']))
+        self.assertEqual([3, 3, 3], [p['hand'] for p in game['state']['players']])
+        self.assertEqual(f'PLAYER#{self.users[1]}', game['player']['sk'])
+
+
+    def test_derived_views_replace_stored_views(self):
+
+        # dealt before the switch, so the views were stored
+        self.assertEqual(s.OK, self.send_action(self.users[0], {'type': 'DEAL'})['statusCode'])
+
+        stored = self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': 'SANITISED#SHD'})['Item']
+
+        with patch.object(shd_handler, 'DERIVED_VIEWS', True):
+            self.assertEqual(s.OK, self.send_action(self.users[1], {'type': 'READY'})['statusCode'])
+
+        items = self.db.query(
+            KeyConditionExpression='pk = :pk',
+            ExpressionAttributeValues={':pk': f'GAME#{self.game_id}'},
+        )['Items']
+
+        self.assertEqual([], [i['sk'] for i in items if i['sk'].startswith(('SANITISED#', 'PLAYER#'))])
+
+        # polls are told to build the views from the state
+        version = next(i for i in items if i['sk'] == 'VERSION')
+        self.assertTrue(version['derived_views'])
+
+        # a stale view left behind is ignored in favour of the state
+        self.db.put_item(Item=stored)
+
+        event = self.replace_event_username(self.get_game_authd_event, self.users[1])
+        game = json.loads(meta_handle(event, None)['body'])
+
+        self.assertTrue(game['player']['is_ready'])
+        self.assertEqual(2, game['state']['version'])
+        self.assertTrue(next(p for p in game['state']['players'] if p['id'] == self.users[1])['is_ready'])
+
+
+    def end_on_next_action(self, game, player_id, action_type, data):
+        game.state = evolve(game.state, status=Status.END)
+
+
+    def test_end_written_only_over_read_version(self):
+
+        self.assertEqual(s.OK, self.send_action(self.users[0], {'type': 'DEAL'})['statusCode'])
+
+        def end_after_another_write(game, player_id, action_type, data):
+            self.end_on_next_action(game, player_id, action_type, data)
+            self.db.update_item(
+                Key={'pk': f'GAME#{self.game_id}', 'sk': 'STATE#SHD'},
+                UpdateExpression='ADD version :one',
+                ExpressionAttributeValues={':one': 1},
+            )
+
+        with patch.object(shd_handler, 'apply_action', side_effect=end_after_another_write):
+            response = self.send_action(self.users[1], {'type': 'READY'})
+
+        self.assertEqual(s.CONFLICT, response['statusCode'])
+
+        # the game the other write left is still live
+        self.assertIn('Item', self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': 'META'}))
+        self.assertTrue(self.db.get_item(Key=self.make_user_key(self.users[1]))['Item']['in_game'])
+
+
+    def test_ended_game_finished_by_next_message(self):
+
+        self.assertEqual(s.OK, self.send_action(self.users[0], {'type': 'DEAL'})['statusCode'])
+
+        # the end is stored but the teardown after it fails
+        with patch.object(shd_handler, 'apply_action', side_effect=self.end_on_next_action), \
+                patch.object(shd_handler, 'end_game', side_effect=RuntimeError('timed out')):
+            with self.assertRaises(RuntimeError):
+                self.send_action(self.users[1], {'type': 'READY'})
+
+        state = self.db.get_item(Key={'pk': f'GAME#{self.game_id}', 'sk': 'STATE#SHD'})['Item']
+        self.assertEqual('END', state['state']['status'])
+
+        response = self.send_action(self.users[2], {'type': 'READY'})
+        self.assertEqual(s.CONFLICT, response['statusCode'])
+
+        self.assertEqual([], self.db.query(
+            KeyConditionExpression='pk = :pk',
+            ExpressionAttributeValues={':pk': f'GAME#{self.game_id}'},
+        )['Items'])
+
+        for user_id in self.users:
+            self.assertFalse(self.db.get_item(Key=self.make_user_key(user_id))['Item']['in_game'])
@@ -0,0 +1,139 @@
+import os
+import sys
+import random
+from pathlib import Path
+from unittest import TestCase
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'services' / 'games' / 'shd')
+sys.path.append(test_path)
+
+from shd_service import recorder
+from shd_service.game import Game
+from shd_service.entities import Status
+from shd_service.actions import Actions, apply_action
+
+
+def next_action(game: Game) -> tuple:
+    '''(player id, action type, data) of a simple legal move, None when there is none'''
+
+    state = game.state
+
+    if state.status == Status.DEAL:
+        return state.players[0].id, Actions.DEAL, None
+
+    if state.status == Status.PREP:
+        player = next(p for p in state.players if not p.is_ready)
+        return player.id, Actions.READY, None
+
+    player = state.active_player
+
+    if player.can_burn:
+        return player.id, Actions.BURN, None
+
+    cards = player.hand if player.has_hand else player.table
+
+    if not cards and not player.has_hidden:
+        # a hidden card that could not be played is on the table
+        return (player.id, Actions.PICKUP, None) if state.table else None
+
+    if not cards:
+        return player.id, Actions.PLAY, {'cardIds': [player.hidden[0].id]}
+
+    current = state.current_value
+    playable = [
+        c for c in cards
+        if c.is_special or (c.value <= 7 if current == 7 else c.value >= current)
+    ]
+
+    if not playable:
+        return player.id, Actions.PICKUP, None
+
+    lowest = min(playable, key=lambda c: c.value)
+    return player.id, Actions.PLAY, {'cardIds': [c.id for c in cards if c.value == lowest.value]}
+
+
+def card_codes(game: Game) -> list:
+
+    state = game.state
+
+    return [
+        [[recorder.card_code(c) for c in getattr(p, pile)] for pile in ['hand', 'table', 'hidden'] for p in state.players],
+        [recorder.card_code(c) for c in state.table],
+        [recorder.card_code(c) for c in state.stack],
+        [recorder.card_code(c) for c in state.dead],
+        state.current_value,
+    ]
+
+
+class TestShdRecorder(TestCase):
+
+    def record_game(self, n_actions: int) -> tuple:
+
+        game = Game.new(n_players=3, game_id='recorded')
+        for p in ['a', 'b', 'c']:
+            game.add_player(p)
+
+        record = recorder.start(game)
+
+        for _ in range(n_actions):
+            move = next_action(game)
+            if not move:
+                break
+            player_id, action_type, data = move
+            before = game.state
+            apply_action(game, player_id, action_type, data)
+            recorder.append(record, before, player_id, action_type, data)
+            if game.state.status == Status.END:
+                break
+
+        return game, record
+
+
+    def test_record_is_compact(self):
+
+        game, record = self.record_game(n_actions=10)
+        line = recorder.to_line(record)
+
+        self.assertNotIn('\n', line)
+        self.assertNotIn(game.state.players[0].hand[0].id, line)
+        self.assertEqual([0, 'DEAL'], recorder.from_line(line)['actions'][0])
+
+
+    def test_replay_reaches_recorded_state(self):
+
+        game, record = self.record_game(n_actions=500)
+
+        replayed = recorder.replay(recorder.from_line(recorder.to_line(record)))
+
+        self.assertEqual(card_codes(game), card_codes(replayed))
+        self.assertEqual(
+            [p.is_active for p in game.state.players],
+            [p.is_active for p in replayed.state.players]
+        )
+
+
+    def test_game_played_to_the_end(self):
+
+        # a deal the simple strategy plays to the end
+        random.seed(3)
+
+        game, record = self.record_game(n_actions=2000)
+
+        self.assertEqual(Status.END, game.state.status)
+
+        results = game.results()
+        loser = game.state.get_player(results['loser'])
+
+        self.assertEqual(['a', 'b', 'c'], sorted(results['result']))
+        self.assertTrue(loser.is_sh)
+        self.assertEqual(1, loser.sh_count)
+        self.assertEqual(0, results['scores'][loser.id])
+        self.assertEqual(2, results['scores'][results['result'][0]])
+
+
+    def test_unknown_version_rejected(self):
+
+        with self.assertRaises(ValueError):
+            recorder.from_line('{"v": 0}')
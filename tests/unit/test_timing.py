@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import logging
+from pathlib import Path
+from unittest import TestCase
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'layers' / 'common')
+sys.path.append(test_path)
+
+from cards_common import timing
+from cards_common.encoding import make_response
+from cards_common.timing import timed, span, tag
+
+
+@timed('test')
+def handle(event, context):
+
+    tag(action=event['type'], players=4)
+
+    with span('load'):
+        pass
+
+    with span('apply'):
+        with span('load'):
+            pass
+
+    return make_response(200, {'ok': True})
+
+
+class TestTiming(TestCase):
+
+    def test_one_record_per_invocation(self):
+
+        with self.assertLogs(timing.log, logging.INFO) as logs:
+            response = handle({'type': 'PLAY'}, None)
+
+        self.assertEqual(200, response['statusCode'])
+
+        records = [json.loads(r.getMessage()) for r in logs.records]
+        self.assertEqual(1, len(records))
+
+        record = records[0]
+        self.assertEqual('timing', record['message'])
+        self.assertEqual('test', record['handler'])
+        self.assertEqual('PLAY', record['action'])
+        self.assertEqual(4, record['players'])
+        self.assertEqual(200, record['status'])
+        self.assertEqual({'load', 'apply', 'serialise'}, set(record['spans']))
+        self.assertGreaterEqual(record['total_ms'], record['spans']['apply'])
+
+
+    def test_record_emitted_when_handler_raises(self):
+
+        @timed('failing')
+        def failing(event, context):
+            with span('parse'):
+                raise ValueError('bad body')
+
+        with self.assertLogs(timing.log, logging.INFO) as logs:
+            with self.assertRaises(ValueError):
+                failing({}, None)
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertIn('parse', record['spans'])
+        self.assertNotIn('status', record)
+
+
+    def test_spans_outside_invocation_do_nothing(self):
+
+        with span('load'):
+            tag(action='PLAY')
+
+        self.assertIsNone(timing._current.get())
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+import rsa
+from jose import jwk, jwt
+
+sys.dont_write_bytecode = True
+
+test_path = str(Path(os.getcwd()) / 'services' / 'connections')
+sys.path.append(test_path)
+
+from cards_common.cache import TTLCache
+from services.connections.connection_service import token
+
+
+def make_signing_key(kid: str):
+    '''Creates a private key for signing and the matching public JWK'''
+
+    _, private = rsa.newkeys(1024)
+    private_pem = private.save_pkcs1().decode('utf-8')
+
+    public_jwk = jwk.construct(private_pem, 'RS256').public_key().to_dict()
+    public_jwk['kid'] = kid
+
+    return private_pem, public_jwk
+
+
+def make_token(private_pem: str, kid: str, **claims) -> str:
+
+    payload = {
+        'sub': 'user-1',
+        'aud': token.app_client_id,
+        'exp': int(time.time()) + 3600,
+    }
+    payload.update(claims)
+
+    return jwt.encode(payload, private_pem, algorithm='RS256', headers={'kid': kid})
+
+
+class TestKeyStore(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_pem, cls.public_jwk = make_signing_key('kid-1')
+        cls.other_pem, cls.other_jwk = make_signing_key('kid-2')
+
+    def setUp(self):
+
+        self.jwks_file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        json.dump({'keys': [self.public_jwk]}, self.jwks_file)
+        self.jwks_file.close()
+
+        self.store = token.KeyStore(token.keys_url, path=self.jwks_file.name)
+
+    def tearDown(self):
+        os.unlink(self.jwks_file.name)
+
+
+    def test_import_does_not_fetch(self):
+
+        self.assertIsNone(token.key_store.fetched_at)
+
+
+    def test_load_from_file_without_network(self):
+
+        with patch.object(token.urllib.request, 'urlopen', side_effect=AssertionError('network used')):
+            key = self.store.get('kid-1')
+
+        self.assertIsNotNone(key)
+
+
+    def test_constructed_key_is_memoised(self):
+
+        with patch.object(token.jwk, 'construct', wraps=token.jwk.construct) as construct:
+            first = self.store.get('kid-1')
+            second = self.store.get('kid-1')
+
+        self.assertIs(first, second)
+        self.assertEqual(1, construct.call_count)
+
+
+    def test_unknown_kid_triggers_refresh(self):
+
+        self.assertIsNone(self.store.get('kid-2'))
+
+        with open(self.jwks_file.name, 'w') as f:
+            json.dump({'keys': [self.public_jwk, self.other_jwk]}, f)
+
+        # refreshes are rate limited so unknown kids cannot force a fetch per request
+        self.assertIsNone(self.store.get('kid-2'))
+
+        self.store.last_attempt = 0
+        self.assertIsNotNone(self.store.get('kid-2'))
+
+
+    def test_expired_keys_are_refetched(self):
+
+        self.store.get('kid-1')
+
+        with patch.object(self.store, 'fetch', return_value=[self.public_jwk]) as fetch:
+            self.store.get('kid-1')
+            self.store.fetched_at -= self.store.ttl + 1
+            self.store.last_attempt -= self.store.ttl + 1
+            self.store.get('kid-1')
+
+        self.assertEqual(1, fetch.call_count)
+
+
+    def test_failed_refresh_keeps_keys(self):
+
+        self.store.get('kid-1')
+        self.store.fetched_at -= self.store.ttl + 1
+
+        with patch.object(self.store, 'fetch', side_effect=OSError('offline')):
+            self.assertIsNotNone(self.store.get('kid-1'))
+
+
+    def test_failed_refresh_not_retried_every_request(self):
+
+        self.store.get('kid-1')
+        self.store.fetched_at -= self.store.ttl + 1
+        self.store.last_attempt -= self.store.ttl + 1
+
+        with patch.object(self.store, 'fetch', side_effect=OSError('offline')) as fetch:
+            for _ in range(5):
+                self.assertIsNotNone(self.store.get('kid-1'))
+
+            self.assertEqual(1, fetch.call_count)
+
+            self.store.last_attempt -= self.store.min_refresh_interval + 1
+            self.store.get('kid-1')
+
+            self.assertEqual(2, fetch.call_count)
+
+
+    def test_validate_and_decode(self):
+
+        with patch.object(token, 'key_store', self.store), \
+                patch.object(token, 'token_cache', TTLCache()):
+
+            claims = token.validate_and_decode(make_token(self.private_pem, 'kid-1'))
+            self.assertEqual('user-1', claims['sub'])
+
+            forged = make_token(self.other_pem, 'kid-1')
+            self.assertIsNone(token.validate_and_decode(forged))
+
+
+class TestTokenCache(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_pem, cls.public_jwk = make_signing_key('kid-1')
+
+    def setUp(self):
+
+        self.store = token.KeyStore(token.keys_url)
+        self.store.load([self.public_jwk])
+        self.cache = TTLCache(max_size=2)
+
+        self.patches = [
+            patch.object(token, 'key_store', self.store),
+            patch.object(token, 'token_cache', self.cache),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+
+    def test_hit_skips_signature_verification(self):
+
+        id_token = make_token(self.private_pem, 'kid-1')
+
+        with patch.object(token, 'verify_signature', wraps=token.verify_signature) as verify:
+            token.validate_and_decode(id_token)
+            claims = token.validate_and_decode(id_token)
+
+        self.assertEqual('user-1', claims['sub'])
+        self.assertEqual(1, verify.call_count)
+
+
+    def test_hit_still_checks_expiry(self):
+
+        id_token = make_token(self.private_pem, 'kid-1')
+        self.assertIsNotNone(token.validate_and_decode(id_token))
+
+        with patch.object(token.time, 'time', return_value=time.time() + 7200):
+            self.assertIsNone(token.validate_and_decode(id_token))
+
+        self.assertEqual(0, len(self.cache))
+
+
+    def test_hit_still_checks_audience(self):
+
+        id_token = make_token(self.private_pem, 'kid-1', aud='another-client')
+
+        self.assertIsNone(token.validate_and_decode(id_token))
+        self.assertEqual(1, len(self.cache))
+        self.assertIsNone(token.validate_and_decode(id_token))
+
+
+    def test_cache_is_bounded(self):
+
+        for i in range(3):
+            token.validate_and_decode(make_token(self.private_pem, 'kid-1', sub=f'user-{i}'))
+
+        self.assertEqual(2, len(self.cache))
+
+
+    def test_invalid_signature_not_cached(self):
+
+        _, other_jwk = make_signing_key('kid-1')
+        self.store.load([other_jwk])
+
+        self.assertIsNone(token.validate_and_decode(make_token(self.private_pem, 'kid-1')))
+        self.assertEqual(0, len(self.cache))
@@ -16,6 +16,7 @@ sys.path.append(test_path)
 
 from services.users.user_service.entities import User
 from services.users.user_service.handler import handle, get_user_from_claims
+from user_service import routes
 
 
 class TestUserHanlder(BaseTestCase):
@@ -35,6 +36,11 @@ class TestUserHanlder(BaseTestCase):
 
         with open('tests/events/get-player-authd.json', 'r') as f:
             self.get_player_authd_event = json.load(f)  
+
+        with open('tests/events/get-players-authd.json', 'r') as f:
+            self.get_players_authd_event = json.load(f)
+
+        routes.profile_cache.clear()
             
              
     def test_get_user_from_event_clams(self):
@@ -97,6 +103,35 @@ class TestUserHanlder(BaseTestCase):
         self.assertEqual(result['email'], 'test@gmail.com')
 
     
+    def test_get_user_not_modified(self):
+
+        handle(self.create_user_authd_event, None)
+
+        response = handle(self.get_user_authd_event, None)
+        etag = response['headers']['ETag']
+
+        event = deepcopy(self.get_user_authd_event)
+        event['headers']['if-none-match'] = etag
+
+        response = handle(event, None)
+        self.assertEqual(s.NOT_MODIFIED, response['statusCode'])
+
+        user = User(id='04f19018-c27e-4097-b84c-49ed474d0134')
+        self.db.update_item(
+            Key=user.get_key(),
+            UpdateExpression='SET #n = :n ADD version :v',
+            ExpressionAttributeNames={'#n': 'name'},
+            ExpressionAttributeValues={':n': 'user-2', ':v': 1},
+        )
+
+        with patch.object(routes.db, 'get_item', wraps=routes.db.get_item) as get_item:
+            response = handle(event, None)
+
+        self.assertEqual(s.OK, response['statusCode'])
+        self.assertEqual('user-2', json.loads(response['body'])['name'])
+        self.assertEqual(1, get_item.call_count)
+
+
     def test_get_user_no_claims(self):
 
         result = handle(self.get_user_no_claims_event, None)
@@ -171,4 +206,63 @@ class TestUserHanlder(BaseTestCase):
         self.assertEqual(s.NOT_FOUND, response['statusCode'])
 
 
+    def create_players(self, n: int) -> list:
+
+        users = []
+
+        for i in range(n):
+
+            username = str(uuid.uuid4())
+            users.append(username)
+
+            event = self.replace_event_username(
+                self.create_user_authd_event,
+                username
+            )
+
+            response = handle(event, None)
+            self.assertEqual(s.CREATED, response['statusCode'])
+
+        return users
+
+
+    def test_get_players(self):
+
+        users = self.create_players(3)
+
+        event = self.replace_query_params(
+            self.get_players_authd_event,
+            'ids',
+            ','.join([users[2], 'not-a-player', users[0], users[2]])
+        )
+
+        with patch.object(routes.db_resource, 'batch_get_item', wraps=routes.db_resource.batch_get_item) as batch_get:
+            response = handle(event, None)
+            result = json.loads(response['body'])
+
+            self.assertEqual(s.OK, response['statusCode'])
+            self.assertEqual([users[2], users[0]], [p['id'] for p in result['players']])
+            self.assertEqual({'id', 'name'}, set(result['players'][0].keys()))
 
+            # profiles are now warm so only the unknown id is looked up
+            handle(event, None)
+
+        self.assertEqual(2, batch_get.call_count)
+        self.assertEqual(1, len(batch_get.call_args[1]['RequestItems'][routes.table]['Keys']))
+
+
+    def test_get_players_limit(self):
+
+        event = self.replace_query_params(
+            self.get_players_authd_event,
+            'ids',
+            ','.join(str(i) for i in range(routes.MAX_BATCH_PLAYERS + 1))
+        )
+
+        response = handle(event, None)
+        self.assertEqual(s.BAD_REQUEST, response['statusCode'])
+
+        event = self.replace_query_params(self.get_players_authd_event, 'ids', '')
+
+        response = handle(event, None)
+        self.assertEqual(s.BAD_REQUEST, response['statusCode'])